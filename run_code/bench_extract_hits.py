@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+bench_extract_hits.py
+对比 extract_hits 中逐关键词子串匹配（旧逻辑）与 KeywordMatcher 自动机的耗时，并校验两者结果一致。
+用法：python run_code/bench_extract_hits.py --dict date/keywords_expand.xlsx --annual_dir date
+"""
+
+import argparse
+import os
+import time
+
+from extract_hits import load_dict, split_sents, KeywordMatcher, match_naive
+
+def load_sents(annual_dir: str):
+    sents = []
+    for fn in sorted(os.listdir(annual_dir)):
+        if fn.lower().endswith(".txt"):
+            with open(os.path.join(annual_dir, fn), "r", encoding="utf-8", errors="ignore") as f:
+                sents.extend(split_sents(f.read()))
+    return sents
+
+def timed(fn, sents, repeat):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = [fn(s) for s in sents]
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dict", required=True, help="扩展关键词表路径")
+    ap.add_argument("--annual_dir", default="date", help="MD&A TXT 文件所在目录")
+    ap.add_argument("--repeat", type=int, default=5, help="重复次数（取最快一次）")
+    args = ap.parse_args()
+
+    catmap = load_dict(args.dict)
+    sents = load_sents(args.annual_dir)
+    n_words = sum(len(v) for v in catmap.values())
+    print(f"[INFO] 句子数 {len(sents)}，类别 {len(catmap)}，关键词 {n_words}")
+
+    t0 = time.perf_counter()
+    matcher = KeywordMatcher(catmap)
+    t_build = time.perf_counter() - t0
+
+    t_naive, ref = timed(lambda s: match_naive(s, catmap), sents, args.repeat)
+    t_ac, got = timed(matcher.match, sents, args.repeat)
+
+    if ref != got:
+        bad = sum(1 for a, b in zip(ref, got) if a != b)
+        print(f"[ERR] 结果不一致：{bad} 个句子的命中不同")
+    else:
+        print(f"[OK] 结果一致，命中句数 {sum(1 for r in got if r)}")
+    print(f"旧逻辑   : {t_naive:.4f}s  ({len(sents) / max(t_naive, 1e-9):,.0f} 句/秒)")
+    print(f"自动机   : {t_ac:.4f}s  ({len(sents) / max(t_ac, 1e-9):,.0f} 句/秒)，构建 {t_build * 1000:.1f}ms")
+    print(f"加速比   : {t_naive / max(t_ac, 1e-9):.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+bench_extract_mda.py
+extract_mda 章节定位的回归与性能对比：旧逻辑（split/join + 多次 find + 两次 re.sub）与 locate_mda 单次扫描。
+- 回归：对目录内年报及其扰动样本（CRLF、去除截断词、跨标题拼接等）和随机模糊样本，校验输出逐字节一致
+  （字节/mmap 路径以通用换行转换后的文本为参照）；
+- 性能：分别统计耗时与 tracemalloc 峰值内存。
+用法：python run_code/bench_extract_mda.py --in_dir date --fuzz 2000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from extract_mda import TITLE_KEYWORDS, NEXT_KEYWORDS, TOC_NEXT_CHARS, locate_mda, clean_mda
+
+def legacy_extract(text: str):
+    """extract_content 改写前的定位与清洗逻辑（参照实现）；未找到标题返回 None。"""
+    min_idx = sys.maxsize
+    topic = None
+    for t in TITLE_KEYWORDS:
+        pos = text.find(t)
+        if pos != -1:
+            nxt_ch = text[pos + len(t): pos + len(t) + 1]
+            if nxt_ch in TOC_NEXT_CHARS:
+                pos2 = text.find(t, pos + 1)
+                if pos2 != -1 and pos2 < min_idx:
+                    min_idx, topic = pos2, t
+            elif pos < min_idx:
+                min_idx, topic = pos, t
+    if not topic: return None
+
+    split_text = text.split(topic)
+    result = None
+    tail_blocks = split_text[1:]
+    for ind, j in enumerate(tail_blocks):
+        if len(j) > 0 and (j[:2] == ' \n' or j[0] in ['\n', ' ', '\t']):
+            result = ''.join(tail_blocks[ind+1:])
+            break
+    if result is None: result = ''.join(tail_blocks)
+
+    cut_points = [result.find(nt) for nt in NEXT_KEYWORDS if result.find(nt) != -1]
+    if not cut_points:
+        cut_points = [result.find(t) for t in TITLE_KEYWORDS if t != topic and result.find(t) != -1]
+    if cut_points:
+        end_idx = min(cut_points)
+        if end_idx > 0: result = result[:end_idx]
+
+    result = re.sub(r'[\r\n\t]', '', result)
+    result = re.sub(r'\s+', ' ', result).strip()
+    return result
+
+def new_extract(buf):
+    segs = locate_mda(buf)
+    if segs is None:
+        return None
+    if isinstance(buf, str):
+        return clean_mda(''.join(buf[a:b] for a, b in segs))
+    return clean_mda(b''.join(buf[a:b] for a, b in segs).decode('utf-8', errors='ignore'))
+
+def text_mode(case: str) -> str:
+    """模拟 open(..., 'r') 的通用换行转换：字节路径读到的原文对应的文本。"""
+    return case.replace('\r\n', '\n').replace('\r', '\n')
+
+def variants(text: str, rng: random.Random):
+    """由真实年报构造覆盖各分支的扰动样本。"""
+    yield 'orig', text
+    yield 'crlf', text.replace('\n', '\r\n')
+    no_next = text
+    for nt in NEXT_KEYWORDS:
+        no_next = no_next.replace(nt, '')
+    yield 'no_next', no_next
+    no_cut = no_next
+    for t in TITLE_KEYWORDS:
+        no_cut = no_cut.replace(t, t if t in text[:2000] else '')
+    yield 'no_cut', no_cut
+    for t in TITLE_KEYWORDS:
+        if t in text:
+            yield 'span', text.replace('重要事项', '重要' + t + '事项', 1)
+            yield 'toc', text.replace(t, t + '》', 1)
+            break
+    for _ in range(3):
+        k = rng.randrange(len(text))
+        yield 'trunc', text[:k]
+
+def fuzz_text(rng: random.Random, n: int = 400):
+    atoms = TITLE_KEYWORDS + NEXT_KEYWORDS + TOC_NEXT_CHARS + ['\n', ' ', '\t', '\r', '　', '重要', '事项', '正文', 'a', '  \n']
+    return ''.join(rng.choice(atoms) for _ in range(rng.randint(0, n)))
+
+def measure(fn, arg):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn(arg)
+    dt = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, dt, peak
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", default="date", help="年报 TXT 目录（回归集）")
+    ap.add_argument("--fuzz", type=int, default=1000, help="随机模糊样本数")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    bad = 0
+    n_cases = 0
+    t_old = t_new = 0.0
+    peak_old = peak_new = 0
+    for fn in sorted(os.listdir(args.in_dir)):
+        if not fn.lower().endswith('.txt'):
+            continue
+        with open(os.path.join(args.in_dir, fn), 'rb') as f:
+            text = f.read().decode('utf-8', errors='ignore')
+        for name, case in variants(text, rng):
+            n_cases += 1
+            ref, dt0, pk0 = measure(legacy_extract, case)
+            got, dt1, pk1 = measure(new_extract, case)
+            got_b = new_extract(case.encode('utf-8'))
+            t_old += dt0; t_new += dt1
+            peak_old = max(peak_old, pk0); peak_new = max(peak_new, pk1)
+            if not (ref == got and legacy_extract(text_mode(case)) == got_b):
+                bad += 1
+                print(f"[ERR] 不一致：{fn} / {name}")
+
+    for i in range(args.fuzz):
+        case = fuzz_text(rng)
+        if not (legacy_extract(case) == new_extract(case)
+                and legacy_extract(text_mode(case)) == new_extract(case.encode('utf-8'))):
+            bad += 1
+            if bad <= 5:
+                print(f"[ERR] 模糊样本 {i} 不一致：{case!r}")
+
+    print(f"[INFO] 回归样本 {n_cases} 个，模糊样本 {args.fuzz} 个，不一致 {bad} 个")
+    if n_cases:
+        print(f"旧逻辑   : 总耗时 {t_old:.4f}s，峰值内存 {peak_old / 2**20:.2f} MiB")
+        print(f"单次扫描 : 总耗时 {t_new:.4f}s，峰值内存 {peak_new / 2**20:.2f} MiB")
+        print(f"加速比   : {t_old / max(t_new, 1e-9):.2f}x")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+bench_finbert.py
+finbert_infer 的 CPU 吞吐基准：与逐句推理（每句单独分词、单独前向）对比，报告各配置的 句/秒、加速比、
+补齐有效率，以及与逐句结果的标签一致率和最大概率差（量化后的精度损失）。
+配置：
+- naive：逐句推理（torch fp32），只跑前 --naive_n 句；
+- padmax：按原顺序分批、补齐到 max_length（常见写法，无分桶）；
+- bucket：长度分桶 + 动态补齐（torch fp32）；
+- bucket-int8：同上，torch int8 动态量化；
+- onnx / onnx-int8：onnxruntime（未安装时跳过）。
+用法：python run_code/bench_finbert.py --model models/FinBERT2 --input climaterisk_final_sample.csv --n 5000 --threads 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from finbert_infer import (configure_threads, load_tokenizer, tokenize, length_buckets, padding_efficiency,
+                           pad_batch, predict, softmax, make_backend)
+from bench_near_dup import make_corpus
+from metrics import peak_rss_mb
+
+CONFIGS = ["naive", "padmax", "bucket", "bucket-int8", "onnx", "onnx-int8"]
+
+def load_texts(path, column, n, seed):
+    if path:
+        s = pd.read_csv(path, encoding="utf-8-sig", usecols=[column])[column].dropna().astype(str)
+        return s.sample(n=min(n, len(s)), random_state=seed).tolist()
+    print("[WARN] 未指定 --input，使用合成句子（长度分布与真实年报句子不同）")
+    return make_corpus(n, seed=seed)[0]
+
+def run_naive(texts, tokenizer, spec):
+    backend = make_backend(spec)
+    backend(*pad_batch(tokenize(tokenizer, texts[:1], spec["max_length"])))  # 预热
+    t0 = time.perf_counter()
+    probs = []
+    for t in texts:
+        enc = tokenizer(t, truncation=True, max_length=spec["max_length"], return_tensors="np")
+        probs.append(softmax(backend(enc["input_ids"].astype(np.int64), enc["attention_mask"].astype(np.int64))))
+    return np.vstack(probs), time.perf_counter() - t0
+
+def run_batched(texts, tokenizer, spec, args, bucket):
+    # 预热（加载模型 / 导出 ONNX 不计入耗时）
+    predict(tokenize(tokenizer, texts[:8], spec["max_length"]), spec, tokenizer.pad_token_id or 0,
+            args.batch_size, args.max_tokens, 1, bucket, progress=False)
+    t0 = time.perf_counter()
+    ids = tokenize(tokenizer, texts, spec["max_length"])
+    probs = predict(ids, spec, tokenizer.pad_token_id or 0, args.batch_size, args.max_tokens,
+                    args.workers, bucket, progress=False)
+    elapsed = time.perf_counter() - t0
+    lengths = [len(s) for s in ids]
+    if bucket:
+        eff = padding_efficiency(lengths, length_buckets(lengths, args.batch_size, args.max_tokens))
+    else:
+        eff = padding_efficiency(lengths, length_buckets(lengths, args.batch_size, 1 << 62, sort=False),
+                                 spec["max_length"])
+    return probs, elapsed, eff
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", required=True, help="FinBERT 分类模型目录")
+    ap.add_argument("--input", default="", help="句子 CSV（默认使用合成句子）")
+    ap.add_argument("--column", default="句子", help="句子列名")
+    ap.add_argument("--n", type=int, default=5000, help="批量配置的句子数")
+    ap.add_argument("--naive_n", type=int, default=300, help="逐句基线的句子数（取前 N 句）")
+    ap.add_argument("--configs", nargs="+", default=CONFIGS, choices=CONFIGS, help="要测试的配置")
+    ap.add_argument("--threads", type=int, default=4, help="每个进程的推理线程数")
+    ap.add_argument("--workers", type=int, default=1, help="批量配置的推理进程数（>1 时含子进程加载模型的耗时）")
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--max_tokens", type=int, default=8192)
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    configure_threads(args.threads)
+    texts = load_texts(args.input, args.column, args.n, args.seed)
+    tokenizer = load_tokenizer(args.model)
+    print(f"[INFO] {len(texts)} 句，{args.threads} 线程 × {args.workers} 进程，batch_size {args.batch_size}，"
+          f"max_tokens {args.max_tokens}，max_length {args.max_length}")
+
+    def spec_for(backend, quantize):
+        return {"backend": backend, "model": args.model, "quantize": quantize, "threads": args.threads,
+                "interop_threads": 1, "max_length": args.max_length}
+
+    # 逐句基线始终运行：加速比与一致率都以它为准
+    ref, t = run_naive(texts[:args.naive_n], tokenizer, spec_for("torch", False))
+    ref_rate = len(ref) / t
+    print(f"{'naive':<12} | {ref_rate:9.1f} 句/秒 | 加速 {1.0:6.2f}x | 补齐有效率 {1.0:6.1%} | "
+          f"一致率 {1.0:6.1%}  最大概率差 {0.0:.4f} | 峰值内存 {peak_rss_mb():,.0f} MB")
+
+    for name in args.configs:
+        if name == "naive":
+            continue
+        backend = "onnx" if name.startswith("onnx") else "torch"
+        if backend == "onnx":
+            try:
+                import onnxruntime  # noqa: F401
+            except ImportError:
+                print(f"[WARN] 未安装 onnxruntime，跳过 {name}")
+                continue
+        spec = spec_for(backend, name.endswith("int8"))
+        probs, t, eff = run_batched(texts, tokenizer, spec, args, bucket=(name != "padmax"))
+        rate = len(texts) / t
+        m = len(ref)
+        agree = float((probs[:m].argmax(1) == ref.argmax(1)).mean())
+        diff = float(np.abs(probs[:m] - ref).max())
+        print(f"{name:<12} | {rate:9.1f} 句/秒 | 加速 {rate / ref_rate:6.2f}x | 补齐有效率 {eff:6.1%} | "
+              f"一致率 {agree:6.1%}  最大概率差 {diff:.4f} | 峰值内存 {peak_rss_mb():,.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+bench_near_dup.py
+near_dup 近似重复聚类的规模与质量基准：按规模生成合成句子（随机句 + 带公司化改动的模板句家族），
+报告签名/分桶耗时、吞吐、峰值内存、节省的推理次数，并抽样核对：
+- 精度：被合并到代表句的成员中，真实 shingle Jaccard ≥ 阈值的比例；
+- 召回：模板句家族中与家族首句真实 Jaccard ≥ 阈值的成员，被聚到同一簇的比例。
+运行前先核对边界情况（空句 / NaN 出现在批次末尾或中间、整批为空句），不符时以退出码 1 结束。
+用法：python run_code/bench_near_dup.py --sizes 10000 100000 1000000 --threshold 0.8
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from metrics import peak_rss_mb
+from near_dup import (minhash_signatures, cluster_signatures, cluster_stats, lsh_params, shingle_text,
+                      cluster_near_duplicates)
+
+CHARS = "气候风险碳排放转型公司经营成本洪涝干旱损失研发绿色低碳能源光伏储能政策监管市场需求供应链资产减值治理目标投入极端天气"
+SLOGANS = [
+    "公司积极响应国家双碳号召，坚持绿色低碳高质量发展道路，持续推进节能减排工作",
+    "报告期内公司高度重视气候变化带来的风险与机遇，将应对气候变化纳入公司发展战略",
+    "极端天气事件频发可能对公司生产经营造成不利影响，公司已制定相应的应急预案",
+    "公司严格遵守国家环境保护相关法律法规，报告期内未发生重大环境污染事故",
+]
+
+def make_corpus(n, dup_ratio=0.3, seed=0):
+    """返回 (句子列表, 家族编号数组)；家族编号 -1 表示随机句。"""
+    rng = random.Random(seed)
+    texts, family = [], []
+    n_fam = max(1, n // 500)
+    bases = [rng.choice(SLOGANS) for _ in range(n_fam)]
+    for f in range(n_fam):
+        # 每个家族在模板上做一处固定改写，使各家族互不相同
+        b = list(bases[f])
+        b[rng.randrange(len(b))] = rng.choice(CHARS)
+        bases[f] = "".join(b) + "".join(rng.choices(CHARS, k=6))
+    for i in range(n):
+        if rng.random() < dup_ratio:
+            f = rng.randrange(n_fam)
+            s = bases[f]
+            # 公司化改动：替换公司名、年份和一两个字
+            s = f"{rng.choice(['本公司', '公司', '集团', '我司'])}{s[2:]}"
+            s = s.replace("报告期内", f"{rng.randint(2014, 2024)}年")
+            if rng.random() < 0.5:
+                j = rng.randrange(len(s))
+                s = s[:j] + rng.choice(CHARS) + s[j + 1:]
+            texts.append(s)
+            family.append(f)
+        else:
+            texts.append("".join(rng.choices(CHARS, k=rng.randint(20, 80))))
+            family.append(-1)
+    return texts, np.array(family)
+
+def shingles(t, k=3):
+    t = shingle_text(t)
+    return {t[i:i + k] for i in range(max(len(t) - k + 1, 1))}
+
+def jaccard(a, b):
+    A, B = shingles(a), shingles(b)
+    return len(A & B) / max(len(A | B), 1)
+
+# (句子列表, 期望的代表行号)：空句与 NaN 视为同一句，不与非空句合并
+EDGE_CASES = [
+    (["积极响应双碳号召", ""], [0, 1]),
+    (["积极响应双碳号召", float("nan")], [0, 1]),
+    (["", "积极响应双碳号召", None, "积极响应双碳号召"], [0, 1, 0, 1]),
+    ([""], [0]),
+    (["", ""], [0, 0]),
+]
+
+def check_edge_cases():
+    """边界情况回归核对，返回不符的用例列表。"""
+    bad = []
+    for texts, want in EDGE_CASES:
+        try:
+            got = cluster_near_duplicates(texts).tolist()
+        except Exception as e:
+            got = f"{type(e).__name__}: {e}"
+        if got != want:
+            bad.append((texts, want, got))
+    return bad
+
+def run(n, threshold, num_perm, check, seed):
+    texts, family = make_corpus(n, seed=seed)
+    t0 = time.perf_counter()
+    sig = minhash_signatures(texts, num_perm=num_perm)
+    t_sig = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rep = cluster_signatures(sig, threshold)
+    t_lsh = time.perf_counter() - t0
+    st = cluster_stats(rep)
+
+    rng = random.Random(seed + 1)
+    merged = np.flatnonzero(rep != np.arange(n))
+    sample = rng.sample(list(merged), min(check, len(merged)))
+    precision = np.mean([jaccard(texts[i], texts[rep[i]]) >= threshold for i in sample]) if sample else 1.0
+    pairs = []
+    for f in rng.sample(sorted(set(family[family >= 0].tolist())), min(50, len(set(family.tolist())) - 1)):
+        members = np.flatnonzero(family == f)
+        head = members[0]
+        pairs += [(head, m) for m in members[1:20] if jaccard(texts[head], texts[m]) >= threshold]
+    recall = np.mean([rep[a] == rep[b] for a, b in pairs]) if pairs else 1.0
+
+    total = t_sig + t_lsh
+    print(f"{n:>9,} 句 | 签名 {t_sig:7.2f}s  分桶 {t_lsh:6.2f}s  合计 {total:7.2f}s ({n / total:,.0f} 句/秒) | "
+          f"簇 {st['clusters']:,}  节省 {st['saved_calls']:,} ({st['saved_calls'] / n:.1%}) | "
+          f"精度 {precision:.3f}  召回 {recall:.3f} | 峰值内存 {peak_rss_mb():,.0f} MB")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="句子规模")
+    ap.add_argument("--threshold", type=float, default=0.8, help="Jaccard 阈值")
+    ap.add_argument("--num_perm", type=int, default=128, help="MinHash 排列数")
+    ap.add_argument("--check", type=int, default=2000, help="抽样核对精度的合并句数")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    bad = check_edge_cases()
+    for texts, want, got in bad:
+        print(f"[ERR] 边界情况 {texts!r}：期望 {want}，实际 {got}")
+    if bad:
+        raise SystemExit(1)
+    print(f"[OK] 边界情况 {len(EDGE_CASES)} 项通过")
+    print(f"[INFO] 阈值 {args.threshold}，排列数 {args.num_perm}，bands×rows = {lsh_params(args.threshold, args.num_perm)}")
+    for n in args.sizes:
+        run(n, args.threshold, args.num_perm, args.check, args.seed)
+
+if __name__ == "__main__":
+    main()
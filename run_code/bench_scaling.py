@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+bench_scaling.py
+规模基准：用 make_reports 生成 1× / 10× / 100× 的合成年报语料，分别测试各环节的吞吐与内存，并与保存的基线对比。
+环节：
+- extract：extract_content 逐文件提取 MD&A（文件/秒、MB/秒），并核对提取的句数与 synth_manifest.json 的 mda_sents；
+- split：split_sents 切分提取结果（句/秒）；
+- scan：scan_dir 切句 + 关键词匹配（句/秒）；
+- expand：expand_for_seed 逐个种子检索近义词（种子/秒），词表规模 = --vocab × 倍数（合成词向量）；
+- expand_all：expand_all 批量检索，作为 expand 的对照。
+每个（环节, 倍数）在新的子进程中运行，峰值内存互不影响；语料按参数缓存在 --work 下，参数不变时直接复用。
+结果写入 --results_dir/scaling_<时间>.json；--baseline 存在时逐项对比，吞吐下降或内存上升超过 --tolerance 记为回归并以退出码 1 结束；
+提取句数与语料不符时同样以退出码 1 结束（此时吞吐数字没有意义）。
+用法：
+    python run_code/bench_scaling.py --base 50 --scales 1 10 100
+    python run_code/bench_scaling.py --scales 1 10 --update_baseline   # 以本次结果作为新基线
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from make_reports import generate, load_keywords, KEYWORDS_FILE, LAYOUT_VERSION
+from metrics import peak_rss_mb
+
+STAGES = ["extract", "split", "scan", "expand", "expand_all"]
+YEAR = "2024"
+# 内存回归至少要增加这么多才报告，避免小规模时的噪声
+MIN_RSS_DELTA_MB = 32
+
+# ================= 语料 =================
+def corpus_params(args, scale):
+    return {"n": args.base * scale, "years": [YEAR], "seed": args.seed, "density": args.density,
+            "mda_sents": args.mda_sents, "missing": 0.02, "pool_size": 4000, "layout": LAYOUT_VERSION}
+
+def ensure_corpus(work, args, scale):
+    """生成（或复用）某一倍数的语料，返回目录。参数与缓存的 synth_manifest.json 一致时不重新生成。"""
+    d = os.path.join(work, f"x{scale}")
+    params = corpus_params(args, scale)
+    mpath = os.path.join(d, "corpus", "synth_manifest.json")
+    if os.path.exists(mpath):
+        with open(mpath, "r", encoding="utf-8") as f:
+            if json.load(f).get("params") == params:
+                return d
+    shutil.rmtree(d, ignore_errors=True)
+    t0 = time.perf_counter()
+    generate(os.path.join(d, "corpus"), params["n"], params["years"], params["seed"], params["density"],
+             params["mda_sents"], params["missing"], progress=False)
+    print(f"[INFO] 生成 {scale}× 语料（{params['n']} 份）耗时 {time.perf_counter() - t0:.1f}s")
+    return d
+
+def year_dirs(d, sub):
+    root = os.path.join(d, sub)
+    return [os.path.join(root, n) for n in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, n))]
+
+def list_files(dirs):
+    return [os.path.join(x, n) for x in dirs for n in sorted(os.listdir(x)) if n.endswith(".txt")]
+
+def corpus_mda_sents(d):
+    with open(os.path.join(d, "corpus", "synth_manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)["stats"]["mda_sents"]
+
+def count_mda_sents(files):
+    """提取结果中的句数：make_reports 生成的 MD&A 句子均以“。”或“；”结尾，页眉页码不含这两个符号。"""
+    n = 0
+    for fp in files:
+        with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        n += text.count("。") + text.count("；")
+    return n
+
+# ================= 各环节（在子进程中运行） =================
+def bench_extract(d, args, scale=1):
+    from extract_mda import extract_content
+    files = list_files(year_dirs(d, "corpus"))
+    out_root = os.path.join(d, "mda")
+    shutil.rmtree(out_root, ignore_errors=True)
+    t0 = time.perf_counter()
+    status = [extract_content(fp, os.path.join(out_root, os.path.basename(os.path.dirname(fp)))) for fp in files]
+    dt = time.perf_counter() - t0
+    return {"items": len(files), "unit": "文件", "bytes": sum(os.path.getsize(f) for f in files), "seconds": dt,
+            "ok": status.count("ok"), "skip": status.count("skip"), "fail": status.count("fail"),
+            "mda_sents": count_mda_sents(list_files(year_dirs(d, "mda")))}
+
+def _mda_files(d, args):
+    if not os.path.isdir(os.path.join(d, "mda")):
+        bench_extract(d, args)
+    return list_files(year_dirs(d, "mda"))
+
+def bench_split(d, args, scale=1):
+    from extract_hits import split_sents
+    files = _mda_files(d, args)
+    t0 = time.perf_counter()
+    n = 0
+    for fp in files:
+        with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+            n += len(split_sents(f.read()))
+    dt = time.perf_counter() - t0
+    return {"items": n, "unit": "句", "bytes": sum(os.path.getsize(f) for f in files), "seconds": dt}
+
+def bench_scan(d, args, scale=1):
+    from extract_hits import scan_dir, split_sents, KeywordMatcher
+    files = _mda_files(d, args)
+    catmap = {k: set(v) for k, v in load_keywords(args.keywords).items()}
+    matcher = KeywordMatcher(catmap)
+    t0 = time.perf_counter()
+    rows = []
+    for x in year_dirs(d, "mda"):
+        rows.extend(scan_dir(x, catmap, matcher))
+    dt = time.perf_counter() - t0
+    n = 0
+    for fp in files:
+        with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+            n += len(split_sents(f.read()))
+    hit_sents = len({(r["文件名"], r["句序"]) for r in rows})
+    return {"items": n, "unit": "句", "bytes": sum(os.path.getsize(f) for f in files), "seconds": dt,
+            "hits": len(rows), "hit_rate": round(hit_sents / max(n, 1), 4)}
+
+def make_vectors(n, dim, words, seed=0):
+    """合成词向量：种子词及其“近义词”围绕同一中心，其余为聚类随机向量。"""
+    from gensim.models import KeyedVectors
+    rng = np.random.default_rng(seed)
+    keys, vecs = [], []
+    for i, w in enumerate(words):
+        c = rng.normal(size=dim)
+        keys.append(w)
+        vecs.append(c)
+        for j in range(5):
+            keys.append(f"{w}相关{j}")
+            vecs.append(c + 0.3 * rng.normal(size=dim))
+    n_rest = max(0, n - len(keys))
+    cent = rng.normal(size=(max(1, n_rest // 200), dim))
+    rest = cent[rng.integers(0, len(cent), n_rest)] + 0.5 * rng.normal(size=(n_rest, dim))
+    kv = KeyedVectors(dim)
+    kv.add_vectors(keys + [f"词{i}" for i in range(n_rest)],
+                   np.vstack([np.asarray(vecs), rest]).astype(np.float32))
+    return kv
+
+def _seed_words(args):
+    return sorted({w for ws in load_keywords(args.keywords).values() for w in ws})
+
+def bench_expand(d, args, scale):
+    from keyword_expand_w2v import expand_for_seed
+    words = _seed_words(args)
+    kv = make_vectors(args.vocab * scale, args.dim, words, args.seed)
+    expand_for_seed(kv, words[0], topn=args.topn)  # 预热（计算范数）
+    t0 = time.perf_counter()
+    out = {w: expand_for_seed(kv, w, topn=args.topn) for w in words}
+    dt = time.perf_counter() - t0
+    return {"items": len(words), "unit": "种子", "vocab": len(kv.index_to_key), "seconds": dt,
+            "expanded": sum(len(v) for v in out.values())}
+
+def bench_expand_all(d, args, scale):
+    from keyword_expand_w2v import expand_all
+    words = _seed_words(args)
+    kv = make_vectors(args.vocab * scale, args.dim, words, args.seed)
+    kv.fill_norms()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 不打印 expand_all 的检索日志
+        out = expand_all(kv, words, topn=args.topn)
+    dt = time.perf_counter() - t0
+    return {"items": len(words), "unit": "种子", "vocab": len(kv.index_to_key), "seconds": dt,
+            "expanded": sum(len(v) for v in out.values())}
+
+def _measure(stage, d, args, scale):
+    """子进程入口：运行一个环节（取 --repeat 次中最快的一次），附上峰值内存。"""
+    rss0 = peak_rss_mb()
+    fn = {"extract": bench_extract, "split": bench_split, "scan": bench_scan, "expand": bench_expand,
+          "expand_all": bench_expand_all}[stage]
+    best = None
+    for _ in range(args.repeat):
+        r = fn(d, args, scale)
+        if best is None or r["seconds"] < best["seconds"]:
+            best = r
+    best["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    best["start_rss_mb"] = round(rss0, 1)
+    return best
+
+# ================= 汇总与对比 =================
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def row_key(r):
+    return f"{r['stage']}@{r['scale']}x"
+
+def compare(results, baseline, tolerance):
+    """逐项对比吞吐与峰值内存，返回回归列表。"""
+    base = {row_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\n📊 与基线对比（{baseline.get('meta', {}).get('time', '?')}，commit {baseline.get('meta', {}).get('commit') or '?'}）：")
+    for r in results:
+        b = base.get(row_key(r))
+        if not b:
+            print(f"  {row_key(r):<16} 基线中无此项")
+            continue
+        speed = r["items_per_s"] / max(b["items_per_s"], 1e-9)
+        mem = r["peak_rss_mb"] - b["peak_rss_mb"]
+        flags = []
+        if speed < 1 - tolerance:
+            flags.append("吞吐回归")
+        if mem > max(MIN_RSS_DELTA_MB, b["peak_rss_mb"] * tolerance):
+            flags.append("内存回归")
+        print(f"  {row_key(r):<16} 吞吐 {speed:6.2f}x  峰值内存 {mem:+8.1f} MB  {'❌ ' + '、'.join(flags) if flags else '✅'}")
+        if flags:
+            regressions.append((row_key(r), flags))
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work", default="bench_work", help="合成语料与中间结果目录")
+    ap.add_argument("--results_dir", default="bench_results", help="结果 JSON 目录")
+    ap.add_argument("--baseline", default="", help="基线 JSON（默认 <results_dir>/scaling_baseline.json）")
+    ap.add_argument("--update_baseline", action="store_true", help="以本次结果覆盖基线")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="吞吐下降 / 内存上升的容忍比例")
+    ap.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="要测试的环节")
+    ap.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="语料倍数")
+    ap.add_argument("--base", type=int, default=50, help="1× 的年报份数")
+    ap.add_argument("--mda_sents", type=int, default=300, help="每份 MD&A 的平均句数")
+    ap.add_argument("--density", type=float, default=0.03, help="MD&A 中含关键词句子的比例")
+    ap.add_argument("--vocab", type=int, default=5000, help="1× 的词向量词表规模")
+    ap.add_argument("--dim", type=int, default=100, help="词向量维度")
+    ap.add_argument("--topn", type=int, default=10)
+    ap.add_argument("--keywords", default=KEYWORDS_FILE, help="种子词表 keywords.json")
+    ap.add_argument("--repeat", type=int, default=3, help="每项重复次数（取最快一次）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    args.baseline = args.baseline or os.path.join(args.results_dir, "scaling_baseline.json")
+
+    ctx = multiprocessing.get_context("spawn")
+    results, mismatches = [], []
+    print(f"{'环节':<10} {'倍数':>5} | {'数量':>10} | {'耗时':>9} | {'吞吐':>16} | {'MB/秒':>8} | {'峰值内存':>10}")
+    for scale in sorted(args.scales):
+        d = ensure_corpus(args.work, args, scale)
+        for stage in [s for s in STAGES if s in args.stages]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+                r = ex.submit(_measure, stage, d, args, scale).result()
+            r.update(stage=stage, scale=scale, items_per_s=r["items"] / max(r["seconds"], 1e-9))
+            if "bytes" in r:
+                r["mb_per_s"] = r["bytes"] / 2**20 / max(r["seconds"], 1e-9)
+            if stage == "extract":
+                r["expected_mda_sents"] = corpus_mda_sents(d)
+                if r["mda_sents"] != r["expected_mda_sents"]:
+                    mismatches.append(f"{scale}×")
+                    print(f"[ERR] {scale}× 提取句数 {r['mda_sents']:,} 与语料 mda_sents {r['expected_mda_sents']:,} 不符")
+            results.append(r)
+            mbs = f"{r['mb_per_s']:8.1f}" if "mb_per_s" in r else f"{'-':>8}"
+            print(f"{stage:<10} {scale:>4}× | {r['items']:>10,} | {r['seconds']:8.3f}s | "
+                  f"{r['items_per_s']:>12,.0f} {r['unit']}/秒 | {mbs} | {r['peak_rss_mb']:>7,.0f} MB")
+
+    meta = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "params": {k: getattr(args, k) for k in ("base", "mda_sents", "density", "vocab", "dim", "topn", "seed",
+                                                       "repeat")}}
+    os.makedirs(args.results_dir, exist_ok=True)
+    out_path = os.path.join(args.results_dir, f"scaling_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    report = {"meta": meta, "results": results}
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n[OK] 结果已保存：{out_path}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("params") != meta["params"]:
+            print(f"[WARN] 基线的语料/检索参数与本次不同（{baseline.get('meta', {}).get('params')}），跳过对比；"
+                  f"可用 --update_baseline 重建基线")
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+    else:
+        shutil.copyfile(out_path, args.baseline)
+        print(f"[OK] 已写入基线：{args.baseline}")
+
+    if mismatches:
+        print(f"[ERR] 提取句数与语料不符：{mismatches}")
+    if regressions:
+        print(f"[ERR] {len(regressions)} 项回归（容忍 {args.tolerance:.0%}）：{[k for k, _ in regressions]}")
+    if mismatches or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
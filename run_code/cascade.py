@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+cascade.py
+置信度路由的级联标注：先用本地模型给全部句子打标签，只有置信度低于阈值、或与词典信号矛盾的句子才请求 DeepSeek。
+- 本地模型：ngram（字符 1~3 gram 哈希特征 + 多类逻辑回归，用已有的 LLM_Label 结果训练）
+  或 finbert（finbert_infer 的输出：预先生成的 risk_Finbert_labeled.csv，或指定 --finbert_model 现场推理）；
+- 词典信号：命中的二级分类隐含方向（物理风险 -> 暴露，气候机遇 -> 防范），本地标签与之方向相反时交给 LLM
+  （本地判为不相关不算矛盾：含关键词的口号句很常见）；
+- 路由到 LLM 的句子复用 llm_analysis.label_rows（断点日志、缓存、并发限速）；
+- 报告免调用比例；给定全量 LLM 标注（--reference）时报告与全量 LLM 的一致率，并按阈值扫描 覆盖率 / 一致率。
+输出与 climaterisk_LLM_Full_Labeled.csv 同列，另加 标注来源 / 本地标签 / 本地置信度。
+用法：
+    python run_code/cascade.py --train climaterisk_LLM_Full_Labeled.csv --local_model cascade_ngram.npz
+    python run_code/cascade.py --local_model cascade_ngram.npz --reference climaterisk_LLM_Full_Labeled.csv --dry_run
+    python run_code/cascade.py --local_model cascade_ngram.npz --threshold 0.9 --async --concurrency 16
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from near_dup import _shingle_hashes, shingle_text
+
+# ================= ⚙️ 配置区域 =================
+INPUT_FILE = r'E:\projects\risk-pipeline\data\output\climaterisk_final_sample.csv'
+OUTPUT_FILE = r'E:\projects\risk-pipeline\data\output\climaterisk_Cascade_Labeled.csv'
+CHECKPOINT_FILE = r'E:\projects\risk-pipeline\data\output\cascade_journal.jsonl'
+LOCAL_MODEL = r'E:\projects\risk-pipeline\data\output\cascade_ngram.npz'
+
+# LLM 标签：-1 暴露 / 0 不相关 / 1 防范
+CLASSES = np.array([-1, 0, 1])
+FINBERT_LABELS = {"暴露": -1, "防范": 1}
+# 二级分类隐含的方向；转型风险两种方向都常见，不作判断
+DICT_PRIOR = {"物理风险": -1, "气候机遇": 1}
+SWEEP = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98]
+
+# ================= 本地模型：字符 n-gram 逻辑回归 =================
+def featurize(texts, dim=1 << 18, ngrams=(1, 2, 3), batch=20000):
+    """字符 n-gram 哈希特征（log1p 词频，行 L2 归一化），返回 CSR 稀疏矩阵 (句子数, dim)。"""
+    from scipy import sparse
+    blocks = []
+    for lo in range(0, len(texts), batch):
+        chunk = [shingle_text(t) for t in texts[lo:lo + batch]]
+        rows, cols = [], []
+        for k in ngrams:
+            h, first = _shingle_hashes(chunk, k)
+            n_sh = np.diff(np.append(first, len(h)))
+            rows.append(np.repeat(np.arange(len(chunk)), n_sh))
+            cols.append((h % np.uint64(dim)).astype(np.int64))
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        X = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(chunk), dim))
+        X.data = np.log1p(X.data)
+        norm = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        blocks.append(sparse.diags(1.0 / np.maximum(norm, 1e-12)) @ X)
+    return sparse.vstack(blocks).tocsr() if blocks else sparse.csr_matrix((0, dim), dtype=np.float32)
+
+class NgramClassifier:
+    """多类逻辑回归（L-BFGS，L2 正则）；输出概率作为路由置信度。"""
+
+    def __init__(self, dim=1 << 18, ngrams=(1, 2, 3), l2=1e-5):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.l2 = l2
+        self.W = None
+        self.b = None
+
+    def fit(self, texts, labels, max_iter=300):
+        from scipy.optimize import minimize
+        X = featurize(texts, self.dim, self.ngrams)
+        y = np.searchsorted(CLASSES, np.asarray(labels))
+        Y = np.eye(len(CLASSES))[y]
+        n, c = X.shape[0], len(CLASSES)
+
+        def loss(theta):
+            W = theta[:-c].reshape(self.dim, c)
+            b = theta[-c:]
+            Z = X @ W + b
+            Z -= Z.max(axis=1, keepdims=True)
+            logp = Z - np.log(np.exp(Z).sum(axis=1, keepdims=True))
+            P = np.exp(logp)
+            f = -(Y * logp).sum() / n + 0.5 * self.l2 * (W * W).sum()
+            gW = X.T @ (P - Y) / n + self.l2 * W
+            gb = (P - Y).sum(axis=0) / n
+            return f, np.concatenate([np.asarray(gW).ravel(), gb])
+
+        res = minimize(loss, np.zeros(self.dim * c + c), jac=True, method="L-BFGS-B",
+                       options={"maxiter": max_iter})
+        self.W = res.x[:-c].reshape(self.dim, c).astype(np.float32)
+        self.b = res.x[-c:].astype(np.float32)
+        return self
+
+    def predict_proba(self, texts):
+        Z = featurize(texts, self.dim, self.ngrams) @ self.W + self.b
+        Z -= Z.max(axis=1, keepdims=True)
+        P = np.exp(Z)
+        return P / P.sum(axis=1, keepdims=True)
+
+    def save(self, path):
+        np.savez_compressed(path, W=self.W, b=self.b, dim=self.dim, ngrams=np.array(self.ngrams), l2=self.l2)
+
+    @classmethod
+    def load(cls, path):
+        z = np.load(path)
+        m = cls(int(z["dim"]), tuple(int(k) for k in z["ngrams"]), float(z["l2"]))
+        m.W, m.b = z["W"], z["b"]
+        return m
+
+def read_labeled(paths):
+    """读取已有的 LLM 标注结果，返回 (句子列表, 标签数组)；无效标签的行丢弃。"""
+    df = pd.concat([pd.read_csv(p, encoding="utf-8-sig", usecols=["句子", "LLM_Label"]) for p in paths])
+    lab = pd.to_numeric(df["LLM_Label"], errors="coerce")
+    df = df[lab.isin(CLASSES)]
+    return df["句子"].astype(str).tolist(), lab[lab.isin(CLASSES)].astype(int).to_numpy()
+
+def train(paths, model_path, holdout=0.2, seed=42):
+    texts, labels = read_labeled(paths)
+    print(f"[INFO] 训练样本 {len(texts)} 条，标签分布 {dict(zip(*np.unique(labels, return_counts=True)))}")
+    idx = np.random.default_rng(seed).permutation(len(texts))
+    n_test = int(len(texts) * holdout)
+    if n_test:
+        te, tr = idx[:n_test], idx[n_test:]
+        t0 = time.time()
+        m = NgramClassifier().fit([texts[i] for i in tr], labels[tr])
+        P = m.predict_proba([texts[i] for i in te])
+        print(f"[INFO] 留出集 {n_test} 条（训练 {time.time() - t0:.1f}s），整体一致率 "
+              f"{(CLASSES[P.argmax(1)] == labels[te]).mean():.1%}")
+        print_sweep(CLASSES[P.argmax(1)], P.max(1), labels[te])
+    m = NgramClassifier().fit(texts, labels)
+    m.save(model_path)
+    print(f"[OK] 本地模型已保存：{model_path}")
+
+# ================= 本地预测 =================
+def local_ngram(texts, model_path):
+    """返回 (标签, 置信度, 概率矩阵[暴露, 防范, 不相关])。"""
+    P = NgramClassifier.load(model_path).predict_proba(texts)
+    probs = np.column_stack([P[:, 0], P[:, 2], P[:, 1]])
+    return CLASSES[P.argmax(1)], P.max(1), probs
+
+def local_finbert(texts, finbert_csv="", finbert_model="", threads=4):
+    """FinBERT 只区分 暴露 / 防范，不会给出不相关；按句子文本对齐预先生成的结果，或现场推理。"""
+    if finbert_csv:
+        fb = pd.read_csv(finbert_csv, encoding="utf-8-sig", usecols=["句子", "AI_Label_Text", "AI_Confidence"])
+        fb = fb.drop_duplicates("句子").set_index("句子")
+        sub = fb.reindex(pd.Series(texts, dtype=object).astype(str))
+        if sub["AI_Label_Text"].isna().any():
+            raise ValueError(f"❌ FinBERT 结果中缺少 {int(sub['AI_Label_Text'].isna().sum())} 个句子")
+        labels = sub["AI_Label_Text"].map(FINBERT_LABELS).to_numpy(int)
+        conf = sub["AI_Confidence"].to_numpy(float)
+    else:
+        from finbert_infer import configure_threads, label_texts, LABELS
+        configure_threads(threads)
+        spec = {"backend": "torch", "model": finbert_model, "quantize": False, "threads": threads,
+                "interop_threads": 1, "max_length": 256}
+        P = label_texts(texts, spec)
+        labels = np.array([FINBERT_LABELS[LABELS[i]] for i in P.argmax(1)])
+        conf = P.max(1)
+    p_exp = np.where(labels == -1, conf, 1 - conf)
+    return labels, conf, np.column_stack([p_exp, 1 - p_exp, np.zeros(len(labels))])
+
+# ================= 路由与报告 =================
+def dict_prior(df, mapping=DICT_PRIOR):
+    """二级分类隐含的方向，无判断时为 NaN。"""
+    if "二级分类" not in df.columns:
+        return np.full(len(df), np.nan)
+    return df["二级分类"].map(mapping).to_numpy(float)
+
+def route(labels, conf, threshold, prior=None):
+    """返回需要请求 LLM 的掩码：置信度低于阈值，或本地标签与词典方向相反。"""
+    to_llm = conf < threshold
+    if prior is not None:
+        to_llm |= conflicts(labels, prior)
+    return to_llm
+
+def conflicts(labels, prior):
+    return ~np.isnan(prior) & (labels == -prior)
+
+def print_sweep(labels, conf, reference, prior=None, thresholds=SWEEP):
+    """
+    按阈值扫描：免调用比例、本地接受部分与全量 LLM 的一致率，
+    以及级联整体一致率（假设路由到 LLM 的句子与全量 LLM 结果相同）。
+    """
+    ok = ~pd.isna(reference)
+    print(f"  {'阈值':>6} | {'免调用':>7} | {'本地部分一致率':>10} | {'整体一致率':>8}")
+    for t in thresholds:
+        local = ~route(labels, conf, t, prior) & ok
+        agree = labels[local] == reference[local]
+        overall = (agree.sum() + (ok & ~local).sum()) / max(ok.sum(), 1)
+        print(f"  {t:>6.2f} | {local.sum() / max(ok.sum(), 1):>7.1%} | "
+              f"{agree.mean() if local.any() else float('nan'):>14.1%} | {overall:>11.1%}")
+
+def load_reference(path, texts):
+    """全量 LLM 标注，按句子文本对齐；缺失为 NaN。"""
+    ref = pd.read_csv(path, encoding="utf-8-sig", usecols=["句子", "LLM_Label"])
+    ref["LLM_Label"] = pd.to_numeric(ref["LLM_Label"], errors="coerce")
+    ref = ref.dropna().drop_duplicates("句子").set_index("句子")["LLM_Label"]
+    return ref.reindex(pd.Series(texts, dtype=object).astype(str)).to_numpy(float)
+
+def local_result(label, conf, probs, source):
+    return {
+        "LLM_Label": int(label),
+        "LLM_Prob_Exposed": float(probs[0]),
+        "LLM_Prob_Prevent": float(probs[1]),
+        "LLM_Prob_Neutral": float(probs[2]),
+        "LLM_Reason": f"本地模型（{source}，置信度 {conf:.3f}）",
+    }
+
+def main():
+    from llm_analysis import add_label_args
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=INPUT_FILE, help="待标注样本 CSV")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="级联标注结果 CSV")
+    ap.add_argument("--local", choices=["ngram", "finbert"], default="ngram", help="本地模型")
+    ap.add_argument("--local_model", default=LOCAL_MODEL, help="ngram 模型文件（.npz）")
+    ap.add_argument("--train", nargs="*", default=[], help="用已有 LLM 标注结果训练 ngram 模型并保存到 --local_model")
+    ap.add_argument("--finbert", default="", help="预先生成的 FinBERT 结果（risk_Finbert_labeled.csv）")
+    ap.add_argument("--finbert_model", default="", help="FinBERT 模型目录（未给 --finbert 时现场推理）")
+    ap.add_argument("--threads", type=int, default=4, help="FinBERT 现场推理的线程数")
+    ap.add_argument("--threshold", type=float, default=0.9, help="本地置信度阈值，低于该值的句子交给 LLM")
+    ap.add_argument("--no_dict_check", action="store_true", help="不检查本地标签与词典方向是否相反")
+    ap.add_argument("--reference", default="", help="全量 LLM 标注结果，用于报告一致率")
+    ap.add_argument("--dry_run", action="store_true", help="只做本地预测与路由统计，不请求 LLM")
+    add_label_args(ap)
+    ap.set_defaults(checkpoint=CHECKPOINT_FILE)
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run("cascade", args):
+        run(args)
+
+def run(args):
+    from llm_analysis import resolve_model, label_rows, build_output, LabelJournal
+
+    if args.train:
+        train(args.train, args.local_model)
+        return
+
+    df = pd.read_csv(args.input, encoding="utf-8-sig")
+    texts = df["句子"].astype(str).tolist()
+    t0 = time.time()
+    if args.local == "ngram":
+        labels, conf, probs = local_ngram(texts, args.local_model)
+    else:
+        labels, conf, probs = local_finbert(texts, args.finbert, args.finbert_model, args.threads)
+    prior = None if args.no_dict_check else dict_prior(df)
+    to_llm = route(labels, conf, args.threshold, prior)
+    n_conflict = 0 if prior is None else int((conflicts(labels, prior) & (conf >= args.threshold)).sum())
+    print(f"🚀 级联标注：{len(df)} 句，本地模型 {args.local}（{time.time() - t0:.1f}s），阈值 {args.threshold}")
+    print(f"📊 本地接受 {int((~to_llm).sum())} 句，交给 LLM {int(to_llm.sum())} 句"
+          f"（低置信度 {int((conf < args.threshold).sum())}，与词典方向矛盾 {n_conflict}），"
+          f"免调用比例 {(~to_llm).mean():.1%}")
+
+    reference = load_reference(args.reference, texts) if args.reference else None
+    if reference is not None:
+        print(f"📏 与全量 LLM 标注对比（覆盖 {int((~np.isnan(reference)).sum())} 句）：")
+        print_sweep(labels, conf, reference, prior)
+    if args.dry_run:
+        return
+
+    model, prompt = resolve_model(args)
+    journal = LabelJournal(args.checkpoint, args.fsync_every)
+    done, _ = label_rows({i: texts[i] for i in np.flatnonzero(to_llm).tolist()}, journal, args, model, prompt)
+    for i in np.flatnonzero(~to_llm).tolist():
+        done[i] = local_result(labels[i], conf[i], probs[i], args.local)
+
+    if len(done) < len(df):
+        print(f"\n⏸️ 任务暂停，已完成 {len(done)} / {len(df)}。请检查网络后重启。")
+        return
+    out = build_output(df, done)
+    out["标注来源"] = np.where(to_llm, "llm", "local")
+    out["本地标签"] = labels
+    out["本地置信度"] = conf
+    routed = to_llm & pd.notna(out["LLM_Label"]).to_numpy()
+    if routed.any():
+        llm = pd.to_numeric(out["LLM_Label"], errors="coerce").to_numpy()
+        print(f"🔁 路由到 LLM 的句子中，本地标签与 LLM 一致 {(labels[routed] == llm[routed]).mean():.1%}")
+    if reference is not None:
+        final = pd.to_numeric(out["LLM_Label"], errors="coerce").to_numpy()
+        ok = ~np.isnan(reference)
+        print(f"📏 级联结果与全量 LLM 一致率 {(final[ok] == reference[ok]).mean():.1%}")
+    out.to_csv(args.output, index=False, encoding="utf-8-sig")
+    journal.remove()
+    print(f"\n✅ 级联标注完成，LLM 请求 {int(to_llm.sum())} 句（免调用 {(~to_llm).mean():.1%}），结果保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 """
 extract_hits_2024.py
-从“扩展关键词表”抽取2024年年报中的相关句子。
+从“扩展关键词表”抽取年报中的相关句子（默认 2024 年，可用 --years 指定年份范围，--workers 多进程扫描）。
 """
 
 import argparse
 import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
 
+import metrics
+
 # 句末分句：句号/感叹号/问号
 SENT_SPLIT_RE = re.compile(r"(?<=[。！？?])\s*")
 
@@ -37,6 +42,36 @@ def split_sents(text: str):
             out.append(p)
     return [s for s in out if len(s) >= 4]
 
+def _pieces(text: str, pattern, start: int, end: int):
+    """按 pattern 切分 text[start:end]（与 re.split 相同），产出去除首尾空白后的非空片段 [s, e)。"""
+    pos = start
+    bounds = [(m.start(), m.end()) for m in pattern.finditer(text, start, end)] + [(end, end)]
+    for ms, me in bounds:
+        s, e = pos, ms
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if s < e:
+            yield s, e
+        pos = me
+
+COMMA_RE = re.compile(r"[，,]")
+
+def sent_spans(text: str):
+    """
+    与 split_sents 相同的切分规则，但返回 (清洗后文本, [(起始, 结束), ...])，
+    偏移为句子在 clean_text(text) 中的字符位置，供句子库记录。
+    """
+    text = clean_text(text)
+    spans = []
+    for s, e in _pieces(text, SENT_SPLIT_RE, 0, len(text)):
+        if e - s > 120:
+            spans.extend(_pieces(text, COMMA_RE, s, e))
+        else:
+            spans.append((s, e))
+    return text, [(s, e) for s, e in spans if e - s >= 4]
+
 def load_dict(dict_path: str):
     """
     读取扩展关键词表：支持 Excel(_ALL) / CSV
@@ -72,44 +107,266 @@ def parse_meta_from_filename(filename: str):
     company = parts[2] if len(parts) > 2 else "Unknown"
     return code, year, company
 
-def scan_dir(annual_dir: str, catmap: dict):
+class KeywordMatcher:
+    """
+    Aho-Corasick 多模式匹配器：由 load_dict 的 catmap 一次性构建。
+    - ASCII 关键词在 s.lower() 上匹配（大小写不敏感），其余关键词在原句上精确匹配，
+      与逐词 `w in s` 的旧逻辑一致；
+    - 一次扫描句子即可得到全部命中词，并映射回 (一级分类, 二级分类)。
+    若安装了 pyahocorasick 则使用其 C 实现，否则使用纯 Python 自动机。
+    """
+
+    def __init__(self, catmap: dict):
+        self.buckets = list(catmap.keys())
+        ascii_words, other_words = {}, {}
+        for bi, words in enumerate(catmap.values()):
+            for w in words:
+                if w.isascii():
+                    ascii_words.setdefault(w.lower(), []).append((bi, w))
+                else:
+                    other_words.setdefault(w, []).append((bi, w))
+        self._lower = self._build(ascii_words)
+        self._exact = self._build(other_words)
+
+    @staticmethod
+    def _build(patterns: dict):
+        """patterns: {模式串: [(桶序号, 原词), ...]}；返回自动机或 None。"""
+        if not patterns:
+            return None
+        try:
+            import ahocorasick
+            A = ahocorasick.Automaton()
+            for pat, payload in patterns.items():
+                A.add_word(pat, payload)
+            A.make_automaton()
+            return ("c", A)
+        except ImportError:
+            pass
+        # 纯 Python：goto 表 + fail 指针 + 输出表（输出沿 fail 链合并）
+        goto, fail, out = [{}], [0], [[]]
+        for pat, payload in patterns.items():
+            node = 0
+            for ch in pat:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({}); fail.append(0); out.append([])
+                node = nxt
+            out[node] = out[node] + payload
+        queue = list(goto[0].values())
+        for node in queue:
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if out[fail[nxt]]:
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+                queue.append(nxt)
+        return ("py", (goto, fail, out))
+
+    @staticmethod
+    def _run(auto, text: str, hits: dict):
+        kind, A = auto
+        if kind == "c":
+            for _, payload in A.iter(text):
+                for bi, w in payload:
+                    hits.setdefault(bi, set()).add(w)
+            return
+        goto, fail, out = A
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for bi, w in out[node]:
+                    hits.setdefault(bi, set()).add(w)
+
+    def match(self, s: str):
+        """返回 [(一级分类, 二级分类, 命中词集合), ...]，顺序与 catmap 一致。"""
+        hits = {}
+        if self._exact is not None:
+            self._run(self._exact, s, hits)
+        if self._lower is not None:
+            self._run(self._lower, s.lower(), hits)
+        return [(*self.buckets[bi], hits[bi]) for bi in sorted(hits)]
+
+def match_naive(s: str, catmap: dict):
+    """旧的逐类别、逐关键词子串匹配，作为 KeywordMatcher 的参照实现（基准测试用）。"""
+    slow = s.lower()
+    out = []
+    for (cat, sub), words in catmap.items():
+        hit_words = {w for w in words if (w.lower() in slow if w.isascii() else w in s)}
+        if hit_words:
+            out.append((cat, sub, hit_words))
+    return out
+
+def scan_file(fpath: str, matcher: KeywordMatcher):
+    """扫描单个 MD&A 文件，返回命中行（按句序、类别顺序）；启用指标时记录耗时、字节数、句数与命中数。"""
+    t0 = time.perf_counter()
     rows = []
+    fn = os.path.basename(fpath)
+    with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+
+    sents = split_sents(text)
+    code, year, company = parse_meta_from_filename(fn)
+
+    for i, s in enumerate(sents):
+        for cat, sub, hit_words in matcher.match(s):
+            rows.append({
+                "文件名": fn,
+                "股票代码": code,
+                "年份": year,
+                "公司": company,
+                "句序": i,
+                "一级分类": cat,
+                "二级分类": sub,
+                "命中关键词": "|".join(sorted(hit_words)),
+                "句子": s,
+            })
+    if metrics.enabled():
+        metrics.emit("scan_file", file=fn, seconds=round(time.perf_counter() - t0, 6),
+                     bytes=os.path.getsize(fpath), sentences=len(sents), hits=len(rows))
+    return rows
+
+def list_txt(annual_dir: str):
+    """目录下的 TXT 文件（按文件名排序，保证输出顺序确定）。"""
     if not os.path.exists(annual_dir):
-        return rows
-    files = [f for f in os.listdir(annual_dir) if f.lower().endswith(".txt")]
-    for fn in files:
-        fpath = os.path.join(annual_dir, fn)
-        with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        
-        sents = split_sents(text)
-        code, year, company = parse_meta_from_filename(fn)
-
-        for i, s in enumerate(sents):
-            slow = s.lower()
-            for (cat, sub), words in catmap.items():
-                hit_words = {w for w in words if (w.lower() in slow if w.isascii() else w in s)}
-                if hit_words:
-                    rows.append({
-                        "文件名": fn,
-                        "股票代码": code,
-                        "年份": year,
-                        "公司": company,
-                        "句序": i,
-                        "一级分类": cat,
-                        "二级分类": sub,
-                        "命中关键词": "|".join(sorted(hit_words)),
-                        "句子": s,
-                    })
+        return []
+    return sorted(os.path.join(annual_dir, f) for f in os.listdir(annual_dir) if f.lower().endswith(".txt"))
+
+def scan_dir(annual_dir: str, catmap: dict, matcher: KeywordMatcher = None):
+    rows = []
+    if matcher is None:
+        matcher = KeywordMatcher(catmap)
+    for fpath in list_txt(annual_dir):
+        rows.extend(scan_file(fpath, matcher))
     return rows
 
-def iter_2024_dirs(base_dir: Path):
-    """仅遍历 base_dir 下 2024 年开头的子目录。"""
+# ---------- 多进程扫描 ----------
+_WORKER_MATCHER = None
+
+def _init_worker(catmap: dict):
+    """每个工作进程只构建一次匹配器。"""
+    global _WORKER_MATCHER
+    _WORKER_MATCHER = KeywordMatcher(catmap)
+
+def _scan_files_worker(fpaths):
+    return [scan_file(fp, _WORKER_MATCHER) for fp in fpaths]
+
+def ordered_submit(ex, fn, items, max_inflight: int):
+    """
+    按输入顺序提交并产出 fn(item) 的结果，同时在途的任务不超过 max_inflight。
+    与 ex.map 不同，不会一次提交全部任务，也不会积压大量已完成但尚未消费的结果，内存随在途任务数而非文件总数增长。
+    """
+    pending = iter(items)
+    inflight = deque()
+    for item in pending:
+        inflight.append(ex.submit(fn, item))
+        if len(inflight) >= max_inflight:
+            break
+    while inflight:
+        result = inflight.popleft().result()
+        nxt = next(pending, None)
+        if nxt is not None:
+            inflight.append(ex.submit(fn, nxt))
+        yield result
+
+def scan_dirs_parallel(dirs, catmap: dict, workers: int, chunksize: int = 8, max_inflight: int = None):
+    """
+    将所有目录下的文件每 chunksize 个一组派发到进程池中扫描，同时在途的组不超过 max_inflight（默认 workers*2）。
+    按 (目录, 文件名) 顺序逐个产出 (目录, 文件路径, 命中行)，与串行模式结果顺序一致。
+    """
+    tasks = [(d, fp) for d in dirs for fp in list_txt(str(d))]
+    if not tasks:
+        return
+    chunksize = max(1, chunksize)
+    groups = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    fpaths = ([fp for _, fp in g] for g in groups)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(catmap,)) as ex:
+        for group, results in zip(groups, ordered_submit(ex, _scan_files_worker, fpaths, max_inflight or workers * 2)):
+            for (d, fp), rows in zip(group, results):
+                yield d, fp, rows
+
+# ---------- 基于句子库扫描 ----------
+def scan_table(table, matcher: KeywordMatcher):
+    """扫描句子库的一段（pyarrow.Table），返回带句子ID的命中行。"""
+    t0 = time.perf_counter()
+    cols = {c: table.column(c).to_pylist() for c in ("句子ID", "文件名", "股票代码", "年份", "公司", "句序", "句子")}
+    rows = []
+    for j, s in enumerate(cols["句子"]):
+        for cat, sub, hit_words in matcher.match(s):
+            rows.append({
+                "文件名": cols["文件名"][j],
+                "股票代码": cols["股票代码"][j],
+                "年份": cols["年份"][j],
+                "公司": cols["公司"][j],
+                "句序": cols["句序"][j],
+                "一级分类": cat,
+                "二级分类": sub,
+                "命中关键词": "|".join(sorted(hit_words)),
+                "句子": s,
+                "句子ID": cols["句子ID"][j],
+            })
+    if metrics.enabled():
+        metrics.emit("scan_slice", seconds=round(time.perf_counter() - t0, 6),
+                     sentences=len(cols["句子"]), hits=len(rows))
+    return rows
+
+_WORKER_STORE = None
+
+def _init_store_worker(catmap: dict, store_root: str):
+    global _WORKER_MATCHER, _WORKER_STORE
+    from sentence_store import SentenceStore
+    _WORKER_MATCHER = KeywordMatcher(catmap)
+    _WORKER_STORE = SentenceStore(store_root)
+
+def _scan_slice_worker(sl):
+    return scan_table(_WORKER_STORE.read_slice(*sl), _WORKER_MATCHER)
+
+def scan_store(store, dirs, catmap: dict, workers: int = 1, max_inflight: int = None):
+    """
+    从句子库扫描 dirs 下的文件（不再读取和分句原始 TXT），按 (目录, 文件名) 顺序逐段产出命中行。
+    并行时各进程自行 mmap 句子库分片，只传递 (分片, 起始行, 行数)。
+    """
+    slices = store.slices(dirs)
+    if workers <= 1:
+        matcher = KeywordMatcher(catmap)
+        for sl in slices:
+            yield scan_table(store.read_slice(*sl), matcher)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_store_worker,
+                             initargs=(catmap, str(store.root))) as ex:
+        yield from ordered_submit(ex, _scan_slice_worker, slices, max_inflight or workers * 2)
+
+def parse_years(spec: str):
+    """解析年份范围：'2024' 或 '2014-2024'，返回 (起始年, 结束年)。"""
+    parts = [p.strip() for p in str(spec).split("-") if p.strip()]
+    if len(parts) == 1:
+        return int(parts[0]), int(parts[0])
+    if len(parts) == 2:
+        y0, y1 = int(parts[0]), int(parts[1])
+        return min(y0, y1), max(y0, y1)
+    raise ValueError(f"无法解析年份范围: {spec}")
+
+def iter_year_dirs(base_dir: Path, start: int, end: int):
+    """遍历 base_dir 下以 <年份>_ 开头、年份位于 [start, end] 的子目录。"""
     if not base_dir.exists():
         return []
-    # 修改正则，只匹配 2024_ 开头的目录
-    year_2024_re = re.compile(r"^2024_")
-    return sorted([p for p in base_dir.iterdir() if p.is_dir() and year_2024_re.match(p.name)])
+    year_re = re.compile(r"^(\d{4})_")
+    out = []
+    for p in base_dir.iterdir():
+        m = year_re.match(p.name)
+        if p.is_dir() and m and start <= int(m.group(1)) <= end:
+            out.append(p)
+    return sorted(out)
+
+def iter_2024_dirs(base_dir: Path):
+    """仅遍历 base_dir 下 2024 年开头的子目录。"""
+    return iter_year_dirs(base_dir, 2024, 2024)
 
 def write_rows(df_all, out_path: Path):
     """写入 CSV (UTF-8-SIG 适配 Excel)"""
@@ -118,42 +375,186 @@ def write_rows(df_all, out_path: Path):
         return
     df_all.to_csv(out_path, index=False, encoding="utf-8-sig")
 
+# ---------- 流式输出 ----------
+HIT_COLUMNS = ["文件名", "股票代码", "年份", "公司", "句序", "一级分类", "二级分类", "命中关键词", "句子"]
+# 从句子库扫描时额外输出稳定的句子ID，供抽样、标注等后续环节关联
+STORE_HIT_COLUMNS = HIT_COLUMNS + ["句子ID"]
+# 重复度高的列以字典（整数编码）形式存储
+DICT_COLUMNS = ["文件名", "股票代码", "年份", "公司", "一级分类", "二级分类"]
+
+def hit_schema(columns=None):
+    import pyarrow as pa
+    fields = []
+    for c in columns or HIT_COLUMNS:
+        if c in DICT_COLUMNS:
+            fields.append((c, pa.dictionary(pa.int32(), pa.string())))
+        elif c == "句序":
+            fields.append((c, pa.int32()))
+        elif c == "句子ID":
+            fields.append((c, pa.int64()))
+        elif c == "命中关键词":
+            fields.append((c, pa.list_(pa.string())))
+        else:
+            fields.append((c, pa.string()))
+    return pa.schema(fields)
+
+class HitsWriter:
+    """
+    按批次流式写出命中行，内存占用只与 batch_rows 有关。
+    - parquet：分类/公司/文件名等列为字典编码，命中关键词为 list<string>（叶子值同样字典编码）；
+    - csv：与 write_rows 相同的 UTF-8-SIG 格式，命中关键词以 "|" 连接。
+    """
+
+    def __init__(self, out_path, fmt: str = None, batch_rows: int = 50000, columns=None):
+        self.out_path = Path(out_path)
+        self.columns = list(columns or HIT_COLUMNS)
+        self.fmt = fmt or ("parquet" if self.out_path.suffix.lower() == ".parquet" else "csv")
+        if self.fmt not in ("parquet", "csv"):
+            raise ValueError(f"不支持的输出格式: {self.fmt}")
+        if self.fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("Parquet 输出需要 pyarrow: pip install pyarrow")
+        self.batch_rows = max(1, batch_rows)
+        self.n_rows = 0
+        self._buf = {c: [] for c in self.columns}
+        self._n_buf = 0
+        self._pq = None
+        self._csv_started = False
+
+    def write(self, rows):
+        for r in rows:
+            for c in self.columns:
+                self._buf[c].append(r[c])
+            self._n_buf += 1
+            if self._n_buf >= self.batch_rows:
+                self.flush()
+
+    def flush(self):
+        if not self._n_buf:
+            return
+        if self.fmt == "parquet":
+            self._flush_parquet()
+        else:
+            self._flush_csv()
+        self.n_rows += self._n_buf
+        self._buf = {c: [] for c in self.columns}
+        self._n_buf = 0
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        cols = dict(self._buf)
+        cols["命中关键词"] = [kw.split("|") if kw else [] for kw in cols["命中关键词"]]
+        schema = hit_schema(self.columns)
+        table = pa.Table.from_pydict(cols, schema=schema)
+        if self._pq is None:
+            self.out_path.parent.mkdir(parents=True, exist_ok=True)
+            self._pq = pq.ParquetWriter(str(self.out_path), schema, use_dictionary=True, compression="zstd")
+        self._pq.write_table(table)
+
+    def _flush_csv(self):
+        df = pd.DataFrame(self._buf, columns=self.columns)
+        if not self._csv_started:
+            self.out_path.parent.mkdir(parents=True, exist_ok=True)
+            df.to_csv(self.out_path, index=False, encoding="utf-8-sig")
+            self._csv_started = True
+        else:
+            df.to_csv(self.out_path, index=False, header=False, mode="a", encoding="utf-8")
+
+    def close(self):
+        self.flush()
+        if self._pq is not None:
+            self._pq.close()
+            self._pq = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_hits(path, columns=None):
+    """读取命中结果：parquet 的字典列还原为 pandas Categorical；CSV 按原格式读取。"""
+    path = str(path)
+    if path.lower().endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, encoding="utf-8-sig", usecols=columns)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--dict", required=True, help="扩展关键词表路径")
-    # 确保添加了下面这一行参数定义
-    ap.add_argument("--annual_dir", help="指定 2024 年报 TXT 文件所在的单目录")
+    ap.add_argument("--annual_dir", help="指定年报 TXT 文件所在的单目录（优先于 --base_dir/--years）")
     ap.add_argument("--base_dir", default="data/output", help="包含各年度子目录的根目录")
-    ap.add_argument("--out", default="risk_hits_2024.csv", help="输出文件名")
-    args = ap.parse_args()
-    
-    # 后续逻辑...
+    ap.add_argument("--years", default="2024", help="年份或年份范围，如 2024 或 2014-2024")
+    ap.add_argument("--workers", type=int, default=1, help="并行进程数（1 为串行，0 为 CPU 核数-1）")
+    ap.add_argument("--chunksize", type=int, default=8, help="并行模式下每次派发给进程的文件数")
+    ap.add_argument("--out", default="risk_hits_2024.csv", help="输出文件名（.parquet 后缀默认输出 Parquet）")
+    ap.add_argument("--format", choices=["csv", "parquet"], default=None, help="输出格式（默认按 --out 后缀判断）")
+    ap.add_argument("--batch_rows", type=int, default=50000, help="每批写出的行数（控制内存上限）")
+    ap.add_argument("--store", default="", help="句子库目录（sentence_store.py）；给定时先增量更新，再从句子库扫描并输出句子ID")
+    metrics.add_args(ap)
     args = ap.parse_args()
+    with metrics.stage_run("extract_hits", args):
+        run(args)
+
+def run(args):
 
     catmap = load_dict(args.dict)
     base_dir = Path(args.base_dir)
     out_path = Path(args.out)
+    y0, y1 = parse_years(args.years)
+    label = f"{y0}" if y0 == y1 else f"{y0}-{y1}"
 
-    dirs = iter_2024_dirs(base_dir)
+    if args.annual_dir:
+        dirs = [Path(args.annual_dir)] if Path(args.annual_dir).is_dir() else []
+    else:
+        dirs = iter_year_dirs(base_dir, y0, y1)
     if not dirs:
-        print(f"[ERR] 在 {base_dir} 下未找到以 2024_ 开头的目录。")
+        print(f"[ERR] 在 {args.annual_dir or base_dir} 下未找到 {label} 年份的目录。")
+        return
+
+    workers = args.workers if args.workers > 0 else max(1, (os.cpu_count() or 4) - 1)
+
+    if args.store:
+        from sentence_store import SentenceStore
+        store = SentenceStore(args.store)
+        c = store.update(dirs, workers=workers)
+        print(f"[INFO] 句子库：复用 {c['hit']} 个文件，新分句 {c['miss'] + c['stale']} 个文件（{c['sentences']} 句）")
+        with HitsWriter(out_path, fmt=args.format, batch_rows=args.batch_rows, columns=STORE_HIT_COLUMNS) as writer:
+            for results in scan_store(store, dirs, catmap, workers):
+                writer.write(results)
+        print(f"[SCANNED {label}] 共 {len(dirs)} 个目录 -> 发现 {writer.n_rows} 条匹配")
+        if writer.n_rows:
+            print(f"\n[DONE] {label}年匹配完成！结果保存至: {out_path.resolve()}")
         return
 
-    all_results = []
-    total_hits = 0
-    
-    for d in dirs:
-        print(f"[SCANNING 2024] {d.name}...")
-        results = scan_dir(str(d), catmap)
-        all_results.extend(results)
-        total_hits += len(results)
-        print(f"  -> 发现 {len(results)} 条匹配")
-
-    if all_results:
-        df_final = pd.DataFrame(all_results)
-        write_rows(df_final, out_path)
-        print(f"\n[DONE] 2024年匹配完成！结果保存至: {out_path.resolve()}")
-        print(f"总计命中句数: {total_hits}")
+    with HitsWriter(out_path, fmt=args.format, batch_rows=args.batch_rows) as writer:
+        if workers == 1:
+            matcher = KeywordMatcher(catmap)
+            for d in dirs:
+                print(f"[SCANNING {label}] {d.name}...")
+                n = 0
+                for fp in list_txt(str(d)):
+                    results = scan_file(fp, matcher)
+                    writer.write(results)
+                    n += len(results)
+                print(f"  -> 发现 {n} 条匹配")
+        else:
+            print(f"[INFO] 多进程扫描，并行数：{workers}，目录 {len(dirs)} 个")
+            per_dir = {}
+            for d, _, results in scan_dirs_parallel(dirs, catmap, workers, args.chunksize):
+                writer.write(results)
+                per_dir[d.name] = per_dir.get(d.name, 0) + len(results)
+            for name, n in per_dir.items():
+                print(f"[SCANNED {label}] {name} -> 发现 {n} 条匹配")
+
+    if writer.n_rows:
+        print(f"\n[DONE] {label}年匹配完成！结果保存至: {out_path.resolve()}")
+        print(f"总计命中句数: {writer.n_rows}")
+    else:
+        print("[WARN] 没有匹配到任何结果。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,6 +2,7 @@
 """
 年报 MD&A 提取脚本
 - 功能：批量提取管理层讨论与分析章节，并清洗文本（去除换行符）。
+- 增量：OUT_BASE 下的 mda_manifest.json 记录已处理文件，重跑时只提取新增/变化的文件（--full 强制全量）。
 - 输入：E:\projects\risk-pipeline\data\annual_txt
 - 输出：E:\projects\risk-pipeline\data\output
 """
@@ -9,8 +10,18 @@
 import os
 import sys
 import re
+import json
+import hashlib
+import mmap
+import time
+import argparse
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
 
 # ======== 配置区域 ========
 IN_BASE  = r'E:\projects\risk-pipeline\data\annual_txt'
@@ -34,61 +45,185 @@ def parse_filename(fname: str):
     code, year, company, _, _ = m.groups()
     return {"code": code, "year": year, "company": company}
 
-def extract_content(in_path: str, out_dir: str) -> str:
-    """处理单个文件：提取、清洗、保存"""
+def output_path(in_path: str, out_dir: str) -> str:
     fname = os.path.basename(in_path)
     meta = parse_filename(fname)
     out_name = f"{meta['code']}_{meta['year']}_{meta['company']}_经营情况段落.txt" if meta else f"{os.path.splitext(fname)[0]}_提取.txt"
-    out_path = os.path.join(out_dir, out_name)
+    return os.path.join(out_dir, out_name)
 
-    try:
-        with open(in_path, 'r', encoding='utf-8', errors='ignore') as f:
-            text = f.read()
-    except: return 'fail'
+# 目录页特征：标题后紧跟这些字符时视为目录/引用，取该标题的下一次出现
+TOC_NEXT_CHARS = ['“','。','分','一','中','关','之','》','"','—','”','第']
+# 超过该大小的报告通过 mmap 按字节定位，只解码最终截取的片段
+MMAP_MIN_BYTES = 32 * 1024 * 1024
+
+def _encode_all(words, as_bytes):
+    return [w.encode('utf-8') for w in words] if as_bytes else list(words)
+
+def _locate_topic(buf, titles, toc_chars):
+    """
+    定位章节标题，返回 (标题序号, 位置)；未找到返回 (None, -1)。
+    与逐个 find 的旧逻辑一致：取位置最小者，并列时取列表靠前者；
+    已有候选后，后续查找只在候选位置之前进行。
+    """
+    min_idx, best = len(buf) + 1, None
+    for ti, t in enumerate(titles):
+        pos = buf.find(t, 0, min_idx - 1 + len(t))
+        if pos == -1:
+            continue
+        p = pos + len(t)
+        if any(buf[p:p + len(c)] == c for c in toc_chars):
+            pos2 = buf.find(t, pos + 1, min_idx - 1 + len(t))
+            if pos2 != -1:
+                min_idx, best = pos2, ti
+        else:
+            min_idx, best = pos, ti
+    return best, min_idx
 
-    # 1. 定位章节标题
-    min_idx = sys.maxsize
-    topic = None
-    for t in TITLE_KEYWORDS:
-        pos = text.find(t)
-        if pos != -1:
-            # 简单逻辑排除目录：检查标题后的第一个非空字符
-            nxt_ch = text[pos + len(t): pos + len(t) + 1]
-            if nxt_ch in ['“','。','分','一','中','关','之','》','"','—','”','第']:
-                pos2 = text.find(t, pos + 1)
-                if pos2 != -1 and pos2 < min_idx:
-                    min_idx, topic = pos2, t
-            elif pos < min_idx:
-                min_idx, topic = pos, t
-
-    if not topic: return 'skip'
-
-    # 2. 提取正文
-    split_text = text.split(topic)
-    if len(split_text) < 2: return 'skip'
-    
-    result = None
-    tail_blocks = split_text[1:]
-    for ind, j in enumerate(tail_blocks):
-        if len(j) > 0 and (j[:2] == ' \n' or j[0] in ['\n', ' ', '\t']):
-            result = ''.join(tail_blocks[ind+1:])
+def _body_segments(buf, topic):
+    """
+    正文片段（buf 上的 [start, end) 偏移）：等价于旧逻辑中
+    ''.join(text.split(topic)[...]) 得到的字符串，但不复制文本，按需逐段产出。
+    """
+    L = len(topic)
+    # 字节模式下文件未经通用换行转换，'\r' 对应文本模式中的 '\n'
+    ws = ('\n', ' ', '\t') if isinstance(buf, str) else (b'\n', b'\r', b' ', b'\t')
+    first = buf.find(topic)
+    start = first + L
+    # 找到第一个以空白开头且非空的块（标题独占一行），正文从其后一处标题之后开始
+    o = first
+    while True:
+        nxt = buf.find(topic, o + L)
+        block_end = len(buf) if nxt == -1 else nxt
+        if block_end > o + L and buf[o + L:o + L + 1] in ws:
+            start = len(buf) if nxt == -1 else nxt + L
             break
-    if result is None: result = ''.join(tail_blocks)
-
-    # 3. 截断到下一章节
-    cut_points = [result.find(nt) for nt in NEXT_KEYWORDS if result.find(nt) != -1]
-    if not cut_points:
-        cut_points = [result.find(t) for t in TITLE_KEYWORDS if t != topic and result.find(t) != -1]
-    
-    if cut_points:
-        end_idx = min(cut_points)
-        if end_idx > 0: result = result[:end_idx]
-
-    # 4. 清洗文本：去除换行符、回车符及多余空格
-    result = re.sub(r'[\r\n\t]', '', result)  # 去除换行和制表符
-    result = re.sub(r'\s+', ' ', result).strip() # 将连续空格替换为单个空格
-
-    # 5. 保存
+        if nxt == -1:
+            break
+        o = nxt
+    # 逐段产出，跳过其后每一处标题
+    a = start
+    while True:
+        k = buf.find(topic, a)
+        if k == -1:
+            yield a, len(buf)
+            return
+        yield a, k
+        a = k + L
+
+def _first_cut(buf, segs, pats):
+    """
+    在片段拼接成的虚拟串中查找 pats 的最早出现位置（含跨片段边界的匹配）。
+    返回 (虚拟偏移或 -1, 已消费的片段列表)；找到后立即停止，不再扫描后文。
+    """
+    consumed = []
+    maxm = max(len(p) for p in pats)
+    base, carry = 0, buf[0:0]
+    for a, b in segs:
+        consumed.append((a, b))
+        best = -1
+        if carry:
+            window = carry + buf[a:min(b, a + maxm - 1)]
+            for p in pats:
+                k = window.find(p)
+                if k != -1 and (best == -1 or base - len(carry) + k < best):
+                    best = base - len(carry) + k
+        for p in pats:
+            end = b if best == -1 else min(b, a + (best - base) + len(p) - 1)
+            k = buf.find(p, a, end) if end > a else -1
+            if k != -1 and (best == -1 or base + k - a < best):
+                best = base + k - a
+        if best != -1:
+            return best, consumed
+        base += b - a
+        if maxm > 1:
+            if b - a >= maxm - 1:
+                carry = buf[b - (maxm - 1):b]
+            else:
+                carry = (carry + buf[a:b])[-(maxm - 1):]
+    return -1, consumed
+
+def locate_mda(buf):
+    """
+    单次前向扫描定位 MD&A 正文，返回 buf 上的片段偏移列表；未找到标题返回 None。
+    buf 可以是 str，也可以是 bytes/mmap（此时按 UTF-8 字节匹配）。
+    """
+    as_bytes = not isinstance(buf, str)
+    titles = _encode_all(TITLE_KEYWORDS, as_bytes)
+    ti, _ = _locate_topic(buf, titles, _encode_all(TOC_NEXT_CHARS, as_bytes))
+    if ti is None:
+        return None
+    topic = titles[ti]
+
+    # 截断到下一章节：优先 NEXT_KEYWORDS，全文都没有时再用其他章节标题
+    body = _body_segments(buf, topic)
+    end_idx, segs = _first_cut(buf, body, _encode_all(NEXT_KEYWORDS, as_bytes))
+    rest = body
+    if end_idx == -1:
+        # 此时 body 已遍历完，segs 即全部正文片段
+        others = [t for t in titles if t != topic]
+        all_segs = segs
+        if others:
+            end_idx, segs = _first_cut(buf, iter(all_segs), others)
+        rest = all_segs[len(segs):]
+    if end_idx <= 0:
+        # 未找到截断点（或截断点在开头）：保留全部正文
+        return segs + list(rest)
+    out, base = [], 0
+    for a, b in segs:
+        if base + (b - a) >= end_idx:
+            out.append((a, a + end_idx - base))
+            break
+        out.append((a, b))
+        base += b - a
+    return out
+
+def clean_mda(result: str) -> str:
+    """清洗文本：去除换行符、回车符及制表符，合并连续空白并去除首尾空白。"""
+    return re.sub(r'\s+', ' ', result.replace('\r', '').replace('\n', '').replace('\t', '')).strip()
+
+def extract_mda_text(in_path: str, use_mmap: bool = None):
+    """读取年报并返回清洗后的 MD&A 文本；未找到章节标题返回 None。"""
+    if use_mmap is None:
+        use_mmap = os.path.getsize(in_path) >= MMAP_MIN_BYTES
+    if use_mmap:
+        with open(in_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            segs = locate_mda(mm)
+            if segs is None:
+                return None
+            raw = b''.join(mm[a:b] for a, b in segs)
+        return clean_mda(raw.decode('utf-8', errors='ignore'))
+
+    with open(in_path, 'r', encoding='utf-8', errors='ignore') as f:
+        text = f.read()
+    segs = locate_mda(text)
+    if segs is None:
+        return None
+    if len(segs) == 1:
+        a, b = segs[0]
+        return clean_mda(text[a:b])
+    return clean_mda(''.join(text[a:b] for a, b in segs))
+
+def extract_content(in_path: str, out_dir: str) -> str:
+    """处理单个文件：提取、清洗、保存；启用指标时记录耗时、输入/输出字节数与状态。"""
+    if not metrics.enabled():
+        return _extract_content(in_path, out_dir)
+    t0 = time.perf_counter()
+    status = _extract_content(in_path, out_dir)
+    out_path = output_path(in_path, out_dir)
+    metrics.emit('extract_file', file=os.path.basename(in_path), status=status,
+                 seconds=round(time.perf_counter() - t0, 6), bytes=os.path.getsize(in_path),
+                 out_bytes=os.path.getsize(out_path) if status == 'ok' else 0)
+    return status
+
+def _extract_content(in_path: str, out_dir: str) -> str:
+    out_path = output_path(in_path, out_dir)
+
+    try:
+        result = extract_mda_text(in_path)
+    except Exception: return 'fail'
+    if result is None: return 'skip'
+
+    # 保存
     try:
         os.makedirs(out_dir, exist_ok=True)
         with open(out_path, 'w', encoding='utf-8') as w:
@@ -96,32 +231,263 @@ def extract_content(in_path: str, out_dir: str) -> str:
         return 'ok'
     except: return 'fail'
 
-if __name__ == "__main__":
+# ======== 增量提取清单 ========
+MANIFEST_NAME = 'mda_manifest.json'
+MANIFEST_VERSION = 1
+
+def settings_fingerprint() -> str:
+    """提取配置指纹：标题/截断关键词或清单版本变化时，需要全部重新提取。"""
+    payload = json.dumps({'version': MANIFEST_VERSION, 'title': TITLE_KEYWORDS, 'next': NEXT_KEYWORDS},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def file_digest(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(path: str) -> dict:
+    """读取清单；配置指纹不一致时返回空清单（全部视为过期）。"""
+    fp = settings_fingerprint()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            m = json.load(f)
+    except (OSError, ValueError):
+        return {'settings': fp, 'files': {}, 'reset': False}
+    if m.get('settings') != fp:
+        return {'settings': fp, 'files': {}, 'reset': True, 'previous': m.get('files', {})}
+    m.setdefault('files', {})
+    m['reset'] = False
+    return m
+
+def save_manifest(path: str, manifest: dict):
+    """原子写入清单（先写临时文件再替换）。"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = {'settings': manifest['settings'], 'files': manifest['files']}
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=0)
+    os.replace(tmp, path)
+
+def plan_files(files, manifest: dict, key_of):
+    """
+    对照清单划分待处理文件，返回 (待处理列表, {'hit','miss','stale'} 计数)。
+    - hit：大小与修改时间一致（或内容哈希一致）且上次结果仍在；
+    - miss：清单中无记录；
+    - stale：内容变化、输出缺失或提取配置变化。
+    """
+    records = manifest['files']
+    previous = manifest.get('previous', {})
+    todo, counts = [], {'hit': 0, 'miss': 0, 'stale': 0}
+    for fp in files:
+        key = key_of(fp)
+        rec = records.get(key)
+        if rec is None:
+            counts['stale' if key in previous else 'miss'] += 1
+            todo.append(fp)
+            continue
+        st = os.stat(fp)
+        out_ok = rec.get('status') != 'ok' or os.path.exists(rec.get('out', ''))
+        if out_ok and rec.get('size') == st.st_size and rec.get('mtime') == st.st_mtime_ns:
+            counts['hit'] += 1
+        elif out_ok and rec.get('size') == st.st_size and rec.get('sha1') == file_digest(fp):
+            rec['mtime'] = st.st_mtime_ns   # 仅修改时间变化（如重新拷贝），内容未变
+            counts['hit'] += 1
+        else:
+            counts['stale'] += 1
+            todo.append(fp)
+    return todo, counts
+
+def extract_task(in_path: str, out_dir: str):
+    """进程池任务：提取单个文件，并返回清单所需的文件信息。"""
+    status = extract_content(in_path, out_dir)
+    st = os.stat(in_path)
+    return {'status': status, 'size': st.st_size, 'mtime': st.st_mtime_ns,
+            'sha1': file_digest(in_path), 'out': output_path(in_path, out_dir)}
+
+# 进程池中各 worker 的结果队列（由 run_batches 经 initializer 传入）；串行调用时为 None
+_RESULT_Q = None
+
+def _init_worker(q):
+    global _RESULT_Q
+    _RESULT_Q = q
+
+def extract_batch(tasks):
+    """
+    进程池任务：依次提取一批文件 [(key, in_path, out_dir), ...]，返回 [(key, 结果记录), ...]；
+    在进程池中每个文件完成后还立即放入结果队列，主进程据此逐文件更新进度。
+    """
+    out = []
+    for key, in_path, out_dir in tasks:
+        try:
+            rec = extract_task(in_path, out_dir)
+        except Exception:
+            rec = {'status': 'fail'}
+        out.append((key, rec))
+        if _RESULT_Q is not None:
+            _RESULT_Q.put((key, rec))
+    return out
+
+def make_batches(tasks, chunk_bytes: int = 16 * 1024 * 1024, chunk_files: int = 32):
+    """
+    按文件大小降序排列任务（大报告先跑，缩短尾部空转），
+    并将相邻的小文件打包成批（每批约 chunk_bytes 或 chunk_files 份），减少进程间通信次数。
+    tasks: [(key, in_path, out_dir, size), ...]
+    """
+    batches, cur, cur_bytes = [], [], 0
+    for key, in_path, out_dir, size in sorted(tasks, key=lambda t: t[3], reverse=True):
+        cur.append((key, in_path, out_dir))
+        cur_bytes += size
+        if cur_bytes >= chunk_bytes or len(cur) >= chunk_files:
+            batches.append(cur)
+            cur, cur_bytes = [], 0
+    if cur:
+        batches.append(cur)
+    return batches
+
+def run_batches(batches, workers: int, max_inflight: int = None):
+    """
+    在长驻进程池中执行全部批次，按提交顺序（大文件优先）派发，同时在途的批次不超过 max_inflight；
+    每个文件完成即经结果队列产出 (key, 结果记录)，不必等整批结束。
+    某个 worker 异常退出（如超大报告 OOM）使进程池损坏时，在途批次中尚未产出的文件记为失败
+    （不记入清单，下次运行重试），随后新建进程池继续其余批次。
+    """
+    max_inflight = max_inflight or workers * 4
+    todo = deque(batches)
+    delivered = set()
+
+    def fresh(results):
+        for key, rec in results:
+            if key not in delivered:
+                delivered.add(key)
+                yield key, rec
+
+    def drain(q):
+        out = []
+        while True:
+            try:
+                out.append(q.get_nowait())
+            except queue.Empty:
+                return out
+
+    with mp.Manager() as manager:
+        # Manager 队列：worker 被强制结束时不会留下未释放的锁
+        q = manager.Queue()
+        while todo:
+            inflight = {}
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(q,)) as ex:
+                try:
+                    while todo or inflight:
+                        while todo and len(inflight) < max_inflight:
+                            inflight[ex.submit(extract_batch, todo[0])] = todo[0]
+                            todo.popleft()
+                        done, _ = wait(inflight, timeout=0.2, return_when=FIRST_COMPLETED)
+                        yield from fresh(drain(q))
+                        for fut in done:
+                            batch = inflight.pop(fut)
+                            try:
+                                results = fut.result()
+                            except Exception:
+                                results = [(key, {'status': 'fail'}) for key, _, _ in batch]
+                            yield from fresh(results)
+                except BrokenProcessPool:
+                    print(f"\n⚠️ 有 worker 异常退出，在途批次中未完成的文件记为失败（下次运行重试）；"
+                          f"新建进程池继续剩余 {len(todo)} 批")
+                yield from fresh(drain(q))
+                for batch in inflight.values():
+                    yield from fresh((key, {'status': 'fail'}) for key, _, _ in batch)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--in_base', default=IN_BASE, help='年报 TXT 根目录（含各年度子目录）')
+    ap.add_argument('--out_base', default=OUT_BASE, help='MD&A 段落输出根目录')
+    ap.add_argument('--years', default='2014-2024', help='年份或年份范围，如 2024 或 2014-2024')
+    ap.add_argument('--full', action='store_true', help='忽略增量清单，全部重新提取')
+    ap.add_argument('--manifest', default='', help='增量清单路径（默认 <out_base>/' + MANIFEST_NAME + '）')
+    ap.add_argument('--workers', type=int, default=0, help='并行进程数（0 为 CPU 核数-1）')
+    ap.add_argument('--chunk_mb', type=float, default=16, help='每批任务的文件总大小上限（MB）')
+    ap.add_argument('--chunk_files', type=int, default=32, help='每批任务的文件数上限')
+    metrics.add_args(ap)
+    args = ap.parse_args()
+
+    with metrics.stage_run('extract_mda', args):
+        run(args)
+
+def run(args):
     from tqdm import tqdm
-    
-    years = [str(y) for y in range(2014, 2025)]
-    workers = max(1, (os.cpu_count() or 4) - 1)
+
+    args.manifest = args.manifest or os.path.join(args.out_base, MANIFEST_NAME)
+    y0, _, y1 = args.years.partition('-')
+    years = [str(y) for y in range(int(y0), int(y1 or y0) + 1)]
+    workers = args.workers if args.workers > 0 else max(1, (os.cpu_count() or 4) - 1)
     print(f"🔧 启动多进程提取，并行数：{workers}")
 
+    manifest = load_manifest(args.manifest)
+    if args.full:
+        manifest['files'] = {}
+    elif manifest['reset']:
+        print("⚠️ 提取配置已变化，全部文件将重新提取")
+    totals = {'hit': 0, 'miss': 0, 'stale': 0}
+
+    # 1. 汇总 2014-2024 全部年度子目录的待处理文件
+    tasks, per_dir = [], {}
+    seen = set()
     for year in years:
         # 扫描年度子目录
-        subdirs = [d for d in os.listdir(IN_BASE) if year in d and os.path.isdir(os.path.join(IN_BASE, d))]
+        subdirs = [d for d in sorted(os.listdir(args.in_base)) if year in d and os.path.isdir(os.path.join(args.in_base, d))]
         for subdir in subdirs:
-            in_dir = os.path.join(IN_BASE, subdir)
-            out_dir = os.path.join(OUT_BASE, subdir)
+            if subdir in seen: continue
+            seen.add(subdir)
+            in_dir = os.path.join(args.in_base, subdir)
+            out_dir = os.path.join(args.out_base, subdir)
             
             files = [os.path.join(in_dir, n) for n in os.listdir(in_dir) if n.lower().endswith('.txt')]
             if not files: continue
 
-            print(f"\n📂 处理目录: {subdir} (共 {len(files)} 份)")
-            
-            ok, fail, skip = 0, 0, 0
-            with ProcessPoolExecutor(max_workers=workers) as ex:
-                futures = [ex.submit(extract_content, fp, out_dir) for fp in files]
-                for fut in tqdm(as_completed(futures), total=len(futures), desc=f"{year}进度"):
-                    status = fut.result()
-                    if status == 'ok': ok += 1
-                    elif status == 'fail': fail += 1
-                    else: skip += 1
-            
-            print(f"✅ 完成：成功 {ok}, 失败 {fail}, 跳过 {skip}")
\ No newline at end of file
+            todo, counts = plan_files(files, manifest, lambda fp: f"{subdir}/{os.path.basename(fp)}")
+            for k, v in counts.items():
+                totals[k] += v
+            print(f"📂 目录: {subdir} (共 {len(files)} 份，命中 {counts['hit']}，新增 {counts['miss']}，过期 {counts['stale']})")
+            if not todo: continue
+            per_dir[subdir] = {'ok': 0, 'fail': 0, 'skip': 0, 'total': len(todo)}
+            for fp in todo:
+                tasks.append((f"{subdir}/{os.path.basename(fp)}", fp, out_dir, os.path.getsize(fp)))
+
+    # 2. 单一进程池执行，按文件大小降序分批派发，逐文件回传状态
+    if tasks:
+        batches = make_batches(tasks, int(args.chunk_mb * 1024 * 1024), args.chunk_files)
+        print(f"\n🚀 待提取 {len(tasks)} 份，共 {len(batches)} 批")
+        ok, fail, skip = 0, 0, 0
+        bar = tqdm(total=len(tasks), desc="提取进度")
+        try:
+            for n_done, (key, rec) in enumerate(run_batches(batches, workers), 1):
+                status = rec['status']
+                stat = per_dir[key.split('/', 1)[0]]
+                if status == 'ok': ok += 1; stat['ok'] += 1
+                elif status == 'fail': fail += 1; stat['fail'] += 1
+                else: skip += 1; stat['skip'] += 1
+                # 失败的文件不记入清单，下次运行重试
+                if status == 'fail':
+                    manifest['files'].pop(key, None)
+                else:
+                    manifest['files'][key] = rec
+                bar.update(1)
+                bar.set_postfix(ok=ok, fail=fail, skip=skip)
+                if n_done % 500 == 0:
+                    save_manifest(args.manifest, manifest)
+        finally:
+            # 中途出错或中断时，已完成的文件也写入清单
+            bar.close()
+            save_manifest(args.manifest, manifest)
+
+        for subdir, stat in per_dir.items():
+            print(f"✅ {subdir}：成功 {stat['ok']}, 失败 {stat['fail']}, 跳过 {stat['skip']}")
+        print(f"✅ 完成：成功 {ok}, 失败 {fail}, 跳过 {skip}")
+
+    save_manifest(args.manifest, manifest)
+    print(f"\n📋 增量清单：命中 {totals['hit']}，新增 {totals['miss']}，过期 {totals['stale']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+finbert_infer.py
+FinBERT 句子分类（CPU 批量推理），取代 run.ipynb 中调用的 app\\Finbert_analysis.py，
+输出 risk_Finbert_labeled.csv（原列 + AI_Label_Text / Climate_Risk_Score / AI_Confidence）：
+- 一次性分批分词（不补齐），按 token 长度排序分桶，每批只补齐到批内最长句（动态补齐），
+  并以 batch_size 与 max_tokens（批内句数 × 批内最长长度）共同限制批大小；
+- 完全相同的句子只推理一次；
+- 推理后端：torch（可选 int8 动态量化）或 onnxruntime（可选导出为 int8 量化模型）；
+- 线程数显式设置（--threads / --interop_threads），--workers > 1 时多进程并行，每个进程各用 --threads 个线程。
+用法：
+    python run_code/finbert_infer.py --model models/FinBERT2 --input climaterisk_final_sample.csv --threads 8
+    python run_code/finbert_infer.py --model models/FinBERT2 --backend onnx --quantize --workers 4 --threads 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import metrics
+
+# ================= ⚙️ 配置区域 =================
+INPUT_FILE = r'E:\projects\risk-pipeline\data\output\climaterisk_final_sample.csv'
+OUTPUT_FILE = r'E:\projects\risk-pipeline\data\risk_Finbert_labeled.csv'
+MODEL_DIR = r'E:\projects\risk-pipeline\models\FinBERT2'
+# 分类头第 i 个输出对应的标签
+LABELS = ["暴露", "防范"]
+# Climate_Risk_Score 取该标签的概率
+RISK_LABEL = "暴露"
+
+# ================= 线程设置 =================
+def configure_threads(threads, interop_threads=1):
+    """
+    显式设置推理线程数；需在导入 torch / onnxruntime 之前调用，
+    OpenMP / MKL 在首次初始化后不再读取环境变量。
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    # 分词在主进程一次性完成，推理期间不需要 tokenizers 的线程池
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # 同一进程内只能设置一次（并行任务开始后再设置会报错）
+        pass
+
+# ================= 分词、分桶与补齐 =================
+def load_tokenizer(model_dir):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+
+def tokenize(tokenizer, texts, max_length=256, chunk=10000):
+    """分块分词，只截断不补齐，返回每句的 token id 列表。"""
+    ids = []
+    for lo in range(0, len(texts), chunk):
+        enc = tokenizer(texts[lo:lo + chunk], truncation=True, max_length=max_length,
+                        return_attention_mask=False, return_token_type_ids=False)
+        ids.extend(enc["input_ids"])
+    return ids
+
+def length_buckets(lengths, batch_size=64, max_tokens=8192, sort=True):
+    """
+    把句子划分为批，返回行号数组的列表。sort=True 时按长度从长到短排序后切分，
+    批内长度相近、补齐浪费最少；最长的批最先出现，内存不足会尽早暴露。
+    每批句数不超过 batch_size，且 句数 × 批内最长长度 不超过 max_tokens（至少一句）。
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind="stable") if sort else np.arange(len(lengths))
+    batches = []
+    lo = 0
+    while lo < len(order):
+        hi = lo + 1
+        longest = lengths[order[lo]]
+        while hi < len(order) and hi - lo < batch_size:
+            longest_next = max(longest, lengths[order[hi]])
+            if (hi - lo + 1) * longest_next > max_tokens:
+                break
+            longest = longest_next
+            hi += 1
+        batches.append(order[lo:hi])
+        lo = hi
+    return batches
+
+def pad_batch(seqs, pad_id=0, pad_to=None):
+    """动态补齐：补齐到批内最长句（pad_to 指定时补齐到固定长度），返回 (input_ids, attention_mask)。"""
+    width = pad_to or max(len(s) for s in seqs)
+    ids = np.full((len(seqs), width), pad_id, dtype=np.int64)
+    mask = np.zeros((len(seqs), width), dtype=np.int64)
+    for i, s in enumerate(seqs):
+        ids[i, :len(s)] = s
+        mask[i, :len(s)] = 1
+    return ids, mask
+
+def softmax(logits):
+    z = logits - logits.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+# ================= 推理后端 =================
+class TorchBackend:
+    """transformers 分类模型；quantize=True 时对全部 Linear 层做 int8 动态量化。"""
+
+    def __init__(self, model_dir, quantize=False):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.torch = torch
+        self.model = model
+
+    def __call__(self, ids, mask):
+        with self.torch.inference_mode():
+            out = self.model(input_ids=self.torch.from_numpy(ids), attention_mask=self.torch.from_numpy(mask))
+        return out.logits.float().numpy()
+
+class OnnxBackend:
+    """onnxruntime CPU 推理；线程数写入 SessionOptions，与进程级设置一致。"""
+
+    def __init__(self, onnx_path, threads=1):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+        so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sess = ort.InferenceSession(onnx_path, so, providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+
+    def __call__(self, ids, mask):
+        feed = {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+        return self.sess.run(None, {k: v for k, v in feed.items() if k in self.inputs})[0]
+
+def onnx_path_for(model_dir, quantize):
+    return os.path.join(model_dir, "model.int8.onnx" if quantize else "model.onnx")
+
+def export_onnx(model_dir, onnx_path, quantize=False):
+    """导出 ONNX（batch 与序列长度为动态维度）；quantize=True 时再做 int8 动态量化（权重 QInt8）。"""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    enc = AutoTokenizer.from_pretrained(model_dir)(["气候变化带来的物理风险"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in enc]
+    fp32_path = onnx_path_for(model_dir, False)
+    if not os.path.exists(fp32_path):
+        axes = {n: {0: "batch", 1: "seq"} for n in names}
+        axes["logits"] = {0: "batch"}
+        with torch.inference_mode():
+            torch.onnx.export(model, tuple(enc[n] for n in names), fp32_path, input_names=names,
+                              output_names=["logits"], dynamic_axes=axes, opset_version=14)
+        print(f"[OK] 已导出 ONNX：{fp32_path}")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QInt8)
+        print(f"[OK] 已量化为 int8：{onnx_path}")
+
+def ensure_onnx(spec):
+    """onnx 后端：模型不存在时先导出（在主进程完成，避免多个推理进程同时导出）。"""
+    path = onnx_path_for(spec["model"], spec["quantize"])
+    if not os.path.exists(path):
+        export_onnx(spec["model"], path, spec["quantize"])
+    return path
+
+def make_backend(spec):
+    """spec：backend（torch / onnx）、model、quantize、threads。"""
+    if spec["backend"] == "onnx":
+        return OnnxBackend(ensure_onnx(spec), spec["threads"])
+    return TorchBackend(spec["model"], spec["quantize"])
+
+# ================= 批量推理 =================
+_BACKEND = None
+_SPEC = None
+_PAD_ID = 0
+
+def _init_worker(spec, pad_id):
+    """加载推理后端；单进程模式下同一 spec 重复调用时复用已加载的模型。"""
+    global _BACKEND, _SPEC, _PAD_ID
+    if spec != _SPEC:
+        configure_threads(spec["threads"], spec.get("interop_threads", 1))
+        _BACKEND = make_backend(spec)
+        _SPEC = dict(spec)
+    _PAD_ID = pad_id
+
+def _run_batches(task):
+    """task：[(行号数组, token 列表, pad_to), ...] -> [(行号数组, 概率矩阵), ...]"""
+    out = []
+    for rows, seqs, pad_to in task:
+        t0 = time.perf_counter()
+        ids, mask = pad_batch(seqs, _PAD_ID, pad_to)
+        out.append((rows, softmax(_BACKEND(ids, mask))))
+        if metrics.enabled():
+            metrics.emit("finbert_batch", seconds=round(time.perf_counter() - t0, 6), sentences=len(rows),
+                         padded_tokens=int(ids.size), tokens=int(mask.sum()))
+    return out
+
+def predict(token_ids, spec, pad_id=0, batch_size=64, max_tokens=8192, workers=1, bucket=True, progress=True):
+    """
+    对已分词的句子做批量推理，返回概率矩阵 (句子数, 类别数)，行顺序与输入一致。
+    bucket=False 时保持原顺序并补齐到 max_length（对照用的朴素批处理）。
+    """
+    lengths = [len(s) for s in token_ids]
+    pad_to = None if bucket else spec.get("max_length")
+    batches = length_buckets(lengths, batch_size, max_tokens if bucket else 1 << 62, sort=bucket)
+    tasks, task = [], []
+    for rows in batches:
+        task.append((rows, [token_ids[i] for i in rows], pad_to))
+        # 每个任务 4 批；任务按从长到短的顺序分发，进程空闲即领取下一个，负载大致均衡
+        if len(task) >= 4:
+            tasks.append(task)
+            task = []
+    if task:
+        tasks.append(task)
+
+    if spec["backend"] == "onnx":
+        ensure_onnx(spec)
+    probs = None
+    bar = tqdm(total=len(token_ids), desc="FinBERT", disable=not progress)
+
+    def collect(result):
+        nonlocal probs
+        for rows, p in result:
+            if probs is None:
+                probs = np.zeros((len(token_ids), p.shape[1]), dtype=np.float32)
+            probs[rows] = p
+            bar.update(len(rows))
+
+    if workers <= 1:
+        _init_worker(spec, pad_id)
+        for t in tasks:
+            collect(_run_batches(t))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn：子进程不继承父进程已初始化的 OpenMP 线程池
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(spec, pad_id)) as ex:
+            for result in ex.map(_run_batches, tasks):
+                collect(result)
+    bar.close()
+    return probs
+
+def padding_efficiency(lengths, batches, pad_to=None):
+    """有效 token 数 / 补齐后的 token 数。"""
+    lengths = np.asarray(lengths)
+    real = int(lengths.sum())
+    padded = sum(len(b) * (pad_to or int(lengths[b].max())) for b in batches)
+    return real / max(padded, 1)
+
+def apply_labels(df, probs, labels=LABELS, risk_label=RISK_LABEL):
+    """概率矩阵 -> AI_Label_Text（最大概率标签）、Climate_Risk_Score（风险标签概率）、AI_Confidence（最大概率）。"""
+    if probs.shape[1] != len(labels):
+        raise ValueError(f"❌ 模型输出 {probs.shape[1]} 类，与标签 {labels} 数量不一致")
+    df = df.copy()
+    best = probs.argmax(axis=1)
+    df["AI_Label_Text"] = np.asarray(labels, dtype=object)[best]
+    df["Climate_Risk_Score"] = probs[:, labels.index(risk_label)] if risk_label in labels else np.nan
+    df["AI_Confidence"] = probs.max(axis=1)
+    return df
+
+def label_texts(texts, spec, batch_size=64, max_tokens=8192, workers=1, n_labels=len(LABELS)):
+    """句子列表 -> 概率矩阵；相同句子只推理一次。没有句子时返回 (0, n_labels) 的空矩阵，不加载模型。"""
+    codes, uniq = pd.factorize(pd.Series(texts, dtype=object).fillna("").astype(str))
+    if len(uniq) == 0:
+        return np.zeros((0, n_labels), dtype=np.float32)
+    t0 = time.time()
+    tokenizer = load_tokenizer(spec["model"])
+    token_ids = tokenize(tokenizer, list(uniq), spec.get("max_length", 256))
+    t_tok = time.time() - t0
+    lengths = [len(s) for s in token_ids]
+    eff = padding_efficiency(lengths, length_buckets(lengths, batch_size, max_tokens))
+    print(f"[INFO] {len(texts)} 句（去重后 {len(uniq)} 句），分词耗时 {t_tok:.1f}s，"
+          f"平均 {np.mean(lengths) if lengths else 0:.0f} token，分桶后补齐有效率 {eff:.1%}")
+
+    t0 = time.time()
+    probs = predict(token_ids, spec, tokenizer.pad_token_id or 0, batch_size, max_tokens, workers)
+    t_inf = time.time() - t0
+    print(f"[INFO] 推理耗时 {t_inf:.1f}s（{len(uniq) / max(t_inf, 1e-9):.1f} 句/秒），"
+          f"后端 {spec['backend']}{'-int8' if spec['quantize'] else ''}，"
+          f"{workers} 个进程 × {spec['threads']} 线程")
+    return probs[codes]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=INPUT_FILE, help="待分类句子 CSV")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="输出 CSV（追加 AI_Label_Text / Climate_Risk_Score / AI_Confidence）")
+    ap.add_argument("--column", default="句子", help="句子列名")
+    ap.add_argument("--model", default=MODEL_DIR, help="FinBERT 分类模型目录（transformers 格式）")
+    ap.add_argument("--labels", default=",".join(LABELS), help="分类头各输出对应的标签（逗号分隔）")
+    ap.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="推理后端")
+    ap.add_argument("--quantize", action="store_true", help="int8 动态量化（torch：Linear 层；onnx：导出后量化）")
+    ap.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="每个进程的推理线程数")
+    ap.add_argument("--interop_threads", type=int, default=1, help="torch 算子间并行线程数")
+    ap.add_argument("--workers", type=int, default=1, help="推理进程数（各自加载一份模型）")
+    ap.add_argument("--batch_size", type=int, default=64, help="每批最多句数")
+    ap.add_argument("--max_tokens", type=int, default=8192, help="每批 句数 × 最长长度 上限")
+    ap.add_argument("--max_length", type=int, default=256, help="截断长度（token）")
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run("finbert", args):
+        run(args)
+
+def run(args):
+    configure_threads(args.threads, args.interop_threads)
+    spec = {"backend": args.backend, "model": args.model, "quantize": args.quantize,
+            "threads": args.threads, "interop_threads": args.interop_threads, "max_length": args.max_length}
+    df = pd.read_csv(args.input, encoding="utf-8-sig")
+    print(f"🚀 FinBERT 推理：{len(df)} 句 -> {args.output}")
+    labels = args.labels.split(",")
+    probs = label_texts(df[args.column].tolist(), spec, args.batch_size, args.max_tokens, args.workers, len(labels))
+    df = apply_labels(df, probs, labels)
+    df.to_csv(args.output, index=False, encoding="utf-8-sig")
+    print(df["AI_Label_Text"].value_counts().to_string())
+    print(f"✅ 完成，已保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+ingest_pdf.py
+年报 PDF -> TXT 转换（extract_mda 的上游步骤）：
+- 输出文件名符合 extract_mda.FNAME_RE：<代码>_<年份>_<公司>_<标题>_<披露日>.txt，
+  由 PDF 文件名解析（已是该格式的直接沿用；否则识别 6 位代码、“XXXX年年度报告”标题与日期）；
+- 多进程并行，每个文件逐页提取、逐页写出，500 页的银行年报也不会整体驻留内存；
+- --skip_financial：MD&A 之后遇到“第X节 财务报告”章节标题即停止，省去占篇幅大半的财务报表页；
+  仅在 MD&A 标题已作为独占一行的章节标题出现（目录页、重要提示中的引用不算），且其后已出现截断章节
+  （NEXT_KEYWORDS）时才停止，不影响 extract_mda 的提取结果；--verify 另行全文转换，逐份核对两者的提取结果；
+- 增量：<out_base>/ingest_manifest.json 记录每个 PDF 的大小/修改时间/sha1、页数与转换耗时，重跑只转换新增/变化的文件；
+- PDF 库按 PyMuPDF > pypdfium2 > pdfminer.six > pypdf 的顺序使用已安装的一个（均可离线运行，pypdf 为纯 Python）。
+目录结构：<in_base>/<年度子目录>/*.pdf -> <out_base>/<年度子目录>/*.txt；直接放在 in_base 下的 PDF 输出到 <年份>_年报/。
+用法：
+    python run_code/ingest_pdf.py --in_base data/annual_pdf --out_base data/annual_txt --years 2024 --workers 8 --skip_financial
+    python run_code/extract_mda.py --in_base data/annual_txt --out_base data/output --years 2024
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from extract_mda import FNAME_RE, TITLE_KEYWORDS, NEXT_KEYWORDS, extract_mda_text, file_digest, plan_files, save_manifest
+
+MANIFEST_NAME = "ingest_manifest.json"
+MANIFEST_VERSION = 2
+BACKENDS = ["pymupdf", "pdfium", "pdfminer", "pypdf"]
+BACKEND_MODULES = {"pymupdf": "fitz", "pdfium": "pypdfium2", "pdfminer": "pdfminer", "pypdf": "pypdf"}
+# 财务报告章节标题（独占一行，不含目录中的引导点与页码）
+FINANCIAL_RE = re.compile(r'^\s*第[一二三四五六七八九十]+[节章]\s*财务报告\s*$', re.M)
+# MD&A 章节标题：独占一行，可带“第X节”前缀；目录行（引导点 + 页码）与正文中的引用都不匹配
+MDA_HEADING_RE = re.compile(r'^\s*(?:第[一二三四五六七八九十]+[节章])?\s*(?:' + '|'.join(TITLE_KEYWORDS) + r')\s*$', re.M)
+# 目录页：多个“第X节”行（部分 PDF 库把引导点与页码拆到别处，单看一行无法区分）
+CHAPTER_LINE_RE = re.compile(r'^\s*第[一二三四五六七八九十]+[节章]', re.M)
+TOC_MIN_CHAPTERS = 3
+ILLEGAL_CHARS = re.compile(r'[\\/:*?"<>|\s]')
+
+# ================= 文件名 =================
+def txt_name(pdf_path: str):
+    """
+    由 PDF 文件名得到符合 FNAME_RE 的 TXT 文件名；无法识别代码或年份时返回 None。
+    常见来源：000001_2024_平安银行_2024年年度报告_2025-03-15.pdf、000001_平安银行_2024年年度报告_2025-03-15.pdf、
+    平安银行：2024年年度报告(000001).pdf 等。缺少披露日期时取 PDF 的修改日期。
+    """
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    if FNAME_RE.match(stem + ".txt"):
+        return stem + ".txt"
+    m_code = re.search(r'(?<!\d)(\d{6})(?!\d)', stem)
+    m_date = re.search(r'((?:19|20)\d{2})[-.]?(\d{2})[-.]?(\d{2})(?!\d)', stem)
+    if m_code is None:
+        return None
+    rest = stem.replace(m_code.group(0), "_")
+    if m_date:
+        date = f"{m_date.group(1)}-{m_date.group(2)}-{m_date.group(3)}"
+        rest = rest.replace(m_date.group(0), "_")
+    else:
+        date = time.strftime("%Y-%m-%d", time.localtime(os.path.getmtime(pdf_path)))
+    tokens = [t for t in re.split(r'[_\s：:()（）\[\]【】]+', rest) if t]
+    title = next((t for t in tokens if "年度报告" in t or "年报" in t), "年度报告")
+    m_year = re.search(r'((?:19|20)\d{2})\s*年', title) or next(
+        (re.fullmatch(r'((?:19|20)\d{2})', t) for t in tokens if re.fullmatch(r'((?:19|20)\d{2})', t)), None)
+    if m_year:
+        year = m_year.group(1)
+    elif m_date:
+        year = str(int(date[:4]) - 1)     # 年报在次年披露
+    else:
+        return None
+    company = next((t for t in tokens if t != title and not re.fullmatch(r'\d+', t)), "")
+    company = ILLEGAL_CHARS.sub("", company).replace("_", "") or "未知公司"
+    title = ILLEGAL_CHARS.sub("", title).replace("_", "-")
+    name = f"{m_code.group(1)}_{year}_{company}_{title}_{date}.txt"
+    return name if FNAME_RE.match(name) else None
+
+# ================= PDF 读取 =================
+def available_backend(prefer: str = "auto"):
+    """返回可用的 PDF 库名称；指定的库未安装或一个都没有时返回 None。"""
+    import importlib.util
+    for name in (BACKENDS if prefer == "auto" else [prefer]):
+        if importlib.util.find_spec(BACKEND_MODULES[name]) is not None:
+            return name
+    return None
+
+def iter_pages(path: str, backend: str):
+    """逐页产出页面文本（生成器），同一时刻只解析一页。"""
+    if backend == "pymupdf":
+        import fitz
+        with fitz.open(path) as doc:
+            for i in range(doc.page_count):
+                yield doc.load_page(i).get_text("text")
+    elif backend == "pdfium":
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                tp = page.get_textpage()
+                try:
+                    yield tp.get_text_range()
+                finally:
+                    tp.close()
+                    page.close()
+        finally:
+            pdf.close()
+    elif backend == "pdfminer":
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        for layout in extract_pages(path):
+            yield "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+    elif backend == "pypdf":
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        for i in range(len(reader.pages)):
+            yield reader.pages[i].extract_text() or ""
+    else:
+        raise ValueError(f"未知的 PDF 库: {backend}")
+
+class FinancialCut:
+    """
+    逐页判断是否可以停止：MD&A 标题作为章节标题出现后又出现了 NEXT_KEYWORDS（MD&A 已结束），
+    且当前页是“第X节 财务报告”章节首页。目录页与重要提示中的标题引用不会使其生效。
+    """
+
+    def __init__(self):
+        self.mda_seen = False
+        self.mda_closed = False
+
+    def feed(self, page: str) -> bool:
+        if not self.mda_closed:
+            if len(CHAPTER_LINE_RE.findall(page)) >= TOC_MIN_CHAPTERS:
+                return False
+            pos = -1
+            if not self.mda_seen:
+                m = MDA_HEADING_RE.search(page)
+                if m is None:
+                    return False
+                self.mda_seen, pos = True, m.end()
+            if any(page.find(nt, max(pos, 0)) != -1 for nt in NEXT_KEYWORDS):
+                self.mda_closed = True
+            return False
+        return FINANCIAL_RE.search(page) is not None
+
+def write_pages(pdf_path: str, out_path: str, backend: str, cut=None):
+    """逐页写出 PDF 文本到 out_path（先写临时文件，完成后原子替换），返回 (页数, 停止页码或 None)。"""
+    pages, skipped_from = 0, None
+    tmp = out_path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as w:
+            for text in iter_pages(pdf_path, backend):
+                if cut is not None and cut.feed(text):
+                    skipped_from = pages + 1
+                    break
+                w.write(text)
+                if not text.endswith("\n"):
+                    w.write("\n")
+                pages += 1
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return pages, skipped_from
+
+def convert_pdf(task):
+    """
+    进程池任务：task = (key, pdf路径, txt路径, PDF 库, 是否跳过财务报告)。
+    先写临时文件，完成后原子替换；返回 (key, 记录)。
+    """
+    key, pdf_path, out_path, backend, skip_financial = task
+    t0 = time.perf_counter()
+    st = os.stat(pdf_path)
+    rec = {"size": st.st_size, "mtime": st.st_mtime_ns, "out": out_path, "pages": 0, "skipped_from": None}
+    try:
+        rec["pages"], rec["skipped_from"] = write_pages(pdf_path, out_path, backend,
+                                                        FinancialCut() if skip_financial else None)
+        rec["status"] = "ok"
+        rec["out_bytes"] = os.path.getsize(out_path)
+    except Exception as e:
+        rec["status"] = "fail"
+        rec["error"] = f"{type(e).__name__}: {e}"[:200]
+    rec["seconds"] = round(time.perf_counter() - t0, 3)
+    rec["sha1"] = file_digest(pdf_path)
+    metrics.emit("pdf_file", file=os.path.basename(pdf_path), status=rec["status"], seconds=rec["seconds"],
+                 bytes=st.st_size, pages=rec["pages"], out_bytes=rec.get("out_bytes", 0),
+                 skipped=rec["skipped_from"] is not None)
+    return key, rec
+
+def verify_cut(task):
+    """
+    进程池任务：task = (key, pdf路径, txt路径, PDF 库)。把 PDF 全文另行转换到临时文件，
+    比较两者经 extract_mda 提取的 MD&A 是否一致；返回 (key, 是否一致)。
+    """
+    key, pdf_path, out_path, backend = task
+    full = out_path + ".full"
+    try:
+        write_pages(pdf_path, full, backend)
+        return key, extract_mda_text(out_path) == extract_mda_text(full)
+    finally:
+        try:
+            os.remove(full)
+        except OSError:
+            pass
+
+def run_tasks(tasks, workers: int, max_inflight: int = None):
+    """
+    大文件优先派发，同时在途的任务不超过 max_inflight；每完成一个文件即产出 (key, 记录)。
+    worker 异常退出（PDF 库在畸形文件上崩溃）使进程池损坏时，在途文件记为失败（下次运行重试），
+    随后新建进程池继续其余文件。
+    """
+    tasks = sorted(tasks, key=lambda t: os.path.getsize(t[1]), reverse=True)
+    if workers <= 1:
+        yield from map(convert_pdf, tasks)
+        return
+    max_inflight = max_inflight or workers * 2
+    todo = deque(tasks)
+    while todo:
+        inflight = {}
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            try:
+                while todo or inflight:
+                    while todo and len(inflight) < max_inflight:
+                        inflight[ex.submit(convert_pdf, todo[0])] = todo[0]
+                        todo.popleft()
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        task = inflight.pop(fut)
+                        try:
+                            yield fut.result()
+                        except Exception as e:
+                            yield task[0], {"status": "fail", "error": type(e).__name__}
+            except BrokenProcessPool:
+                print(f"\n[WARN] 有 worker 异常退出，在途文件记为失败（下次运行重试）；新建进程池继续剩余 {len(todo)} 份")
+            for task in inflight.values():
+                yield task[0], {"status": "fail", "error": "BrokenProcessPool"}
+
+# ================= 增量清单 =================
+def settings_fingerprint(backend: str, skip_financial: bool) -> str:
+    """转换配置指纹：PDF 库（各库的文本顺序/空白略有差异）或 --skip_financial 变化时需要全部重新转换。"""
+    payload = json.dumps({"version": MANIFEST_VERSION, "backend": backend, "skip_financial": bool(skip_financial),
+                          "title": TITLE_KEYWORDS, "next": NEXT_KEYWORDS}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def load_manifest(path: str, settings: str) -> dict:
+    """读取清单；配置指纹不一致时返回空清单（全部视为过期）。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            m = json.load(f)
+    except (OSError, ValueError):
+        return {"settings": settings, "files": {}, "reset": False}
+    if m.get("settings") != settings:
+        return {"settings": settings, "files": {}, "reset": True, "previous": m.get("files", {})}
+    m.setdefault("files", {})
+    m["reset"] = False
+    return m
+
+def collect(in_base: str, out_base: str, years):
+    """
+    收集待转换的 PDF：in_base 下名称含年份的子目录 + 直接放在 in_base 下、按文件名解析出的年份在范围内的 PDF。
+    返回 ([(key, pdf路径, txt路径), ...], 无法识别文件名的 PDF 列表)。
+    """
+    out, bad = [], []
+    entries = sorted(os.listdir(in_base))
+    for d in entries:
+        sub = os.path.join(in_base, d)
+        if os.path.isdir(sub) and any(y in d for y in years):
+            for n in sorted(os.listdir(sub)):
+                if n.lower().endswith(".pdf"):
+                    name = txt_name(os.path.join(sub, n))
+                    if name is None:
+                        bad.append(os.path.join(sub, n))
+                    else:
+                        out.append((f"{d}/{n}", os.path.join(sub, n), os.path.join(out_base, d, name)))
+    for n in entries:
+        p = os.path.join(in_base, n)
+        if os.path.isfile(p) and n.lower().endswith(".pdf"):
+            name = txt_name(p)
+            if name is None:
+                bad.append(p)
+            elif name.split("_")[1] in years:
+                year = name.split("_")[1]
+                out.append((n, p, os.path.join(out_base, f"{year}_年报", name)))
+    return out, bad
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_base", required=True, help="年报 PDF 根目录（年度子目录，或直接存放 PDF）")
+    ap.add_argument("--out_base", required=True, help="TXT 输出根目录（即 extract_mda 的 --in_base）")
+    ap.add_argument("--years", default="2014-2024", help="年份或年份范围，如 2024 或 2014-2024")
+    ap.add_argument("--workers", type=int, default=0, help="并行进程数（0 为 CPU 核数-1）")
+    ap.add_argument("--backend", default="auto", choices=["auto"] + BACKENDS, help="PDF 库（默认自动选择已安装的）")
+    ap.add_argument("--skip_financial", action="store_true", help="MD&A 之后遇到财务报告章节即停止转换")
+    ap.add_argument("--verify", action="store_true",
+                    help="与 --skip_financial 同用：对提前停止的文件另行全文转换，核对 extract_mda 的提取结果是否一致")
+    ap.add_argument("--full", action="store_true", help="忽略增量清单，全部重新转换")
+    ap.add_argument("--manifest", default="", help="增量清单路径（默认 <out_base>/" + MANIFEST_NAME + "）")
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run("ingest", args):
+        run(args)
+
+def run(args):
+    from tqdm import tqdm
+
+    backend = available_backend(args.backend)
+    if backend is None:
+        want = "、".join(BACKEND_MODULES.values()) if args.backend == "auto" else BACKEND_MODULES[args.backend]
+        print(f"[ERR] 未安装可用的 PDF 库（{want}），可 pip install pymupdf 或 pypdf")
+        raise SystemExit(1)
+    y0, _, y1 = args.years.partition("-")
+    years = [str(y) for y in range(int(y0), int(y1 or y0) + 1)]
+    workers = args.workers if args.workers > 0 else max(1, (os.cpu_count() or 4) - 1)
+    manifest_path = args.manifest or os.path.join(args.out_base, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path, settings_fingerprint(backend, args.skip_financial))
+    if args.full:
+        manifest["files"] = {}
+    elif manifest["reset"]:
+        print("[WARN] PDF 库或 --skip_financial 设置已变化，全部文件将重新转换")
+
+    items, bad = collect(args.in_base, args.out_base, years)
+    for p in bad[:10]:
+        print(f"[WARN] 无法从文件名识别代码/年份，跳过：{os.path.basename(p)}")
+    if len(bad) > 10:
+        print(f"[WARN] ……共 {len(bad)} 个文件名无法识别")
+    by_path = {p: (key, out) for key, p, out in items}
+    todo, counts = plan_files(list(by_path), manifest, key_of=lambda p: by_path[p][0])
+    print(f"[INFO] PDF 库 {backend}，并行 {workers}；共 {len(items)} 份，命中 {counts['hit']}，"
+          f"新增 {counts['miss']}，过期 {counts['stale']}")
+
+    tasks = [(by_path[p][0], p, by_path[p][1], backend, args.skip_financial) for p in todo]
+    ok = fail = 0
+    pages = n_skipped_files = 0
+    t0 = time.time()
+    bar = tqdm(total=len(tasks), desc="转换进度")
+    try:
+        for n_done, (key, rec) in enumerate(run_tasks(tasks, workers), 1):
+            if rec["status"] == "ok":
+                ok += 1
+                pages += rec["pages"]
+                manifest["files"][key] = rec
+            else:
+                # 失败的文件不记入清单，下次运行重试
+                fail += 1
+                manifest["files"].pop(key, None)
+                print(f"[ERR] {key}：{rec.get('error', '')}")
+            if rec.get("skipped_from"):
+                n_skipped_files += 1
+            bar.update(1)
+            bar.set_postfix(ok=ok, fail=fail)
+            if n_done % 200 == 0:
+                save_manifest(manifest_path, manifest)
+    finally:
+        # 中途出错或中断时，已完成的转换也写入清单
+        bar.close()
+        save_manifest(manifest_path, manifest)
+
+    elapsed = time.time() - t0
+    if tasks:
+        slow = sorted(((r.get("seconds", 0), k, r.get("pages", 0)) for k, r in manifest["files"].items()
+                       if k in {t[0] for t in tasks}), reverse=True)[:5]
+        print(f"[INFO] 耗时最长：" + "；".join(f"{k}（{p} 页，{s:.1f}s）" for s, k, p in slow))
+        print(f"[DONE] 成功 {ok}，失败 {fail}，共 {pages} 页，{pages / max(elapsed, 1e-9):.1f} 页/秒，"
+              f"{n_skipped_files} 份跳过了财务报告，耗时 {elapsed:.1f}s")
+    else:
+        print("[DONE] 没有需要转换的文件")
+
+    if args.verify:
+        verify(args, items, manifest, backend, workers)
+
+def verify(args, items, manifest, backend: str, workers: int):
+    """核对 --skip_financial：提前停止的文件与全文转换的 extract_mda 结果应完全一致，不一致时以退出码 1 结束。"""
+    if not args.skip_financial:
+        print("[WARN] --verify 仅在 --skip_financial 时有意义，跳过核对")
+        return
+    checks = [(key, p, out, backend) for key, p, out in items
+              if manifest["files"].get(key, {}).get("skipped_from")]
+    if not checks:
+        print("[INFO] 没有跳过财务报告的文件，无需核对")
+        return
+    t0 = time.time()
+    if workers > 1 and len(checks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(verify_cut, checks))
+    else:
+        results = [verify_cut(t) for t in checks]
+    bad = [key for key, same in results if not same]
+    for key in bad[:10]:
+        print(f"[ERR] 提取结果与全文转换不一致：{key}")
+    if bad:
+        print(f"[ERR] 核对 {len(results)} 份，{len(bad)} 份不一致，耗时 {time.time() - t0:.1f}s")
+        raise SystemExit(1)
+    print(f"[OK] 核对 {len(results)} 份，extract_mda 结果与全文转换一致，耗时 {time.time() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-import os, re, json, argparse, glob, unicodedata
+import os, re, json, argparse, glob, unicodedata, hashlib, time
 import pandas as pd
 
+import metrics
+
 def try_imports():
     mods = {}
     try:
@@ -67,13 +69,172 @@ def build_corpus(paths, jieba=None):
             docs.append(toks)
     return docs
 
-def load_pretrained_any(path, KeyedVectors):
+# ---------- streaming corpus with on-disk token cache ----------
+SENT_SPLIT_RE = re.compile(r"[。！？!?；;\n]+")
+TOKENIZER_TAG = "jieba-sent-v1"
+
+def list_corpus_files(paths):
+    files = []
+    for p in paths or []:
+        if not os.path.isdir(p):
+            continue
+        for fn in sorted(os.listdir(p)):
+            if fn.lower().endswith(".txt"):
+                files.append(os.path.join(p, fn))
+    return files
+
+def token_cache_path(path, cache_dir, tag):
+    """按 (绝对路径, 大小, 修改时间, 分词器标识) 命名缓存文件，源文件变化后自动失效。"""
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}\x1f{st.st_size}\x1f{st.st_mtime_ns}\x1f{tag}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".tok")
+
+_WORKER_JIEBA = None
+
+def _init_tokenizer(use_jieba):
+    global _WORKER_JIEBA
+    if use_jieba:
+        import jieba
+        jieba.setLogLevel(60)
+        jieba.initialize()
+        _WORKER_JIEBA = jieba
+
+def tokenize_file(task):
+    """
+    子进程：把一个 .txt 按句切分、分词后写入缓存（每行一句，词之间以空格分隔）。
+    先写临时文件再改名，中断后重跑只会补齐缺失的文件。返回写入的句数。
+    """
+    src, dst = task
+    try:
+        with open(src, "r", encoding="utf-8", errors="ignore") as fh:
+            text = fh.read()
+    except OSError:
+        text = ""
+    n = 0
+    tmp = f"{dst}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for sent in SENT_SPLIT_RE.split(text):
+            toks = [t for t in tokenize(sent, _WORKER_JIEBA) if not re.search(r"\s", t)]
+            if toks:
+                out.write(" ".join(toks) + "\n")
+                n += 1
+    os.replace(tmp, dst)
+    return n
+
+class CorpusStream:
+    """
+    可重复迭代的句子流，供 Word2Vec 多轮遍历：
+    首次迭代时用进程池对未缓存的文件分词并落盘，之后每轮直接逐行读取缓存，不再调用 jieba；
+    任意时刻内存中只保留一句。
+    """
+
+    def __init__(self, paths, cache_dir="./token_cache", use_jieba=True, workers=None):
+        self.paths = paths
+        self.cache_dir = cache_dir
+        self.use_jieba = use_jieba
+        self.tag = TOKENIZER_TAG if use_jieba else "regex-sent-v1"
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.cache_files = None
+
+    def prepare(self):
+        if self.cache_files is not None:
+            return self.cache_files
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tasks = [(f, token_cache_path(f, self.cache_dir, self.tag)) for f in list_corpus_files(self.paths)]
+        todo = [t for t in tasks if not os.path.exists(t[1])]
+        print(f"[INFO] 语料文件 {len(tasks)} 个，分词缓存命中 {len(tasks) - len(todo)}，待分词 {len(todo)}")
+        if todo:
+            t0 = time.time()
+            if self.workers > 1 and len(todo) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(self.workers, initializer=_init_tokenizer,
+                                         initargs=(self.use_jieba,)) as ex:
+                    n = sum(ex.map(tokenize_file, todo, chunksize=4))
+            else:
+                _init_tokenizer(self.use_jieba)
+                n = sum(map(tokenize_file, todo))
+            print(f"[OK] 分词完成：{n} 句，耗时 {time.time() - t0:.1f}s")
+        self.cache_files = [dst for _, dst in tasks]
+        return self.cache_files
+
+    def __iter__(self):
+        for path in self.prepare():
+            with open(path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    toks = line.split()
+                    if toks:
+                        yield toks
+
+    def __bool__(self):
+        return any(os.path.getsize(p) > 0 for p in self.prepare())
+
+# ---------- pretrained vectors & mmap cache ----------
+def source_fingerprint(path, chunk=1 << 24):
+    """源向量文件的内容哈希（sha1）。按 (大小, 修改时间) 记录在旁路 JSON 中，文件未变时不重复计算。"""
+    st = os.stat(path)
+    side = path + ".sha1.json"
+    try:
+        with open(side, "r", encoding="utf-8") as f:
+            rec = json.load(f)
+        if rec.get("size") == st.st_size and rec.get("mtime") == st.st_mtime_ns:
+            return rec["sha1"]
+    except (OSError, ValueError, KeyError):
+        pass
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    try:
+        with open(side, "w", encoding="utf-8") as f:
+            json.dump({"size": st.st_size, "mtime": st.st_mtime_ns, "sha1": digest}, f)
+    except OSError:
+        pass
+    return digest
+
+def cached_kv_path(path, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{stem}.{source_fingerprint(path)[:16]}.kv")
+
+def save_kv_cache(kv, kv_path):
+    """
+    以原生格式保存（vectors/norms 单独存为 .npy，便于 mmap），先写临时名再改名，避免并发任务读到半成品。
+    """
+    os.makedirs(os.path.dirname(kv_path) or ".", exist_ok=True)
+    kv.fill_norms()
+    tmp = f"{kv_path}.tmp{os.getpid()}"
+    kv.save(tmp, separately=["vectors", "norms"])
+    for suffix in (".vectors.npy", ".norms.npy"):
+        if os.path.exists(tmp + suffix):
+            os.replace(tmp + suffix, kv_path + suffix)
+    os.replace(tmp, kv_path)
+
+def load_pretrained_any(path, KeyedVectors, cache_dir=None):
+    """
+    加载预训练向量。.kv 直接 mmap 打开；.txt/.bin 在给定 cache_dir 时首次解析后转存为原生 .kv 缓存
+    （按源文件哈希命名，含预先计算的范数），之后以 mmap='r' 打开，多个任务通过系统页缓存共享内存。
+    """
     if KeyedVectors is None:
         return None
     if path.endswith(".kv"):
         return KeyedVectors.load(path, mmap='r')
+    kv_path = cached_kv_path(path, cache_dir) if cache_dir else None
+    if kv_path and os.path.exists(kv_path):
+        print("[INFO] 使用向量缓存：", kv_path)
+        return KeyedVectors.load(kv_path, mmap='r')
     binary = path.endswith(".bin")
-    return KeyedVectors.load_word2vec_format(path, binary=binary)
+    t0 = time.time()
+    kv = KeyedVectors.load_word2vec_format(path, binary=binary)
+    print(f"[INFO] 文本格式向量解析耗时 {time.time() - t0:.1f}s")
+    if kv_path:
+        try:
+            save_kv_cache(kv, kv_path)
+            print("[OK] 已写入向量缓存：", kv_path)
+            del kv
+            return KeyedVectors.load(kv_path, mmap='r')
+        except OSError as e:
+            print("[WARN] 向量缓存写入失败：", e)
+    return kv
 
 def train_or_load_w2v(docs, model_path, Word2Vec):
     if Word2Vec is None:
@@ -169,7 +330,10 @@ def expand_for_seed(model_like, word, topn=10, blacklist=None):
         except Exception:
             pass
 
-    # dedup + filter
+    return finalize_results(results, topn, blacklist)
+
+def finalize_results(results, topn=10, blacklist=None):
+    """dedup + filter：同一扩展词取最高相似度，去掉黑名单与纯符号词。"""
     uniq = {}
     for w, s in results:
         if blacklist and w in blacklist:
@@ -183,6 +347,88 @@ def expand_for_seed(model_like, word, topn=10, blacklist=None):
     out = sorted(uniq.items(), key=lambda x: x[1], reverse=True)[:topn]
     return out
 
+# ---------- batched expansion ----------
+def build_queries(kv, words):
+    """
+    为全部种子构造查询：每个在词表内的变体一条（排除其自身），
+    没有任何变体在词表内的种子回退为 jieba 分词向量均值（与 expand_for_seed 的 B 分支一致）。
+    返回 (查询矩阵, 每条查询的排除下标, 每条查询所属种子)。
+    """
+    import numpy as np
+    qs, exclude, owner = [], [], []
+    try:
+        import jieba
+    except Exception:
+        jieba = None
+    for word in words:
+        found = False
+        for cand in dict.fromkeys(generate_variants(word)):
+            if cand in kv:
+                qs.append(kv.get_vector(cand, norm=True))
+                exclude.append((kv.key_to_index[cand],))
+                owner.append(word)
+                found = True
+        if found or jieba is None:
+            continue
+        vecs = []
+        for t in (t for t in jieba.cut(normalize_cn(word)) if t.strip()):
+            for tv in generate_variants(t):
+                if tv in kv:
+                    vecs.append(kv.get_vector(tv))
+                    break
+        if vecs:
+            qs.append(np.mean(vecs, axis=0))
+            exclude.append(())
+            owner.append(word)
+    Q = np.vstack(qs) if qs else np.zeros((0, kv.vector_size), dtype=np.float32)
+    return Q, exclude, owner
+
+def make_searcher(kv, args):
+    """按 --search 构造检索器；ann 模式加载或构建磁盘 IVF 索引，--ann_eval 时同时返回精确检索器用于对照。"""
+    from vector_search import ExactSearch, IVFIndex
+    kv.fill_norms()
+    exact = ExactSearch(kv.vectors, kv.norms)
+    if args.search != "ann":
+        return exact, None
+    t0 = time.time()
+    index, built = IVFIndex.load_or_build(args.ann_index, kv.vectors, nlist=args.ann_nlist or None)
+    print(f"[INFO] ANN 索引{'已构建' if built else '已加载'}（{len(index.centroids)} 个簇，{time.time() - t0:.1f}s）：",
+          args.ann_index or "（仅内存）")
+    ann = lambda Q, k, exclude=None: index.search(Q, k, nprobe=args.ann_nprobe, exclude=exclude)
+    return ann, (exact if args.ann_eval else None)
+
+def expand_all(model_like, words, topn=10, blacklist=None, search=None, reference=None):
+    """
+    批量扩展：全部种子的查询向量组成一个矩阵，一次分块矩阵乘法得到各自的 top-k，
+    再按种子合并、去重过滤。search 为 (Q, k, exclude) -> (下标, 相似度) 的检索函数，默认精确检索；
+    给定 reference（精确检索）时打印近似检索的 recall@k。返回 {种子: [(词, 相似度), ...]}。
+    """
+    kv = getattr(model_like, "wv", model_like)
+    out = {w: [] for w in words}
+    if kv is None or not words:
+        return out
+    if search is None:
+        from vector_search import ExactSearch
+        kv.fill_norms()
+        search = ExactSearch(kv.vectors, kv.norms).search
+    Q, exclude, owner = build_queries(kv, words)
+    if not len(Q):
+        return out
+    t0 = time.time()
+    idx, scores = search(Q, topn, exclude=exclude)
+    print(f"[INFO] 批量检索 {len(Q)} 条查询，耗时 {time.time() - t0:.2f}s")
+    if reference is not None:
+        from vector_search import recall_at_k
+        ref_idx, _ = reference(Q, topn, exclude=exclude)
+        print(f"[INFO] ANN recall@{topn}: {recall_at_k(ref_idx, idx):.4f}")
+    results = {w: [] for w in words}
+    keys = kv.index_to_key
+    for word, row_i, row_s in zip(owner, idx.tolist(), scores.tolist()):
+        results[word].extend((keys[i], s) for i, s in zip(row_i, row_s) if s != float("-inf"))
+    for w in words:
+        out[w] = finalize_results(results[w], topn, blacklist)
+    return out
+
 def auto_find_vectors(dir_path):
     order = ["*.bin", "*.txt", "*.kv"]
     cands = []
@@ -201,15 +447,29 @@ def main():
     ap.add_argument("--use-tencent", action="store_true", help="自动下载 lili666/text2vec-word2vec-tencent-chinese")
     ap.add_argument("--pretrained", default="", help="已下载的预训练向量路径（.txt/.bin/.kv）")
     ap.add_argument("--cache_dir", default="./ms_models", help="ModelScope 下载缓存目录")
+    ap.add_argument("--vec_cache", default="./vec_cache", help="预训练向量的原生 .kv 缓存目录（mmap 加载）")
+    ap.add_argument("--no_vec_cache", action="store_true", help="不使用向量缓存，每次解析原始文件")
     ap.add_argument("--topn", type=int, default=10, help="每个种子扩展数量")
     ap.add_argument("--min_sim", type=float, default=0.0, help="相似度阈值（默认不过滤）")
+    ap.add_argument("--search", choices=["exact", "ann", "gensim"], default="exact",
+                    help="近邻检索方式：exact=批量精确矩阵检索；ann=IVF 近似索引；gensim=逐词 most_similar（旧实现）")
+    ap.add_argument("--ann_index", default="", help="ANN 索引目录（留空则仅在内存中构建）")
+    ap.add_argument("--ann_nlist", type=int, default=0, help="ANN 聚类数（默认 sqrt(词表大小)）")
+    ap.add_argument("--ann_nprobe", type=int, default=16, help="ANN 查询时探查的簇数")
+    ap.add_argument("--ann_eval", action="store_true", help="同时运行精确检索，报告 ANN 的 recall@topn")
     ap.add_argument("--blacklist", default="", help="黑名单词列表文件（每行一个），用于去噪")
     ap.add_argument("--excel", default="SEEDS_expend.xlsx", help="输出 Excel 文件名")
     ap.add_argument("--csv", default="", help="同时输出 CSV（UTF-8-SIG）。若留空，将按 Excel 名自动生成 .csv")
     ap.add_argument("--model", default="w2v.model", help="（回退）本地训练模型保存/加载路径")
     ap.add_argument("--corpus", nargs="*", default=None, help="（回退）本地语料目录")
+    ap.add_argument("--token_cache", default="./token_cache", help="（回退）语料分词缓存目录")
+    ap.add_argument("--corpus_workers", type=int, default=0, help="（回退）分词进程数（默认 CPU 核数-1）")
+    metrics.add_args(ap)
     args = ap.parse_args()
+    with metrics.stage_run("expand", args):
+        run(args)
 
+def run(args):
     mods = try_imports()
     KeyedVectors = mods["KeyedVectors"]
     Word2Vec = mods["Word2Vec"]
@@ -237,17 +497,26 @@ def main():
 
     if vec_path and KeyedVectors is not None:
         try:
-            model_like = load_pretrained_any(vec_path, KeyedVectors)
+            model_like = load_pretrained_any(vec_path, KeyedVectors, None if args.no_vec_cache else args.vec_cache)
             print("[OK] 已加载预训练向量：", vec_path)
         except Exception as e:
             print("[ERR] 预训练向量加载失败：", e)
 
     if model_like is None:
-        docs = build_corpus(args.corpus, jieba=jieba) if args.corpus else []
+        docs = CorpusStream(args.corpus, args.token_cache, use_jieba=jieba is not None,
+                            workers=args.corpus_workers or None) if args.corpus else []
         model_like = train_or_load_w2v(docs, args.model, Word2Vec)
         if model_like is None:
             print("[WARN] 无法加载预训练向量且本地语料不可用，将仅输出种子词。")
 
+    expansions = {}
+    if model_like is not None and args.search != "gensim":
+        words = list(dict.fromkeys(kw for kws in seeds.values() for kw in kws))
+        search, reference = make_searcher(getattr(model_like, "wv", model_like), args)
+        expansions = expand_all(model_like, words, topn=args.topn, blacklist=blacklist,
+                                search=getattr(search, "search", search),
+                                reference=getattr(reference, "search", None))
+
     rows = []
     for cat_sub, kws in seeds.items():
         try:
@@ -257,7 +526,10 @@ def main():
         for kw in kws:
             expanded = []
             if model_like is not None:
-                expanded = expand_for_seed(model_like, kw, topn=args.topn, blacklist=blacklist)
+                if args.search == "gensim":
+                    expanded = expand_for_seed(model_like, kw, topn=args.topn, blacklist=blacklist)
+                else:
+                    expanded = expansions.get(kw, [])
                 if args.min_sim > 0:
                     expanded = [(w, s) for (w, s) in expanded if s >= args.min_sim]
             if expanded:
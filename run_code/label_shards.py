@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+label_shards.py
+多机分片标注：多台共享文件系统的服务器（各自的 API 配额）同时标注同一份样本，互不重复。
+- 样本按固定行数切成分片（<shard_dir>/plan.json），每台机器可同时运行一个或多个 worker；
+- worker 通过租约文件认领分片：shards/NNNNN/lease.<代数>，先写好临时文件再以硬链接放到位（已存在即失败），
+  同一代只有一个 worker 能创建成功，租约文件一出现就是完整的；
+  持有者每 ttl/3 续约一次（改写到期时间），到期未续约（worker 崩溃/断网）的分片由其他 worker 创建下一代租约接管；
+  持有者发现已出现下一代租约即停止写入，不会两台机器同时标注同一分片；
+- 每一代租约写自己的断点日志 part-<代数>.jsonl（复用 llm_analysis.label_rows：缓存、去重、并发限速照旧），
+  接管者先读取前几代日志，只标注剩余的句子；分片完成后写 done.json；
+- --merge 按原始行序拼出 climaterisk_LLM_Full_Labeled.csv；--status 查看进度与当前租约。
+各机器的时钟需大致同步（误差远小于 --ttl）；LLM 缓存（--cache）请放在各机器本地磁盘上。
+用法：
+    python run_code/label_shards.py --input climaterisk_final_sample.csv --shard_dir /mnt/share/label_shards --async --concurrency 16
+    python run_code/label_shards.py --input climaterisk_final_sample.csv --shard_dir /mnt/share/label_shards --status
+    python run_code/label_shards.py --input climaterisk_final_sample.csv --shard_dir /mnt/share/label_shards --merge --output climaterisk_LLM_Full_Labeled.csv
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+
+import pandas as pd
+
+import metrics
+from llm_analysis import (INPUT_FILE, OUTPUT_FILE, USAGE, LabelJournal, add_label_args, build_output, label_rows,
+                          resolve_model)
+
+SHARD_DIR = os.path.join(os.path.dirname(OUTPUT_FILE), 'label_shards')
+PLAN_NAME = 'plan.json'
+PLAN_VERSION = 1
+SHARD_SIZE = 1000
+
+# ================= 分片计划 =================
+def texts_digest(texts):
+    """按句子内容（而非文件路径）计算样本指纹，各机器挂载路径不同也能对上。"""
+    h = hashlib.sha1()
+    for t in texts:
+        h.update(LabelJournal.text_hash(t).encode('ascii'))
+    return h.hexdigest()
+
+def write_json(path, obj):
+    """原子写入（先写临时文件再替换），临时文件名带主机与进程号，避免多机互相覆盖。"""
+    tmp = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_plan(shard_dir, texts, shard_size):
+    """读取或创建分片计划；已有计划与当前样本不一致时报错（请换一个 --shard_dir）。shard_size 为 0 时沿用已有计划。"""
+    path = os.path.join(shard_dir, PLAN_NAME)
+    want = {'version': PLAN_VERSION, 'n_rows': len(texts), 'digest': texts_digest(texts)}
+    plan = read_json(path)
+    if plan is None:
+        os.makedirs(shard_dir, exist_ok=True)
+        size = shard_size or SHARD_SIZE
+        # 多个 worker 同时创建时内容相同，后写者覆盖无妨
+        plan = dict(want, shard_size=size, n_shards=(len(texts) + size - 1) // size)
+        write_json(path, plan)
+    elif any(plan.get(k) != v for k, v in want.items()):
+        raise SystemExit(f"[ERR] {path} 对应的样本与 --input 不一致（行数或句子已变化），请使用新的 --shard_dir")
+    elif shard_size and plan['shard_size'] != shard_size:
+        print(f"[WARN] 沿用已有计划的分片大小 {plan['shard_size']}（忽略 --shard_size {shard_size}）")
+    return plan
+
+def shard_rows(plan, k):
+    return range(k * plan['shard_size'], min((k + 1) * plan['shard_size'], plan['n_rows']))
+
+def shard_path(shard_dir, k):
+    return os.path.join(shard_dir, 'shards', f"{k:05d}")
+
+# ================= 租约 =================
+def lease_gens(d):
+    """分片目录下已有的租约代数（升序）。"""
+    try:
+        names = os.listdir(d)
+    except FileNotFoundError:
+        return []
+    return sorted(int(n[6:]) for n in names if n.startswith('lease.') and n[6:].isdigit())
+
+def current_lease(d, ttl):
+    """
+    最新一代租约：返回 (代数, 内容, 到期时间)，没有租约时为 (0, None, 0)。
+    无法解析的租约（旧版本的 worker 在写入内容前退出）按文件修改时间 + ttl 到期，不会永远占住分片。
+    """
+    gens = lease_gens(d)
+    if not gens:
+        return 0, None, 0
+    path = os.path.join(d, f"lease.{gens[-1]}")
+    cur = read_json(path)
+    if cur is not None:
+        return gens[-1], cur, cur.get('expires', 0)
+    try:
+        return gens[-1], None, os.path.getmtime(path) + ttl
+    except OSError:
+        return gens[-1], None, 0
+
+class LeaseLost(Exception):
+    pass
+
+class Lease:
+    """
+    一个分片的第 gen 代租约。只有创建者改写 lease.<gen>；出现 lease.<gen+1> 即视为已被接管。
+    后台线程每 ttl/3 续约一次。
+    """
+
+    def __init__(self, d, gen, owner, ttl):
+        self.d, self.gen, self.owner, self.ttl = d, gen, owner, ttl
+        self.path = os.path.join(d, f"lease.{gen}")
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def acquire(cls, d, owner, ttl):
+        """认领空闲分片或接管已过期的租约；失败返回 None。"""
+        gen, _, expires = current_lease(d, ttl)
+        if expires > time.time():
+            return None       # 仍在有效期内
+        lease = cls(d, gen + 1, owner, ttl)
+        os.makedirs(d, exist_ok=True)
+        # 先写完整的临时文件再硬链接到位：链接已存在时失败，租约文件不会出现空文件
+        tmp = f"{lease.path}.{socket.gethostname()}-{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(lease.payload(), f)
+        try:
+            os.link(tmp, lease.path)
+        except FileExistsError:
+            return None       # 其他 worker 抢先创建了这一代
+        finally:
+            os.remove(tmp)
+        return lease
+
+    def payload(self, expires=None):
+        return {'owner': self.owner, 'gen': self.gen, 'expires': time.time() + self.ttl if expires is None else expires}
+
+    def superseded(self):
+        return os.path.exists(os.path.join(self.d, f"lease.{self.gen + 1}"))
+
+    def renew(self):
+        if self.lost or self.superseded():
+            self.lost = True
+            return
+        write_json(self.path, self.payload())
+        # 写入期间可能恰好被接管：以下一代租约是否存在为准
+        if self.superseded():
+            self.lost = True
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except OSError as e:
+                print(f"[WARN] 续约失败：{e}")
+            if self.lost:
+                print(f"[WARN] 分片 {os.path.basename(self.d)} 的租约已被接管，停止写入")
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+    def release(self):
+        """停止续约，并把到期时间置为 0，让其他 worker 立即可以接管未完成的部分。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.lost and not self.superseded():
+            write_json(self.path, self.payload(expires=0))
+
+class ShardJournal(LabelJournal):
+    """本代租约的断点日志；租约丢失后拒绝写入，由 label_rows 向上抛出 LeaseLost。"""
+
+    def __init__(self, path, lease, fsync_every=10):
+        super().__init__(path, fsync_every)
+        self.lease = lease
+
+    def append(self, row, text, result):
+        if self.lease.lost:
+            raise LeaseLost(self.lease.path)
+        super().append(row, text, result)
+
+def load_shard_done(d, texts):
+    """合并分片目录下各代日志中的结果 {行号: 结果}（同一行以先写入的为准）。"""
+    done = {}
+    if not os.path.isdir(d):
+        return done
+    for name in sorted(os.listdir(d)):
+        if name.startswith('part-') and name.endswith('.jsonl'):
+            for row, r in LabelJournal(os.path.join(d, name)).load(texts).items():
+                done.setdefault(row, r)
+    return done
+
+# ================= worker =================
+def label_shard(k, lease, plan, all_texts, args, model, prompt):
+    """标注一个分片中尚未完成的句子；返回 (本分片已完成条数, 失败信息或 None)。"""
+    d = lease.d
+    texts = {i: all_texts[i] for i in shard_rows(plan, k)}
+    prev = load_shard_done(d, texts)
+    todo = {i: t for i, t in texts.items() if i not in prev}
+    if prev:
+        print(f"🔄 分片 {k}：前几代已完成 {len(prev)} 条，剩余 {len(todo)} 条")
+    USAGE.update(dict.fromkeys(USAGE, 0))   # 用量统计按分片报告
+    journal = ShardJournal(os.path.join(d, f"part-{lease.gen:04d}.jsonl"), lease, args.fsync_every)
+    done, failed = label_rows(todo, journal, args, model, prompt)
+    return len(prev) + len(done), failed
+
+def next_shard(shard_dir, plan, owner, ttl, start):
+    """从 start 开始轮询，返回 (分片号, 租约)；没有可认领的分片时返回 (None, 是否全部完成)。"""
+    n = plan['n_shards']
+    all_done = True
+    for j in range(n):
+        k = (start + j) % n
+        d = shard_path(shard_dir, k)
+        if os.path.exists(os.path.join(d, 'done.json')):
+            continue
+        all_done = False
+        lease = Lease.acquire(d, owner, ttl)
+        if lease is None:
+            continue
+        if os.path.exists(os.path.join(d, 'done.json')):
+            lease.release()   # 上一代恰好在到期前完成
+            continue
+        return k, lease
+    return None, all_done
+
+def work(args, df):
+    model, prompt = resolve_model(args)
+    texts = df['句子'].tolist()
+    plan = load_plan(args.shard_dir, texts, args.shard_size)
+    if plan['n_rows'] == 0:
+        print(f"[WARN] {args.input} 中没有待标注的句子，无需认领分片")
+        return
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+    # 各 worker 从不同位置开始认领，减少争抢同一分片
+    start = zlib.crc32(owner.encode('utf-8')) % plan['n_shards']
+    print(f"🚀 分片标注 worker {owner}：共 {plan['n_rows']} 条 / {plan['n_shards']} 个分片，租约 {args.ttl}s")
+
+    n_shards = n_rows = 0
+    while True:
+        k, lease = next_shard(args.shard_dir, plan, owner, args.ttl, start)
+        if k is None:
+            if lease:   # 全部完成
+                break
+            if args.no_wait:
+                print("⏸️ 剩余分片均被其他 worker 持有，退出（--no_wait）")
+                return
+            time.sleep(min(args.ttl / 4, 30))
+            continue
+        t0 = time.time()
+        n_rows_shard = len(shard_rows(plan, k))
+        print(f"\n📦 认领分片 {k}（第 {lease.gen} 代，{n_rows_shard} 条）")
+        lease.start()
+        outcome, finished = 'ok', False
+        try:
+            n_done, failed = label_shard(k, lease, plan, texts, args, model, prompt)
+            if failed:
+                outcome = 'fail'
+            elif n_done >= n_rows_shard:
+                # 先写完成标记再释放租约：否则释放后的间隙里其他 worker 会认领这个已完成的分片
+                write_json(os.path.join(lease.d, 'done.json'),
+                           {'rows': n_rows_shard, 'owner': owner, 'gen': lease.gen, 'finished': time.time()})
+                finished = True
+        except LeaseLost:
+            n_done, failed, outcome = 0, None, 'lost'
+        finally:
+            lease.release()
+        if finished:
+            n_shards += 1
+            n_rows += n_rows_shard
+        metrics.emit('label_shard', shard=k, gen=lease.gen, status=outcome, rows=n_rows_shard,
+                     seconds=round(time.time() - t0, 3))
+        if outcome == 'fail':
+            print(f"⏸️ 分片 {k} 未完成，租约已释放，其他 worker 可继续。请检查网络/配额后重启。")
+            return
+        start = k + 1
+    print(f"\n✅ 全部分片已完成（本 worker 完成 {n_shards} 个分片 / {n_rows} 条）。合并：--merge --output ...")
+
+# ================= 进度与合并 =================
+def status(args, df):
+    plan = load_plan(args.shard_dir, df['句子'].tolist(), args.shard_size)
+    now = time.time()
+    n_done, active, free = 0, [], 0
+    for k in range(plan['n_shards']):
+        d = shard_path(args.shard_dir, k)
+        if os.path.exists(os.path.join(d, 'done.json')):
+            n_done += 1
+            continue
+        gen, cur, expires = current_lease(d, args.ttl)
+        if expires > now:
+            active.append((k, gen, cur, expires))
+        else:
+            free += 1
+    print(f"[INFO] 分片 {plan['n_shards']} 个（每片 {plan['shard_size']} 条）：完成 {n_done}，进行中 {len(active)}，"
+          f"待认领 {free}")
+    for k, gen, cur, expires in active:
+        owner = cur['owner'] if cur else '（租约无法解析）'
+        print(f"  分片 {k}：{owner}，第 {gen} 代，{expires - now:.0f}s 后到期")
+
+def merge(args, df):
+    texts = df['句子'].tolist()
+    plan = load_plan(args.shard_dir, texts, args.shard_size)
+    by_row = dict(enumerate(texts))
+    done = {}
+    for k in range(plan['n_shards']):
+        rows = shard_rows(plan, k)
+        done.update(load_shard_done(shard_path(args.shard_dir, k), {i: by_row[i] for i in rows}))
+    missing = len(df) - len(done)
+    if missing:
+        print(f"[ERR] 还有 {missing} 条未标注，暂不合并（可用 --status 查看进度）")
+        raise SystemExit(1)
+    build_output(df, done).to_csv(args.output, index=False, encoding='utf-8-sig')
+    print(f"[DONE] 已按原始顺序合并 {len(done)} 条 -> {args.output}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=INPUT_FILE, help="待标注样本 CSV（各 worker 须为同一份）")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="合并后的标注结果 CSV（--merge）")
+    ap.add_argument("--shard_dir", default=SHARD_DIR, help="共享目录：分片计划、租约与各分片断点日志")
+    ap.add_argument("--shard_size", type=int, default=0,
+                    help=f"每个分片的句子数（首次创建计划时生效，默认 {SHARD_SIZE}；之后沿用计划）")
+    ap.add_argument("--ttl", type=float, default=600, help="租约有效期（秒），超时未续约的分片可被接管")
+    ap.add_argument("--no_wait", action="store_true", help="剩余分片都被他人持有时直接退出，而不是等待其到期")
+    ap.add_argument("--merge", action="store_true", help="合并各分片结果为最终 CSV")
+    ap.add_argument("--status", action="store_true", help="只查看分片进度")
+    add_label_args(ap)
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    args.shard_size = max(0, args.shard_size)
+    df = pd.read_csv(args.input, encoding='utf-8-sig')
+    if args.status:
+        status(args, df)
+    elif args.merge:
+        merge(args, df)
+    else:
+        with metrics.stage_run('label_shard', args):
+            work(args, df)
+
+if __name__ == "__main__":
+    main()
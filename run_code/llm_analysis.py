@@ -1,10 +1,16 @@
 import os
 import json
+import hashlib
 import time
+import random
+import asyncio
+import argparse
 import pandas as pd
 import openai
 from dotenv import load_dotenv
 from tqdm import tqdm
+from llm_cache import LLMCache, cache_key, prompt_version
+import metrics
 
 # 1. 加载环境变量
 load_dotenv(".env")
@@ -13,15 +19,39 @@ load_dotenv(".env")
 INPUT_FILE = r'E:\projects\risk-pipeline\data\output\climaterisk_final_sample.csv'
 # 最终输出文件
 OUTPUT_FILE = r'E:\projects\risk-pipeline\data\output\climaterisk_LLM_Full_Labeled.csv'
-# 中断备份文件（用于断点续传）
-CHECKPOINT_FILE = r'E:\projects\risk-pipeline\data\output\label_checkpoint.tmp'
+# 断点日志（追加写入，用于断点续传）
+CHECKPOINT_FILE = r'E:\projects\risk-pipeline\data\output\label_journal.jsonl'
+# 标注结果缓存（按句子 + 提示词 + 模型 + 温度）
+CACHE_FILE = r'E:\projects\risk-pipeline\data\output\llm_cache.sqlite'
+
+MODEL = "deepseek-chat"
+TEMPERATURE = 0.1
+# 输出列（与 JSON 字段的对应关系）
+LLM_COLUMNS = {
+    'LLM_Label': 'label',
+    'LLM_Prob_Exposed': 'prob_exposed',
+    'LLM_Prob_Prevent': 'prob_prevent',
+    'LLM_Prob_Neutral': 'prob_neutral',
+    'LLM_Reason': 'reason',
+}
+# 重试：429 / 5xx / 网络错误按指数退避（带随机抖动）重试
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
 
 def setup_client():
     api_key = os.getenv("DEEP_API_KEY")
     base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
     if not api_key:
         raise ValueError("❌ 错误: 未在环境变量中找到 DEEP_API_KEY")
-    return openai.OpenAI(api_key=api_key, base_url=base_url)
+    return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+def setup_async_client():
+    api_key = os.getenv("DEEP_API_KEY")
+    base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+    if not api_key:
+        raise ValueError("❌ 错误: 未在环境变量中找到 DEEP_API_KEY")
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
 
 # ================= Prompt 设计 =================
 SYSTEM_PROMPT = """你是一个气候金融专家。分析文本语义并输出 JSON：
@@ -38,75 +68,537 @@ SYSTEM_PROMPT = """你是一个气候金融专家。分析文本语义并输出
   "reason": "内容描述了极端天气导致的供应链中断"
 }"""
 
-def main():
-    client = setup_client()
-    
-    # 1. 加载全量数据
-    df = pd.read_csv(INPUT_FILE, encoding='utf-8-sig')
-    total_count = len(df)
-    
-    # 2. 检查是否有断点（续传逻辑）
-    if os.path.exists(CHECKPOINT_FILE):
-        processed_df = pd.read_csv(CHECKPOINT_FILE, encoding='utf-8-sig')
-        start_idx = len(processed_df)
-        print(f"🔄 检测到断点，从第 {start_idx} 条开始续传...")
-    else:
-        processed_df = pd.DataFrame()
-        start_idx = 0
-        print(f"🚀 全量模式启动，共计 {total_count} 条待标注...")
-
-    # 3. 核心推理循环
-    # 仅处理尚未标注的部分
-    target_sentences = df['句子'].iloc[start_idx:].tolist()
-    
-    for i, text in enumerate(tqdm(target_sentences, desc="DeepSeek 标注中", initial=start_idx, total=total_count)):
+def build_messages(text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"文本：{text}"}
+    ]
+
+def parse_result(content):
+    """解析模型返回的 JSON，映射为 LLM_* 列。"""
+    data = json.loads(content)
+    return {col: data.get(key) for col, key in LLM_COLUMNS.items()}
+
+# ================= 重试与限速 =================
+def is_retryable(e):
+    """429、5xx 以及连接/超时错误可重试；其余（如 400、鉴权失败）直接失败。"""
+    if isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500
+    return False
+
+def backoff_delay(attempt, e=None):
+    """第 attempt 次重试的等待时间：优先遵循 Retry-After，否则指数退避 + 随机抖动。"""
+    resp = getattr(e, 'response', None)
+    retry_after = resp.headers.get('retry-after') if resp is not None else None
+    if retry_after:
+        try:
+            return min(BACKOFF_CAP, float(retry_after)) * random.uniform(1.0, 1.2)
+        except ValueError:
+            pass
+    return min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+class RateLimiter:
+    """
+    异步令牌桶：同时限制每分钟请求数（rpm）与每分钟 token 数（tpm），0 表示不限。
+    token 按预估值预扣，收到响应后按实际用量修正。
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm, self.tpm = rpm, tpm
+        self._req = float(rpm)
+        self._tok = float(tpm)
+        self._ts = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        dt, self._ts = now - self._ts, now
+        if self.rpm:
+            self._req = min(self.rpm, self._req + dt * self.rpm / 60.0)
+        if self.tpm:
+            self._tok = min(self.tpm, self._tok + dt * self.tpm / 60.0)
+
+    async def acquire(self, tokens=0):
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        async with self._lock:
+            while True:
+                self._refill()
+                wait_req = 0.0 if not self.rpm or self._req >= 1 else (1 - self._req) * 60.0 / self.rpm
+                wait_tok = 0.0 if not self.tpm or self._tok >= tokens else (tokens - self._tok) * 60.0 / self.tpm
+                if wait_req <= 0 and wait_tok <= 0:
+                    if self.rpm: self._req -= 1
+                    if self.tpm: self._tok -= tokens
+                    return
+                await asyncio.sleep(max(wait_req, wait_tok))
+
+    def settle(self, estimated, actual):
+        """按实际 token 用量修正预扣值。"""
+        if self.tpm and actual:
+            self._tok -= (actual - min(estimated, self.tpm))
+
+def estimate_tokens(messages, completion=150):
+    """粗略估计请求 token 数（中文约 1 字 1 token）。"""
+    return sum(len(m['content']) for m in messages) + completion
+
+# ================= 批量 Prompt =================
+# 一次请求打包多句，每句带稳定 id；模型返回 {"results": [...]}，逐 id 校验，缺失或格式错误的句子单独重排
+BATCH_SYSTEM_PROMPT = """你是一个气候金融专家。用户会给出多条文本，每条以 [id] 开头。逐条分析文本语义并标注：
+1. 【暴露】 (-1)：具体描述了气候灾害损失、资产减值或合规成本上升。
+2. 【防范】 (1)：具体描述了减排投入、转型技术、管理架构或明确目标。
+3. 【不相关】 (0)：空洞口号、洗绿话术或单纯政策复述。
+
+只输出一个 JSON 对象，results 数组中每条文本对应一个元素，id 与输入一致，不得遗漏：
+{
+  "results": [
+    {"id": 1, "label": -1, "prob_exposed": 0.8, "prob_prevent": 0.1, "prob_neutral": 0.1, "reason": "内容描述了极端天气导致的供应链中断"}
+  ]
+}"""
+
+def build_batch_messages(batch):
+    """batch: [(id, text), ...]"""
+    lines = "\n".join(f"[{i}] {str(t).replace(chr(10), ' ')}" for i, t in batch)
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": f"共 {len(batch)} 条文本：\n{lines}"}
+    ]
+
+def _valid_item(item):
+    try:
+        if int(item.get('label')) not in (-1, 0, 1):
+            return False
+        return all(0.0 <= float(item.get(k)) <= 1.0 for k in ('prob_exposed', 'prob_prevent', 'prob_neutral'))
+    except (TypeError, ValueError):
+        return False
+
+def parse_batch(content, batch):
+    """解析批量返回，只保留 id 属于本批且字段合法的结果：{id: 结果}。"""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return {}
+    items = data.get('results') if isinstance(data, dict) else data
+    wanted = {i for i, _ in batch}
+    out = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            i = int(item.get('id'))
+        except (TypeError, ValueError):
+            continue
+        if i in wanted and i not in out and _valid_item(item):
+            item['label'] = int(item['label'])
+            out[i] = {col: item.get(key) for col, key in LLM_COLUMNS.items()}
+    return out
+
+# ================= 标注 =================
+# 本次运行的调用统计（请求数、prompt/completion token 数）
+USAGE = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+def record_usage(response):
+    """累计 token 用量，返回本次总 token 数。"""
+    usage = getattr(response, 'usage', None)
+    USAGE['requests'] += 1
+    if usage is None:
+        return 0
+    USAGE['prompt_tokens'] += usage.prompt_tokens or 0
+    USAGE['completion_tokens'] += usage.completion_tokens or 0
+    return usage.total_tokens or 0
+
+def record_call(t0, t1, attempt, response=None, error=None):
+    """
+    写入单次调用的指标：seconds 为含排队与退避重试的总耗时，latency 为最后一次请求的往返耗时，
+    retries 为重试次数，以及 prompt / completion token 数。
+    """
+    if not metrics.enabled():
+        return
+    now = time.perf_counter()
+    usage = getattr(response, 'usage', None)
+    metrics.emit('llm_call', seconds=round(now - t0, 4), latency=round(now - t1, 4), retries=attempt,
+                 prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                 completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                 **({'error': error} if error else {}))
+
+def chat_json(client, messages, model=MODEL):
+    """同步请求（JSON 输出），可重试错误按退避重试，返回消息内容。"""
+    t0 = time.perf_counter()
+    for attempt in range(MAX_RETRIES + 1):
+        t1 = time.perf_counter()
         try:
             response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": f"文本：{text}"}
-                ],
+                model=model,
+                messages=messages,
                 response_format={'type': 'json_object'},
-                temperature=0.1
+                temperature=TEMPERATURE
             )
-            
-            # 解析内容
-            data = json.loads(response.choices[0].message.content)
-            
-            # 整理当前行数据
-            current_row = df.iloc[[start_idx + i]].copy()
-            current_row['LLM_Label'] = data.get('label')
-            current_row['LLM_Prob_Exposed'] = data.get('prob_exposed')
-            current_row['LLM_Prob_Prevent'] = data.get('prob_prevent')
-            current_row['LLM_Prob_Neutral'] = data.get('prob_neutral')
-            current_row['LLM_Reason'] = data.get('reason')
-            
-            # 实时追加到已处理 DataFrame
-            processed_df = pd.concat([processed_df, current_row], ignore_index=True)
-            
-            # 每 10 条保存一次临时文件，防止断电
-            if (i + 1) % 10 == 0:
-                processed_df.to_csv(CHECKPOINT_FILE, index=False, encoding='utf-8-sig')
-                
+            record_usage(response)
+            record_call(t0, t1, attempt, response)
+            return response.choices[0].message.content
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                record_call(t0, t1, attempt, error=type(e).__name__)
+                raise
+            time.sleep(backoff_delay(attempt, e))
+
+async def achat_json(aclient, messages, sem, limiter, model=MODEL, completion=150):
+    """异步请求：并发数由 sem 控制，速率由 limiter 控制，可重试错误按抖动退避重试。"""
+    est = estimate_tokens(messages, completion)
+    t0 = t1 = time.perf_counter()
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire(est)
+        try:
+            async with sem:
+                t1 = time.perf_counter()
+                response = await aclient.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    response_format={'type': 'json_object'},
+                    temperature=TEMPERATURE
+                )
+            limiter.settle(est, record_usage(response))
+            record_call(t0, t1, attempt, response)
+            return response.choices[0].message.content
         except Exception as e:
-            print(f"\n⚠️ 处理第 {start_idx + i} 条时出错: {e}")
-            # 保存当前进度并退出，方便稍后重启
-            processed_df.to_csv(CHECKPOINT_FILE, index=False, encoding='utf-8-sig')
-            print("💾 进度已安全保存至临时文件。")
-            break
-        
-        # 针对全量标注微调延迟
-        time.sleep(0.05)
-
-    # 4. 完成后保存最终文件并清理临时文件
-    if len(processed_df) >= total_count:
-        processed_df.to_csv(OUTPUT_FILE, index=False, encoding='utf-8-sig')
-        if os.path.exists(CHECKPOINT_FILE):
-            os.remove(CHECKPOINT_FILE)
-        print(f"\n✅ 全量标注任务已圆满完成！结果保存至: {OUTPUT_FILE}")
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                record_call(t0, t1, attempt, error=type(e).__name__)
+                raise
+            await asyncio.sleep(backoff_delay(attempt, e))
+
+def label_sentence(client, text, model=MODEL):
+    """同步标注单句。"""
+    return parse_result(chat_json(client, build_messages(text), model))
+
+async def alabel_sentence(aclient, text, sem, limiter, model=MODEL):
+    """异步标注单句。"""
+    return parse_result(await achat_json(aclient, build_messages(text), sem, limiter, model))
+
+def label_batch(client, batch, model=MODEL):
+    """同步批量标注，返回 {id: 结果}（只含合法结果）。"""
+    return parse_batch(chat_json(client, build_batch_messages(batch), model), batch)
+
+async def alabel_batch(aclient, batch, sem, limiter, model=MODEL):
+    """异步批量标注，返回 {id: 结果}（只含合法结果）。"""
+    content = await achat_json(aclient, build_batch_messages(batch), sem, limiter, model, completion=80 * len(batch))
+    return parse_batch(content, batch)
+
+async def arun_jobs(jobs, fn, concurrency=16, rpm=0, tpm=0, progress=None, weight=None, ctx=None):
+    """
+    并发执行 fn(aclient, job, sem, limiter)，返回与 jobs 同序的结果列表；失败的位置为异常对象。
+    ctx=(aclient, sem, limiter) 时复用调用方的客户端与限速器（多轮提交共享同一令牌桶），否则本次新建。
+    """
+    own = ctx is None
+    aclient, sem, limiter = ctx if ctx else (setup_async_client(), asyncio.Semaphore(concurrency), RateLimiter(rpm, tpm))
+
+    async def one(job):
+        try:
+            return await fn(aclient, job, sem, limiter)
+        except Exception as e:
+            return e
+        finally:
+            if progress is not None:
+                progress.update(weight(job) if weight else 1)
+
+    try:
+        return await asyncio.gather(*(one(j) for j in jobs))
+    finally:
+        if own:
+            await aclient.close()
+
+async def alabel_many(texts, concurrency=16, rpm=0, tpm=0, model=MODEL, progress=None, ctx=None):
+    """
+    并发标注一组句子，返回与输入同序的结果列表；失败的句子对应位置为异常对象。
+    """
+    fn = lambda c, t, sem, lim: alabel_sentence(c, t, sem, lim, model)
+    return await arun_jobs(texts, fn, concurrency, rpm, tpm, progress, ctx=ctx)
+
+def label_pending_sync(items, on_result, model=MODEL, batch_size=1):
+    """
+    同步标注 items=[(key, text), ...]；batch_size>1 时每次请求打包多句，缺失/不合法的句子逐句重排。
+    每条结果回调 on_result(key, 结果, 实际使用的提示词)；遇到不可恢复的错误即停止，返回 (key, 异常) 或 None。
+    """
+    if not items:
+        return None     # 全部来自断点日志/缓存/去重：不创建客户端，无 API key 也能运行
+    client = setup_client()
+    bar = tqdm(desc="DeepSeek 标注中", total=len(items))
+    try:
+        for b0 in range(0, len(items), batch_size):
+            chunk = items[b0:b0 + batch_size]
+            got = {}
+            if batch_size > 1:
+                try:
+                    got = label_batch(client, [(b0 + j, t) for j, (_, t) in enumerate(chunk)], model)
+                except Exception as e:
+                    return chunk[0][0], e
+            for j, (key, text) in enumerate(chunk):
+                used = BATCH_SYSTEM_PROMPT
+                if b0 + j not in got:
+                    used = SYSTEM_PROMPT
+                    try:
+                        got[b0 + j] = label_sentence(client, text, model)
+                    except Exception as e:
+                        return key, e
+                on_result(key, got[b0 + j], used)
+                bar.update(1)
+            # 针对全量标注微调延迟
+            time.sleep(0.05)
+    finally:
+        bar.close()
+    return None
+
+def label_pending_async(items, on_result, concurrency, rpm, tpm, block, model=MODEL, batch_size=1):
+    """
+    异步并发标注 items；batch_size>1 时先批量请求，缺失/不合法的句子再逐句并发请求。
+    全程只有一个事件循环、一个客户端和一个限速器，--rpm/--tpm 跨块生效；
+    每个块结束后若有失败即停止，返回 (key, 异常) 或 None。
+    """
+    if not items:
+        return None     # 同 label_pending_sync：没有待请求的句子时不创建客户端
+    return asyncio.run(_alabel_pending(items, on_result, concurrency, rpm, tpm, block, model, batch_size))
+
+async def _alabel_pending(items, on_result, concurrency, rpm, tpm, block, model, batch_size):
+    aclient = setup_async_client()
+    ctx = (aclient, asyncio.Semaphore(concurrency), RateLimiter(rpm, tpm))
+    bar = tqdm(desc="DeepSeek 标注中", total=len(items))
+    try:
+        for b0 in range(0, len(items), block):
+            chunk = items[b0:b0 + block]
+            failed = None
+            singles = list(range(len(chunk)))
+            if batch_size > 1:
+                batches = [[(j, chunk[j][1]) for j in range(k, min(k + batch_size, len(chunk)))]
+                           for k in range(0, len(chunk), batch_size)]
+                fn = lambda c, bt, sem, lim: alabel_batch(c, bt, sem, lim, model)
+                results = await arun_jobs(batches, fn, ctx=ctx)
+                singles = []
+                for bt, r in zip(batches, results):
+                    if isinstance(r, Exception):
+                        failed = failed or (chunk[bt[0][0]][0], r)
+                        continue
+                    for j, _ in bt:
+                        if j in r:
+                            on_result(chunk[j][0], r[j], BATCH_SYSTEM_PROMPT)
+                            bar.update(1)
+                        else:
+                            singles.append(j)
+            if singles:
+                results = await alabel_many([chunk[j][1] for j in singles], model=model, progress=bar, ctx=ctx)
+                for j, r in zip(singles, results):
+                    if isinstance(r, Exception):
+                        failed = failed or (chunk[j][0], r)
+                    else:
+                        on_result(chunk[j][0], r, SYSTEM_PROMPT)
+            if failed:
+                return failed
+    finally:
+        bar.close()
+        await aclient.close()
+    return None
+
+def usage_report(n_labeled):
+    """打印本次运行的请求数与每句平均 token 数。"""
+    total = USAGE['prompt_tokens'] + USAGE['completion_tokens']
+    if not USAGE['requests']:
+        return
+    print(f"📊 请求 {USAGE['requests']} 次，prompt {USAGE['prompt_tokens']} / completion {USAGE['completion_tokens']} tokens，"
+          f"平均每句 {total / max(n_labeled, 1):.1f} tokens")
+
+# ================= 断点日志 =================
+class LabelJournal:
+    """
+    追加写入的断点日志（JSON Lines）：每行 {"row": 行号, "h": 句子哈希, "r": 标注结果}。
+    每条结果只写一次，每 fsync_every 条 fsync 一次；续传时按行号跳过已完成的句子，与完成顺序无关。
+    """
+
+    def __init__(self, path, fsync_every=10):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self._fh = None
+        self._unsynced = 0
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:16]
+
+    def load(self, texts=None):
+        """读取已完成的结果 {行号: 结果}；给定 texts（行号 -> 句子）时丢弃句子已变化的记录。"""
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 断电时可能留下半行
+                row = rec.get('row')
+                if texts is not None and (row not in texts or self.text_hash(texts[row]) != rec.get('h')):
+                    continue
+                done[row] = rec.get('r')
+        return done
+
+    def append(self, row, text, result):
+        if self._fh is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._fh = open(self.path, 'a', encoding='utf-8')
+        self._fh.write(json.dumps({'row': row, 'h': self.text_hash(text), 'r': result}, ensure_ascii=False) + '\n')
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self._fh is not None and self._unsynced:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def label_rows(texts, journal, args, model, prompt):
+    """
+    标注 texts（行号 -> 句子）中日志里尚未完成的句子，结果逐条追加到 journal。
+    返回 ({行号: 结果}, 失败信息或 None)。
+    """
+    done = journal.load(texts)
+    todo = [(row, t) for row, t in texts.items() if row not in done]
+    if done:
+        print(f"🔄 检测到断点，已完成 {len(done)} 条，剩余 {len(todo)} 条...")
+
+    # 去重与缓存：相同（规范化后）句子只请求一次，已缓存的直接复用
+    cache = None if args.no_cache else LLMCache(args.cache)
+    rows_by_key = {}
+    for row, t in todo:
+        rows_by_key.setdefault(cache_key(t, prompt, model, TEMPERATURE), []).append(row)
+    known = cache.get_many(rows_by_key) if cache else {}
+    n_cached_rows = sum(len(rows_by_key[k]) for k in known)
+    items = [(k, texts[rows[0]]) for k, rows in rows_by_key.items() if k not in known]
+    n_dup = len(todo) - n_cached_rows - len(items)
+    print(f"📦 缓存命中 {n_cached_rows}/{len(todo)} 句（{n_cached_rows / max(len(todo), 1):.1%}），"
+          f"去重节省 {n_dup} 次请求，需请求 {len(items)} 次")
+
+    def on_result(key, result, used_prompt=prompt, from_cache=False):
+        # 批量模式下逐句重排的句子实际使用单句提示词，按实际提示词写入缓存，两种结果不混用
+        if cache and not from_cache:
+            if used_prompt != prompt:
+                key_used = cache_key(texts[rows_by_key[key][0]], used_prompt, model, TEMPERATURE)
+            else:
+                key_used = key
+            cache.put(key_used, result, prompt_version(used_prompt), model)
+        for row in rows_by_key[key]:
+            journal.append(row, texts[row], result)
+            done[row] = result
+
+    for k, result in known.items():
+        on_result(k, result, from_cache=True)
+
+    # 核心推理循环
+    try:
+        if args.use_async:
+            print(f"⚡ 异步模式：并发 {args.concurrency}，RPM {args.rpm or '不限'}，TPM {args.tpm or '不限'}")
+            failed = label_pending_async(items, on_result, args.concurrency, args.rpm, args.tpm, args.block, model, args.batch_size)
+        else:
+            failed = label_pending_sync(items, on_result, model, args.batch_size)
+    finally:
+        journal.close()
+        if cache:
+            cache.close()
+    usage_report(sum(1 for k, _ in items if rows_by_key[k][0] in done))
+    if failed:
+        print(f"\n⚠️ 处理第 {rows_by_key[failed[0]][0]} 条时出错: {failed[1]}")
+        print("💾 已完成的结果均已写入断点日志。")
+    return done, failed
+
+def build_output(df, done):
+    """按输入顺序一次性拼出带 LLM_* 列的结果表。"""
+    out = df.copy()
+    for col in LLM_COLUMNS:
+        out[col] = [done[i][col] for i in range(len(df))]
+    return out
+
+def add_label_args(ap):
+    """标注运行参数（断点日志、并发限速、缓存、批量），供其他调用 label_rows 的脚本复用。"""
+    ap.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="断点日志（JSON Lines）")
+    ap.add_argument("--fsync_every", type=int, default=10, help="断点日志每写入 N 条 fsync 一次（与原先每 10 条保存一次一致）")
+    ap.add_argument("--model", default=MODEL, help="模型名（deepseek 等价于 deepseek-chat）")
+    ap.add_argument("--async", dest="use_async", action="store_true", help="异步并发模式")
+    ap.add_argument("--concurrency", type=int, default=16, help="异步模式下的最大并发请求数")
+    ap.add_argument("--rpm", type=int, default=0, help="每分钟请求数上限（0 不限）")
+    ap.add_argument("--tpm", type=int, default=0, help="每分钟 token 数上限（0 不限）")
+    ap.add_argument("--block", type=int, default=500, help="异步模式下每轮并发提交的句子数")
+    ap.add_argument("--cache", default=CACHE_FILE, help="标注结果缓存（SQLite）路径")
+    ap.add_argument("--no_cache", action="store_true", help="不读写持久缓存（仍在本次运行内去重）")
+    ap.add_argument("--batch_size", type=int, default=1, help="每次请求打包的句子数（1 为逐句模式）")
+
+def resolve_model(args):
+    """返回 (模型名, 提示词)，并规范 batch_size。"""
+    model = "deepseek-chat" if args.model == "deepseek" else args.model
+    args.batch_size = max(1, args.batch_size)
+    # 批量模式使用不同的提示词，缓存按实际提示词区分
+    prompt = BATCH_SYSTEM_PROMPT if args.batch_size > 1 else SYSTEM_PROMPT
+    return model, prompt
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=INPUT_FILE, help="待标注样本 CSV")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="标注结果 CSV")
+    add_label_args(ap)
+    ap.add_argument("--store", default="", help="句子库目录；输入含“句子ID”列时从句子库读取句子文本")
+    ap.add_argument("--near_dup", type=float, default=0.0,
+                    help="近似重复聚类的 Jaccard 阈值（如 0.8；0 为关闭），每簇只请求代表句")
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run('label', args):
+        run(args)
+
+def run(args):
+    model, prompt = resolve_model(args)
+
+    # 1. 加载全量数据
+    df = pd.read_csv(args.input, encoding='utf-8-sig')
+    total_count = len(df)
+    print(f"🚀 全量模式启动，共计 {total_count} 条待标注...")
+
+    # 2. 标注（已完成的行从断点日志中跳过）
+    journal = LabelJournal(args.checkpoint, args.fsync_every)
+    if args.store and '句子ID' in df.columns:
+        # 句子文本以句子库为准，按稳定的句子ID取回
+        from sentence_store import SentenceStore
+        sents = SentenceStore(args.store).lookup(df['句子ID'].tolist())
+        missing = sum(t is None for t in sents)
+        if missing:
+            print(f"⚠️ 句子库中缺少 {missing} 个句子ID，改用输入文件中的句子")
+        orig = df['句子'].tolist() if '句子' in df.columns else [''] * len(df)
+        df['句子'] = [t if t is not None else o for t, o in zip(sents, orig)]
+    texts = dict(enumerate(df['句子'].tolist()))
+    rep = None
+    if args.near_dup > 0:
+        # 近似重复聚类：每簇只标注代表句，结果复制给簇内其余句子
+        from near_dup import cluster_near_duplicates, cluster_stats, print_stats
+        rep = cluster_near_duplicates(df['句子'].tolist(), args.near_dup)
+        print_stats(cluster_stats(rep))
+        texts = {i: t for i, t in texts.items() if rep[i] == i}
+    done, _ = label_rows(texts, journal, args, model, prompt)
+    if rep is not None:
+        done = {i: done[r] for i, r in enumerate(rep.tolist()) if r in done}
+        df['近似重复簇'] = rep
+
+    # 3. 完成后一次性生成最终文件并清理断点日志
+    if len(done) >= total_count:
+        build_output(df, done).to_csv(args.output, index=False, encoding='utf-8-sig')
+        journal.remove()
+        print(f"\n✅ 全量标注任务已圆满完成！结果保存至: {args.output}")
     else:
-        print(f"\n⏸️ 任务暂停，已完成 {len(processed_df)} / {total_count}。请检查网络后重启。")
+        print(f"\n⏸️ 任务暂停，已完成 {len(done)} / {total_count}。请检查网络后重启。")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
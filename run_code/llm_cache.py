@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+llm_cache.py
+大模型标注结果的本地持久缓存（SQLite）。
+- 键：规范化句子文本 + 系统提示词 + 模型名 + 温度 的 SHA-256；
+- 每条记录带提示词版本与写入时间，可按时间或提示词版本清理。
+用法：
+    python run_code/llm_cache.py --db llm_cache.sqlite --stats
+    python run_code/llm_cache.py --db llm_cache.sqlite --older_than_days 30
+    python run_code/llm_cache.py --db llm_cache.sqlite --keep_current
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+
+def normalize_text(text) -> str:
+    """规范化句子：NFKC、合并空白、去除首尾空白。"""
+    s = unicodedata.normalize("NFKC", str(text or ""))
+    return re.sub(r"\s+", " ", s).strip()
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+def cache_key(text, prompt: str, model: str, temperature) -> str:
+    payload = "\x1f".join([normalize_text(text), prompt, model, repr(float(temperature))])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """键值缓存：key -> 解析后的标注结果（dict）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, prompt_version TEXT, model TEXT,"
+            " result TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_pv ON cache(prompt_version)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_created ON cache(created)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """批量查询，返回 {key: result}（只含命中的键）。"""
+        out = {}
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            q = f"SELECT key, result FROM cache WHERE key IN ({','.join('?' * len(chunk))})"
+            for k, v in self.conn.execute(q, chunk):
+                out[k] = json.loads(v)
+        return out
+
+    def put(self, key: str, result: dict, prompt_ver: str = "", model: str = "", commit: bool = True):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache(key, prompt_version, model, result, created) VALUES (?, ?, ?, ?, ?)",
+            (key, prompt_ver, model, json.dumps(result, ensure_ascii=False), time.time()),
+        )
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def prune(self, older_than_days: float = None, keep_prompt_version: str = None) -> int:
+        """删除超过 older_than_days 天的记录，和/或提示词版本不等于 keep_prompt_version 的记录。"""
+        n = 0
+        if older_than_days is not None:
+            cutoff = time.time() - older_than_days * 86400
+            n += self.conn.execute("DELETE FROM cache WHERE created < ?", (cutoff,)).rowcount
+        if keep_prompt_version:
+            n += self.conn.execute("DELETE FROM cache WHERE prompt_version != ?", (keep_prompt_version,)).rowcount
+        self.conn.commit()
+        return n
+
+    def stats(self):
+        rows = self.conn.execute(
+            "SELECT prompt_version, model, COUNT(*), MIN(created), MAX(created) FROM cache GROUP BY prompt_version, model"
+        ).fetchall()
+        return [{"prompt_version": pv, "model": m, "count": c,
+                 "oldest": time.strftime("%Y-%m-%d %H:%M", time.localtime(t0)),
+                 "newest": time.strftime("%Y-%m-%d %H:%M", time.localtime(t1))}
+                for pv, m, c, t0, t1 in rows]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", required=True, help="缓存数据库路径")
+    ap.add_argument("--stats", action="store_true", help="按提示词版本/模型统计缓存条数")
+    ap.add_argument("--older_than_days", type=float, default=None, help="删除早于 N 天的记录")
+    ap.add_argument("--keep_current", action="store_true", help="只保留当前 SYSTEM_PROMPT 版本的记录")
+    args = ap.parse_args()
+
+    cache = LLMCache(args.db)
+    keep = None
+    if args.keep_current:
+        from llm_analysis import SYSTEM_PROMPT
+        keep = prompt_version(SYSTEM_PROMPT)
+    if args.older_than_days is not None or keep:
+        n = cache.prune(args.older_than_days, keep)
+        print(f"[DONE] 已删除 {n} 条缓存记录")
+    if args.stats or (args.older_than_days is None and not keep):
+        for s in cache.stats():
+            print(f"{s['prompt_version']}  {s['model']:<16} {s['count']:>8} 条  {s['oldest']} ~ {s['newest']}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
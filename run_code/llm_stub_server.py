@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+llm_stub_server.py
+本地 OpenAI 兼容桩服务，用于在不消耗 API 额度的情况下测试 llm_analysis 的并发、限速与重试逻辑。
+- POST /chat/completions（或 /v1/chat/completions）：按关键词规则返回确定性的 JSON 标注；
+- --latency 模拟响应延迟，--fail_rate 按比例随机返回 429 / 500；
+- 批量请求（每行 [id] 文本）返回 {"results": [...]}，--drop_rate 按比例漏掉条目以测试重排逻辑。
+用法：
+    python run_code/llm_stub_server.py --port 8009 --latency 0.2 --fail_rate 0.1
+    DEEP_API_KEY=stub DEEPSEEK_BASE_URL=http://127.0.0.1:8009 python run_code/llm_analysis.py --async ...
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EXPOSED_WORDS = ["损失", "减值", "灾害", "中断", "受损", "成本上升"]
+PREVENT_WORDS = ["减排", "转型", "研发", "目标", "投入", "治理"]
+
+def rule_label(text: str):
+    """按关键词给出确定性标注。"""
+    if any(w in text for w in EXPOSED_WORDS):
+        return {"label": -1, "prob_exposed": 0.8, "prob_prevent": 0.1, "prob_neutral": 0.1, "reason": "stub: 暴露"}
+    if any(w in text for w in PREVENT_WORDS):
+        return {"label": 1, "prob_exposed": 0.1, "prob_prevent": 0.8, "prob_neutral": 0.1, "reason": "stub: 防范"}
+    return {"label": 0, "prob_exposed": 0.1, "prob_prevent": 0.1, "prob_neutral": 0.8, "reason": "stub: 不相关"}
+
+BATCH_LINE_RE = re.compile(r"^\[(\d+)\]\s*(.*)$", re.M)
+
+def make_reply(messages, drop_rate=0.0):
+    """根据用户消息生成回复内容；批量请求（每行以 [id] 开头）返回 results 数组，并按 drop_rate 随机漏掉条目。"""
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    if '"results"' in system:
+        results = []
+        for sid, text in BATCH_LINE_RE.findall(user):
+            if random.random() < drop_rate:
+                continue
+            results.append({"id": int(sid), **rule_label(text)})
+        return json.dumps({"results": results}, ensure_ascii=False)
+    return json.dumps(rule_label(user), ensure_ascii=False)
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    drop_rate = 0.0
+    stats = {"requests": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.lock:
+            self.stats["requests"] += 1
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.fail_rate:
+            with self.lock:
+                self.stats["failed"] += 1
+            if random.random() < 0.5:
+                self._send(429, {"error": {"message": "rate limited", "type": "rate_limit"}}, {"Retry-After": "0.1"})
+            else:
+                self._send(500, {"error": {"message": "internal error", "type": "server_error"}})
+            return
+        messages = req.get("messages", [])
+        content = make_reply(messages, self.drop_rate)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages)
+        completion_tokens = len(content)
+        self._send(200, {
+            "id": f"stub-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8009)
+    ap.add_argument("--latency", type=float, default=0.0, help="平均响应延迟（秒）")
+    ap.add_argument("--fail_rate", type=float, default=0.0, help="随机返回 429/500 的比例")
+    ap.add_argument("--drop_rate", type=float, default=0.0, help="批量请求中随机漏掉条目的比例")
+    args = ap.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.fail_rate = args.fail_rate
+    StubHandler.drop_rate = args.drop_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"[INFO] stub 服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[DONE] 请求 {StubHandler.stats['requests']}，注入失败 {StubHandler.stats['failed']}")
+
+if __name__ == "__main__":
+    main()
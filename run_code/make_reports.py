@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+make_reports.py
+合成年报 TXT 生成器：在没有私有语料时为性能测试提供规模可控、结构逼真的输入。
+- 文件名符合 extract_mda.FNAME_RE：<代码>_<年份>_<公司>_<年份>年年度报告_<披露日>.txt，按 <年份>_年报 子目录存放；
+- 结构：封面、重要提示（含“详见第三节 管理层讨论与分析”式引用）、目录（带引导点的诱饵标题）、释义、
+  公司简介、MD&A 章节（标题取自 TITLE_KEYWORDS，每页页眉为“公司 年度报告 章节标题”一行）、
+  其后为 NEXT_KEYWORDS 中的章节与财务报表；
+- synth_manifest.json 中的 mda_sents 为 MD&A 句数（以“。”或“；”结尾），extract_mda 正确提取时两者一致；
+- 正文按 PDF 转换的样子折行、插入页眉页码；
+- MD&A 中含关键词（取自 keywords.json）的句子比例由 --density 控制，其余章节的填充句不含关键词；
+- 相同 --seed 与参数生成的文件逐字节一致。
+用法：
+    python run_code/make_reports.py --out synth --n 200 --years 2023-2024 --density 0.03
+    python run_code/extract_mda.py --in_base synth --out_base synth_mda --years 2023-2024
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+from extract_mda import NEXT_KEYWORDS, FNAME_RE
+
+KEYWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "date", "keywords.json")
+# 各标题在真实年报中的大致占比：2016 年后多为“管理层讨论与分析”，早年多为“董事会报告”
+TITLE_WEIGHTS = {"管理层讨论与分析": 6, "经营情况讨论与分析": 2, "董事会报告": 2}
+LINE_WIDTH = (38, 48)          # PDF 转换后每行的字数范围
+PAGE_CHARS = 1400              # 每页正文字数，用于插入页眉页码
+# 版面规则变化时递增，bench_scaling 据此重新生成缓存的语料
+LAYOUT_VERSION = 2
+
+# ================= 填充语料 =================
+SUBJECTS = ["公司", "本公司", "集团", "报告期内公司", "公司管理层", "本集团", "公司董事会"]
+BIZ = ["主营业务", "核心产品", "零售业务", "对公业务", "海外业务", "研发投入", "销售网络", "信息化建设",
+       "客户服务", "人才队伍", "内部控制", "成本管控", "产品结构", "营销体系", "渠道布局", "数字化转型"]
+VERBS = ["持续推进", "不断优化", "稳步提升", "全面加强", "积极拓展", "深入落实", "进一步完善", "有序开展"]
+RESULTS = ["经营质量持续改善", "市场份额稳步提升", "盈利能力有所增强", "运营效率明显提高", "风险抵御能力不断增强",
+           "客户满意度保持较高水平", "资产质量总体稳定", "核心竞争力进一步巩固"]
+METRICS = ["营业收入", "归属于上市公司股东的净利润", "经营活动产生的现金流量净额", "总资产", "研发费用",
+           "销售费用", "管理费用", "毛利率", "加权平均净资产收益率", "基本每股收益"]
+CONNECT = ["同时，", "此外，", "另一方面，", "与此同时，", "总体来看，", ""]
+# 含关键词的句式，{kw} 处填入关键词
+KW_TEMPLATES = [
+    "{kw}可能对公司生产经营造成不利影响，公司已制定相应的应对预案",
+    "报告期内，公司密切关注{kw}相关情况，并将其纳入全面风险管理体系",
+    "受{kw}影响，公司部分业务面临一定压力，相关成本有所上升",
+    "公司积极把握{kw}带来的发展机遇，持续加大相关领域投入",
+    "围绕{kw}，公司{verb}{biz}，推动业务高质量发展",
+    "未来，{kw}仍是公司面临的重要外部因素之一，公司将持续跟踪评估",
+]
+
+def load_keywords(path=KEYWORDS_FILE):
+    """读取种子词表 keywords.json：{一级: {二级: {主题: [词...]}}} -> {(一级, 二级): [词...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = json.load(f)
+    out = {}
+    for cat, subs in tree.items():
+        for sub, groups in subs.items():
+            words = []
+            for ws in (groups.values() if isinstance(groups, dict) else [groups]):
+                words.extend(w for w in ws if w not in words)
+            out[(cat, sub)] = words
+    return out
+
+def _amount(rng):
+    return f"{rng.uniform(0.5, 3000):,.2f}"
+
+def filler_sentence(rng):
+    k = rng.random()
+    if k < 0.35:
+        return (f"{rng.choice(CONNECT)}{rng.choice(SUBJECTS)}{rng.choice(VERBS)}{rng.choice(BIZ)}，"
+                f"{rng.choice(RESULTS)}。")
+    if k < 0.7:
+        up = rng.random() < 0.7
+        return (f"报告期内，公司实现{rng.choice(METRICS)}{_amount(rng)}亿元，同比{'增长' if up else '下降'}"
+                f"{rng.uniform(0.1, 40):.2f}%，{rng.choice(RESULTS)}。")
+    if k < 0.85:
+        return (f"{rng.choice(SUBJECTS)}围绕年度经营目标，{rng.choice(VERBS)}{rng.choice(BIZ)}与"
+                f"{rng.choice(BIZ)}的协同，{rng.choice(RESULTS)}；")
+    return f"截至报告期末，{rng.choice(METRICS)}为{_amount(rng)}万元，较上年末{rng.choice(['增加', '减少'])}{_amount(rng)}万元。"
+
+def build_pool(rng, keywords, size):
+    """预生成填充句池（剔除偶然含关键词的句子），生成正文时从池中抽样，保证速度。"""
+    pool = []
+    while len(pool) < size:
+        s = filler_sentence(rng)
+        if not any(w in s for w in keywords):
+            pool.append(s)
+    return pool
+
+def keyword_sentence(rng, words):
+    kw = rng.choice(words)
+    s = rng.choice(KW_TEMPLATES).format(kw=kw, verb=rng.choice(VERBS), biz=rng.choice(BIZ))
+    return s + rng.choice(["。", "。", "；"]), kw
+
+# ================= 版面 =================
+def layout(text, rng, company, year, header, page_no):
+    """
+    按 PDF 转换的样子折行，每 PAGE_CHARS 字插入页码与页眉，返回 (文本, 新页码)。
+    页眉为“公司 年度报告 章节标题”一行，不与章节标题本身（独占一行）混淆。
+    """
+    lines, pos, since_page = [], 0, 0
+    while pos < len(text):
+        w = rng.randint(*LINE_WIDTH)
+        lines.append(text[pos:pos + w])
+        pos += w
+        since_page += w
+        if since_page >= PAGE_CHARS:
+            page_no += 1
+            lines.append(f"{page_no}\n{company}股份有限公司 {year} 年年度报告 {header}")
+            since_page = 0
+    return "\n".join(lines), page_no
+
+def toc_line(title, page):
+    # 与 PDF 转换结果一致，标题与引导点之间有空格；extract_mda 据此把目录行之后的章节标题作为正文起点
+    return f"{title} {'.' * (100 - 2 * len(title))} {page}"
+
+def make_report(rng, pool, kw_words, code, year, company, mda_sents, density, title=None, next_kw=None,
+                missing=False):
+    """
+    生成一份年报文本，返回 (文本, 统计)。
+    统计含 MD&A 句数与其中含关键词的句数；missing=True 时不含任何 MD&A 标题（extract_mda 应跳过）。
+    """
+    title = title or rng.choices(list(TITLE_WEIGHTS), weights=list(TITLE_WEIGHTS.values()))[0]
+    next_kw = next_kw or rng.choice(NEXT_KEYWORDS)
+    mda_title = "第一节 经营概况" if missing else f"第三节 {title}"
+    parts, page = [], 1
+    body = lambda n: "".join(rng.choice(pool) for _ in range(n))
+
+    parts.append(f"{company}股份有限公司\n{year} 年年度报告\n重要提示\n{page}")
+    risk_ref = "经营概况" if missing else title
+    intro = (f"1、本公司董事会、监事会及董事、监事、高级管理人员保证年度报告内容的真实、准确、完整。"
+             f"2、公司经营中面临的风险详见“第三节 {risk_ref}”中关于公司未来发展的讨论与分析。" + body(6))
+    text, page = layout(intro, rng, company, year, "重要提示", page)
+    parts.append(text)
+
+    chapters = ["释义", "公司简介和主要财务指标", mda_title.split(" ", 1)[1], next_kw, "环境和社会责任", "财务报告"]
+    toc_pages = sorted(rng.sample(range(3, 200), len(chapters)))
+    parts.append("目\n录\n" + "\n".join(toc_line(c, p) for c, p in zip(chapters, toc_pages)))
+
+    for header, n in (("释义", 8), ("公司简介和主要财务指标", 40)):
+        text, page = layout(f"第{'一' if header == '释义' else '二'}节 {header}\n" + body(n), rng, company, year,
+                            header, page)
+        parts.append(text)
+
+    # MD&A：按 density 混入含关键词的句子
+    n_kw = 0
+    sents = []
+    for _ in range(mda_sents):
+        if rng.random() < density:
+            s, _ = keyword_sentence(rng, kw_words)
+            n_kw += 1
+        else:
+            s = rng.choice(pool)
+        sents.append(s)
+    header = mda_title.split(" ", 1)[1]
+    text, page = layout("".join(sents), rng, company, year, header, page)
+    parts.append(f"{mda_title}\n{text}")
+
+    for i, header in enumerate([next_kw, "环境和社会责任"]):
+        text, page = layout(body(max(20, mda_sents // 4)), rng, company, year, header, page)
+        parts.append(f"第{'四五'[i]}节 {header}\n{text}")
+
+    rows = "\n".join(f"{m} {_amount(rng)} {_amount(rng)} {rng.uniform(-30, 30):.2f}%" for m in
+                     rng.sample(METRICS, len(METRICS)) * max(1, mda_sents // 40))
+    parts.append(f"第十节 财务报告\n合并资产负债表\n项目 期末余额 期初余额 变动比例\n{rows}")
+
+    stats = {"mda_sents": 0 if missing else mda_sents, "kw_sents": 0 if missing else n_kw, "missing": missing,
+             "title": None if missing else title}
+    return "\n".join(parts) + "\n", stats
+
+def report_name(code, year, company, rng):
+    d = f"{int(year) + 1}-{rng.randint(3, 4):02d}-{rng.randint(1, 28):02d}"
+    name = f"{code}_{year}_{company}_{year}年年度报告_{d}.txt"
+    assert FNAME_RE.match(name), name
+    return name
+
+def generate(out_dir, n, years, seed=0, density=0.03, mda_sents=300, missing=0.02, keywords_path=KEYWORDS_FILE,
+             pool_size=4000, progress=True):
+    """
+    在 out_dir/<年份>_年报/ 下生成 n 家公司 × 各年度的年报，返回统计信息（同时写入 out_dir/synth_manifest.json）。
+    每家公司的 MD&A 句数在 mda_sents 的 0.5~1.5 倍之间浮动。
+    """
+    rng = random.Random(seed)
+    catmap = load_keywords(keywords_path)
+    kw_words = sorted({w for ws in catmap.values() for w in ws})
+    pool = build_pool(rng, kw_words, pool_size)
+    companies = [(f"{(600000 if i % 2 else 0) + i + 1:06d}", f"合成{i:05d}") for i in range(n)]
+
+    t0 = time.perf_counter()
+    total = {"files": 0, "bytes": 0, "mda_sents": 0, "kw_sents": 0, "missing": 0}
+    for year in years:
+        year_dir = os.path.join(out_dir, f"{year}_年报")
+        os.makedirs(year_dir, exist_ok=True)
+        for code, company in companies:
+            frng = random.Random(f"{seed}-{code}-{year}")
+            k = max(60, int(mda_sents * frng.uniform(0.5, 1.5)))
+            text, st = make_report(frng, pool, kw_words, code, year, company, k, density,
+                                   missing=frng.random() < missing)
+            data = text.encode("utf-8")
+            with open(os.path.join(year_dir, report_name(code, year, company, frng)), "wb") as f:
+                f.write(data)
+            total["files"] += 1
+            total["bytes"] += len(data)
+            total["mda_sents"] += st["mda_sents"]
+            total["kw_sents"] += st["kw_sents"]
+            total["missing"] += int(st["missing"])
+        if progress:
+            print(f"[INFO] {year}：{len(companies)} 份")
+    manifest = {"params": {"n": n, "years": list(years), "seed": seed, "density": density, "mda_sents": mda_sents,
+                           "missing": missing, "pool_size": pool_size, "layout": LAYOUT_VERSION},
+                "stats": total, "seconds": round(time.perf_counter() - t0, 2)}
+    with open(os.path.join(out_dir, "synth_manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def parse_years(spec):
+    y0, _, y1 = str(spec).partition("-")
+    return [str(y) for y in range(int(y0), int(y1 or y0) + 1)]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True, help="输出根目录（其下按 <年份>_年报 建子目录）")
+    ap.add_argument("--n", type=int, default=100, help="公司数（每家每年一份）")
+    ap.add_argument("--years", default="2024", help="年份或年份范围，如 2024 或 2014-2024")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--density", type=float, default=0.03, help="MD&A 中含关键词句子的比例")
+    ap.add_argument("--mda_sents", type=int, default=300, help="每份 MD&A 的平均句数")
+    ap.add_argument("--missing", type=float, default=0.02, help="不含 MD&A 标题的报告比例")
+    ap.add_argument("--keywords", default=KEYWORDS_FILE, help="种子词表 keywords.json")
+    args = ap.parse_args()
+
+    m = generate(args.out, args.n, parse_years(args.years), args.seed, args.density, args.mda_sents, args.missing,
+                 args.keywords)
+    st = m["stats"]
+    print(f"[DONE] {st['files']} 份，{st['bytes'] / 2**20:,.1f} MB，MD&A 句 {st['mda_sents']:,}，"
+          f"含关键词 {st['kw_sents']:,}（{st['kw_sents'] / max(st['mda_sents'], 1):.2%}），"
+          f"无 MD&A {st['missing']}，耗时 {m['seconds']}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+各脚本共用的运行指标：以 JSON Lines 追加写入指标文件，每行一个事件
+    {"ts": 时间戳, "run": 运行ID, "stage": 步骤, "pid": 进程号, "event": 事件名, ...数值字段}
+- 未指定指标文件（--metrics 或环境变量 CLIMATE_METRICS）时 emit 为空操作，不影响原有性能；
+- 配置写入环境变量，进程池中的工作进程与 pipeline.py 启动的子进程自动写入同一文件、同一运行ID；
+- stage_run() 记录整个步骤的墙钟时间与峰值内存，结束时按事件打印分位数汇总（p50 / p90 / p99 / max / 合计）；
+- --profile（或 CLIMATE_PROFILE=步骤名）时用 cProfile 剖析该步骤的主进程，结果写入 <步骤>.prof 并打印耗时最多的函数。
+用法：
+    python run_code/extract_hits.py ... --metrics metrics.jsonl --profile
+    python run_code/metrics.py metrics.jsonl --run <运行ID> --stage extract_hits
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+ENV_PATH = "CLIMATE_METRICS"
+ENV_RUN = "CLIMATE_RUN_ID"
+ENV_STAGE = "CLIMATE_STAGE"
+ENV_PROFILE = "CLIMATE_PROFILE"
+# 汇总时不参与统计的字段
+META_FIELDS = {"ts", "run", "stage", "pid", "event"}
+QUANTILES = (50, 90, 99)
+
+_LOCK = threading.Lock()
+_STATE = {"path": None, "run": "", "stage": "", "fh": None, "pid": None, "loaded": False}
+
+def configure(path=None, stage=None, run_id=None):
+    """设置指标文件、步骤名与运行ID，并写入环境变量供子进程继承；path 为空时沿用环境变量。"""
+    path = path or os.environ.get(ENV_PATH) or None
+    if path:
+        path = os.path.abspath(path)
+        os.environ[ENV_PATH] = path
+        os.environ[ENV_RUN] = run_id or os.environ.get(ENV_RUN) or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    if stage:
+        os.environ[ENV_STAGE] = stage
+    with _LOCK:
+        if _STATE["fh"] is not None and _STATE["path"] != path:
+            _STATE["fh"].close()
+            _STATE["fh"] = None
+        _STATE.update(path=path, run=os.environ.get(ENV_RUN, ""), stage=os.environ.get(ENV_STAGE, ""), loaded=True)
+
+def enabled():
+    if not _STATE["loaded"]:
+        configure()
+    return _STATE["path"] is not None
+
+def run_id():
+    return _STATE["run"] if enabled() else ""
+
+def emit(event, **fields):
+    """追加一条事件；未启用时直接返回。"""
+    if not enabled():
+        return
+    rec = {"ts": round(time.time(), 3), "run": _STATE["run"], "stage": _STATE["stage"], "pid": os.getpid(),
+           "event": event}
+    rec.update(fields)
+    line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+    with _LOCK:
+        # fork 出的子进程不复用父进程的文件句柄
+        if _STATE["fh"] is None or _STATE["pid"] != os.getpid():
+            os.makedirs(os.path.dirname(_STATE["path"]), exist_ok=True)
+            _STATE["fh"] = open(_STATE["path"], "a", encoding="utf-8")
+            _STATE["pid"] = os.getpid()
+        _STATE["fh"].write(line)
+        _STATE["fh"].flush()
+
+@contextmanager
+def timer(event, **fields):
+    """计时上下文：结束时写入 seconds 及调用方在返回的 dict 中补充的字段；出错时记录 error。"""
+    if not enabled():
+        yield fields
+        return
+    t0 = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        emit(event, seconds=round(time.perf_counter() - t0, 6), **fields)
+
+def peak_rss_mb():
+    """进程峰值内存（MB）；Windows 下无 resource 模块时返回 nan。"""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / (1024 * 1024) if sys.platform == "darwin" else r / 1024
+
+# ================= 步骤 =================
+def add_args(ap):
+    ap.add_argument("--metrics", default="", help="指标文件（JSON Lines，追加写入）；留空则不记录")
+    ap.add_argument("--profile", action="store_true", help="用 cProfile 剖析本步骤（主进程）")
+
+def _profile_wanted(stage, flag):
+    want = os.environ.get(ENV_PROFILE, "")
+    return flag or want == "all" or stage in want.split(",")
+
+@contextmanager
+def stage_run(stage, args=None):
+    """
+    包裹一个脚本的主流程：记录 run_start / run_end（墙钟时间、峰值内存、成功与否），
+    按需开启 cProfile，结束时打印本步骤的指标汇总。
+    """
+    configure(getattr(args, "metrics", "") or None, stage)
+    profiler = None
+    if _profile_wanted(stage, getattr(args, "profile", False)):
+        import cProfile
+        profiler = cProfile.Profile()
+    emit("run_start", argv=sys.argv[1:])
+    t0 = time.perf_counter()
+    status = "error"
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+        status = "ok"
+    finally:
+        if profiler:
+            profiler.disable()
+        seconds = time.perf_counter() - t0
+        emit("run_end", seconds=round(seconds, 3), peak_rss_mb=round(peak_rss_mb(), 1), status=status)
+        if profiler:
+            dump_profile(profiler, stage)
+        if enabled():
+            print_summary(load_events(_STATE["path"], _STATE["run"], stage))
+
+def dump_profile(profiler, stage, top=25):
+    import pstats
+    base = os.path.dirname(_STATE["path"]) if enabled() else os.getcwd()
+    path = os.path.join(base, f"{stage}.prof")
+    profiler.dump_stats(path)
+    print(f"[INFO] cProfile 结果：{path}（可用 snakeviz / pstats 查看），累计耗时前 {top} 的函数：")
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(top)
+
+# ================= 汇总 =================
+def load_events(path, run=None, stage=None):
+    events = []
+    if not path or not os.path.exists(path):
+        return events
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if (run and rec.get("run") != run) or (stage and rec.get("stage") != stage):
+                continue
+            events.append(rec)
+    return events
+
+def summarize(events):
+    """
+    按 (步骤, 事件) 汇总数值字段：次数、合计、分位数、最大值；
+    含 sentences 字段的事件额外给出吞吐（句/秒，按事件耗时合计与按步骤墙钟时间）。
+    """
+    groups = {}
+    for rec in events:
+        groups.setdefault((rec.get("stage", ""), rec["event"]), []).append(rec)
+    wall = {}
+    for (stage, event), recs in groups.items():
+        if event == "run_end":
+            wall[stage] = sum(r.get("seconds", 0) for r in recs)
+    out = []
+    for (stage, event), recs in groups.items():
+        fields = {}
+        for r in recs:
+            for k, v in r.items():
+                if k not in META_FIELDS and isinstance(v, (int, float)) and not isinstance(v, bool):
+                    fields.setdefault(k, []).append(v)
+        row = {"stage": stage, "event": event, "count": len(recs), "fields": {}}
+        for k, vals in fields.items():
+            a = np.asarray(vals, dtype=float)
+            row["fields"][k] = {"sum": float(a.sum()), "max": float(a.max()),
+                                **{f"p{q}": float(np.percentile(a, q)) for q in QUANTILES}}
+        f = row["fields"]
+        if "sentences" in f and "seconds" in f:
+            row["sentences_per_s"] = f["sentences"]["sum"] / max(f["seconds"]["sum"], 1e-9)
+            if wall.get(stage):
+                row["sentences_per_s_wall"] = f["sentences"]["sum"] / wall[stage]
+        errors = sum(1 for r in recs if r.get("error") or r.get("status") in ("error", "fail"))
+        if errors:
+            row["errors"] = errors
+        out.append(row)
+    return out
+
+def print_summary(events):
+    rows = summarize(events)
+    if not rows:
+        return
+    print("\n📈 指标汇总（p50 / p90 / p99 / max，合计）：")
+    for row in rows:
+        extra = f"，错误 {row['errors']}" if row.get("errors") else ""
+        print(f"  [{row['stage'] or '-'}] {row['event']}：{row['count']} 次{extra}")
+        for k, s in row["fields"].items():
+            print(f"      {k:<20} {s['p50']:>12.4g} {s['p90']:>12.4g} {s['p99']:>12.4g} {s['max']:>12.4g}   "
+                  f"合计 {s['sum']:.6g}")
+        if "sentences_per_s" in row:
+            wall = f"，按墙钟 {row['sentences_per_s_wall']:,.0f} 句/秒" if "sentences_per_s_wall" in row else ""
+            print(f"      吞吐：按单文件耗时 {row['sentences_per_s']:,.0f} 句/秒{wall}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("path", help="指标文件（JSON Lines）")
+    ap.add_argument("--run", default="", help="只汇总该运行ID（默认最近一次）")
+    ap.add_argument("--stage", default="", help="只汇总该步骤")
+    args = ap.parse_args()
+
+    events = load_events(args.path)
+    run = args.run or (events[-1]["run"] if events else "")
+    events = [e for e in events if e.get("run") == run and (not args.stage or e.get("stage") == args.stage)]
+    print(f"[INFO] 运行ID {run}，{len(events)} 条事件")
+    print_summary(events)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+near_dup.py
+句子近似重复聚类（字符 shingle + MinHash + LSH 分桶），用于合并“积极响应双碳号召”一类仅有少量公司化改动的模板句：
+- 每簇只需标注一个代表句（簇内最小行号），结果复制给全部成员，节省 LLM / FinBERT 推理次数；
+- 签名与分桶全部按批向量化（NumPy），可处理百万级句子；
+- 分桶候选对按签名估计的 Jaccard 相似度复核，低于阈值的不合并。
+用法：
+    python run_code/near_dup.py --input climaterisk_final_sample.csv --threshold 0.8 --output sample_clusters.csv
+"""
+
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from llm_cache import normalize_text
+
+DIGITS_RE = re.compile(r"\d+")
+
+def shingle_text(text) -> str:
+    """聚类前的规范化：NFKC、合并空白，数字统一为 0（年份、金额等公司化改动不影响相似度）。"""
+    return DIGITS_RE.sub("0", normalize_text(text))
+
+def _mix64(x):
+    """splitmix64 终混函数（uint64 数组，溢出按模 2^64 回绕）。"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+EMPTY_HASH = np.uint64(0)      # 空句的 shingle 哈希
+
+def _shingle_hashes(texts, k):
+    """
+    一批句子的全部 k 字 shingle 哈希，返回 (哈希数组, 每句起始下标)。
+    句子间以 k-1 个 0 码点隔开，短于 k 字的句子整体作为一个 shingle；空句取固定哈希。
+    """
+    sep = "\0" * (k - 1)
+    # 末尾多补一个 0：空句的 shingle 窗口比其后的分隔符长一位，末句为空时不越界
+    joined = sep.join(texts) + "\0" * k
+    cp = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lens = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    starts = np.concatenate([[0], np.cumsum(lens + k - 1)[:-1]])
+    n_sh = np.maximum(lens - k + 1, 1)
+    seg = np.repeat(np.arange(len(texts)), n_sh)
+    first = np.concatenate([[0], np.cumsum(n_sh)[:-1]])
+    pos = starts[seg] + (np.arange(n_sh.sum()) - first[seg])
+    h = np.zeros(len(pos), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(k):
+            h = h * np.uint64(1000003) + cp[pos + j]
+        h = _mix64(h)
+    # 空句的窗口会读到下一句的首字，统一改为固定值，空句之间互为重复
+    h[first[lens == 0]] = EMPTY_HASH
+    return h, first
+
+def minhash_signatures(texts, num_perm=64, k=3, seed=1, batch=20000):
+    """MinHash 签名矩阵 (句子数, num_perm)，uint32。排列为 (a·x + b) mod 2^64 取高 32 位。"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    sig = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for lo in range(0, len(texts), batch):
+        chunk = [shingle_text(t) for t in texts[lo:lo + batch]]
+        h, first = _shingle_hashes(chunk, k)
+        with np.errstate(over="ignore"):
+            for p in range(num_perm):
+                v = ((h * a[p] + b[p]) >> np.uint64(32)).astype(np.uint32)
+                sig[lo:lo + len(chunk), p] = np.minimum.reduceat(v, first)
+    return sig
+
+def lsh_params(threshold: float, num_perm: int):
+    """
+    选择分桶参数 (bands, rows)：在 bands·rows ≤ num_perm 中取 S 曲线拐点 (1/b)^(1/r) 不高于阈值且最接近者，
+    偏向召回，误合并由签名相似度复核剔除。
+    """
+    best = (num_perm, 1)
+    best_t = -1.0
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        t = (1.0 / b) ** (1.0 / r)
+        if t <= threshold and t > best_t:
+            best, best_t = (b, r), t
+    return best
+
+def _band_keys(sig, band, rows):
+    key = np.zeros(sig.shape[0], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for c in range(band * rows, (band + 1) * rows):
+            key = (key ^ sig[:, c].astype(np.uint64)) * np.uint64(0x100000001B3)
+    return key
+
+def _components(n, u, v):
+    """无向图连通分量（最小下标标签传播 + 指针跳跃），返回每个节点所在分量的最小下标。"""
+    labels = np.arange(n, dtype=np.int64)
+    if not len(u):
+        return labels
+    while True:
+        m = np.minimum(labels[u], labels[v])
+        before = labels.copy()
+        np.minimum.at(labels, u, m)
+        np.minimum.at(labels, v, m)
+        while True:
+            nxt = labels[labels]
+            if np.array_equal(nxt, labels):
+                break
+            labels = nxt
+        if np.array_equal(labels, before):
+            return labels
+
+def cluster_signatures(sig, threshold=0.8, bands=None, rows=None, verify_batch=200000):
+    """
+    按签名做 LSH 分桶：同一桶内的句子与桶首句比较签名一致比例（估计 Jaccard），达到阈值则合并，
+    合并后的每个成员与代表句的估计相似度均不低于阈值。返回每句的代表行号（所在簇的最小行号）。
+    """
+    n, num_perm = sig.shape
+    if bands is None or rows is None:
+        bands, rows = lsh_params(threshold, num_perm)
+    us, vs = [], []
+    for band in range(bands):
+        key = _band_keys(sig, band, rows)
+        order = np.argsort(key, kind="stable")
+        ks = key[order]
+        new_run = np.ones(n, dtype=bool)
+        new_run[1:] = ks[1:] != ks[:-1]
+        head = order[np.maximum.accumulate(np.where(new_run, np.arange(n), 0))]
+        members = ~new_run
+        u, v = order[members], head[members]
+        for lo in range(0, len(u), verify_batch):
+            uu, vv = u[lo:lo + verify_batch], v[lo:lo + verify_batch]
+            ok = (sig[uu] == sig[vv]).mean(axis=1) >= threshold
+            us.append(uu[ok]); vs.append(vv[ok])
+    u = np.concatenate(us) if us else np.zeros(0, dtype=np.int64)
+    v = np.concatenate(vs) if vs else np.zeros(0, dtype=np.int64)
+    rep = _components(n, u, v)
+    # 连通分量可能经由中间句串联出与代表句差异较大的成员：与代表句相似度不足者单独成簇
+    for lo in range(0, n, verify_batch):
+        r = rep[lo:lo + verify_batch]
+        far = (sig[lo:lo + verify_batch] == sig[r]).mean(axis=1) < threshold
+        r[far] = np.arange(lo, lo + len(r))[far]
+    return rep
+
+def cluster_near_duplicates(texts, threshold=0.8, num_perm=128, k=3, seed=1):
+    """句子列表 -> 每句的代表行号（np.int64 数组）；rep[i] == i 的句子即需要标注的代表句。"""
+    texts = ["" if t is None or (isinstance(t, float) and np.isnan(t)) else str(t) for t in texts]
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    sig = minhash_signatures(texts, num_perm=num_perm, k=k, seed=seed)
+    return cluster_signatures(sig, threshold)
+
+def cluster_stats(rep):
+    """簇统计：句子数、簇数、单句簇、多句簇覆盖句数、最大簇、可节省的推理次数。"""
+    sizes = np.bincount(rep, minlength=len(rep))
+    sizes = sizes[sizes > 0]
+    n_multi = sizes[sizes > 1]
+    return {
+        "sentences": int(len(rep)),
+        "clusters": int(len(sizes)),
+        "singletons": int((sizes == 1).sum()),
+        "multi_clusters": int(len(n_multi)),
+        "multi_sentences": int(n_multi.sum()),
+        "max_size": int(sizes.max()) if len(sizes) else 0,
+        "saved_calls": int(len(rep) - len(sizes)),
+    }
+
+def print_stats(stats):
+    n = max(stats["sentences"], 1)
+    print(f"[INFO] 句子 {stats['sentences']}，簇 {stats['clusters']}（单句簇 {stats['singletons']}，"
+          f"多句簇 {stats['multi_clusters']} 覆盖 {stats['multi_sentences']} 句，最大簇 {stats['max_size']}）")
+    print(f"[INFO] 只标注代表句可节省 {stats['saved_calls']} 次推理（{stats['saved_calls'] / n:.1%}）")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", required=True, help="句子 CSV（如 climaterisk_final_sample.csv）")
+    ap.add_argument("--column", default="句子", help="句子列名")
+    ap.add_argument("--output", default="", help="输出 CSV：追加 近似重复簇（代表行号）与 簇大小 两列")
+    ap.add_argument("--threshold", type=float, default=0.8, help="Jaccard 相似度阈值")
+    ap.add_argument("--num_perm", type=int, default=128, help="MinHash 排列数")
+    ap.add_argument("--shingle", type=int, default=3, help="字符 shingle 长度")
+    ap.add_argument("--show", type=int, default=5, help="打印最大的若干个簇的示例")
+    args = ap.parse_args()
+
+    df = pd.read_csv(args.input, encoding="utf-8-sig")
+    texts = df[args.column].tolist()
+    t0 = time.time()
+    rep = cluster_near_duplicates(texts, args.threshold, args.num_perm, args.shingle)
+    print(f"[INFO] 聚类耗时 {time.time() - t0:.1f}s，分桶参数 bands×rows = {lsh_params(args.threshold, args.num_perm)}")
+    print_stats(cluster_stats(rep))
+
+    sizes = np.bincount(rep, minlength=len(rep))
+    for r in np.argsort(-sizes, kind="stable")[:args.show]:
+        if sizes[r] < 2:
+            break
+        members = np.flatnonzero(rep == r)
+        print(f"  簇 {r}（{sizes[r]} 句）：{texts[r]}")
+        for m in members[1:3]:
+            print(f"      ~ {texts[m]}")
+    if args.output:
+        df["近似重复簇"] = rep
+        df["簇大小"] = sizes[rep]
+        df.to_csv(args.output, index=False, encoding="utf-8-sig")
+        print(f"[DONE] 输出：{args.output}")
+
+if __name__ == "__main__":
+    main()
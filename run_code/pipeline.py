@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+流水线运行器（取代 run.ipynb 中逐个手动执行的 !python 单元）：把各步骤建模为有向无环图
+    [ingest ─>] extract_mda ─┐
+                             ├─> extract_hits ─> sample ─┬─> score
+    expand ──────────────────┘                           └─> label
+- 每个步骤的指纹 = 脚本及其导入的仓库内模块源码 + 命令行参数 + 输入文件 / 上游输出的哈希；指纹不变且输出未被改动时跳过；
+- 没有依赖关系的步骤并发执行（--jobs），各步骤输出写入 <work>/logs/<步骤>.log；
+- 全部路径由命令行给出（默认都在 --work 目录下），不再依赖脚本中写死的 Windows 路径；
+- 例如只改 --min_sim 时，只有 expand 及其下游（extract_hits、sample、score、label）会重新运行。
+未使用预训练向量（--pretrained / --use_tencent）时，expand 以 MD&A 段落为语料训练词向量，此时依赖 extract_mda。
+给出 --pdf_base（年报 PDF）而非 --in_base 时，先由 ingest（ingest_pdf.py）转换为 <work>/txt 下的 TXT。
+用法：
+    python run_code/pipeline.py --in_base data/annual_txt --work data/pipeline --seeds data/keywords.json \\
+        --pretrained tencent.kv --min_sim 0.8 --years 2014-2024 --jobs 2
+    python run_code/pipeline.py --pdf_base data/annual_pdf --work data/pipeline --seeds data/keywords.json ...
+    python run_code/pipeline.py ... --dry_run                  # 只显示哪些步骤会运行
+    python run_code/pipeline.py ... --stages sample --force sample
+    python run_code/pipeline.py ... --extra label "--async --concurrency 16"
+"""
+
+import argparse
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import metrics
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_NAME = "pipeline_state.json"
+STATE_VERSION = 1
+# 超过该大小的文件（如预训练词向量）以 大小 + 修改时间 作为指纹，不读全文
+HASH_MAX_BYTES = 256 * 1024 * 1024
+
+# ================= 指纹 =================
+def file_fingerprint(path):
+    st = os.stat(path)
+    if st.st_size > HASH_MAX_BYTES:
+        return f"stat:{st.st_size}:{st.st_mtime_ns}"
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def dir_fingerprint(path, pattern="*"):
+    """目录指纹：按相对路径排序的 (路径, 大小, 修改时间)；只统计文件名匹配 pattern 的文件。"""
+    h = hashlib.sha1()
+    n = 0
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            fp = os.path.join(root, name)
+            st = os.stat(fp)
+            h.update(f"{os.path.relpath(fp, path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+            n += 1
+    return f"dir:{n}:{h.hexdigest()}"
+
+def path_fingerprint(spec):
+    """spec 为路径或 (目录, 文件名模式)；不存在时返回 None。"""
+    path, pattern = spec if isinstance(spec, tuple) else (spec, "*")
+    if os.path.isdir(path):
+        return dir_fingerprint(path, pattern)
+    if os.path.isfile(path):
+        return file_fingerprint(path)
+    return None
+
+def local_modules(script):
+    """脚本本身及其（递归）导入的 run_code 内模块文件名，含函数内的延迟导入。"""
+    seen, todo = set(), [script]
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        with open(os.path.join(CODE_DIR, name), "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                mods = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                mods = [node.module]
+            else:
+                continue
+            for mod in mods:
+                fn = mod.split(".")[0] + ".py"
+                if os.path.isfile(os.path.join(CODE_DIR, fn)):
+                    todo.append(fn)
+    return sorted(seen)
+
+def spec_key(spec):
+    return f"{spec[0]}::{spec[1]}" if isinstance(spec, tuple) else spec
+
+# ================= 步骤定义 =================
+class Stage:
+    """一个步骤：脚本、依赖、命令行参数，以及需要计入指纹的输入和需要检查的输出。"""
+
+    def __init__(self, name, script, deps, argv, inputs=(), outputs=()):
+        self.name = name
+        self.script = script
+        self.deps = list(deps)
+        self.argv = list(argv)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def command(self):
+        return [sys.executable, os.path.join(CODE_DIR, self.script)] + self.argv
+
+    def fingerprint(self, dep_outputs):
+        payload = {
+            "stage": self.name,
+            # 只改被导入的模块（如 llm_cache、sentence_store、extract_mda）也会使步骤失效
+            "code": {m: file_fingerprint(os.path.join(CODE_DIR, m)) for m in local_modules(self.script)},
+            "argv": self.argv,
+            "inputs": {spec_key(s): path_fingerprint(s) for s in self.inputs},
+            "deps": dep_outputs,
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def output_fingerprints(self):
+        return {spec_key(s): path_fingerprint(s) for s in self.outputs}
+
+def extra_args(args, stage):
+    return shlex.split(args.extra.get(stage, ""))
+
+def build_stages(args):
+    w = os.path.abspath(args.work)
+    mda_dir = os.path.abspath(args.mda_dir or os.path.join(w, "mda"))
+    dict_csv = os.path.join(w, "keywords_expand.csv")
+    hits = os.path.join(w, f"climaterisk_hits_{args.years}.parquet")
+    sample = os.path.join(w, "climaterisk_final_sample.csv")
+    workers = ["--workers", str(args.workers)]
+
+    stages = []
+    if args.pdf_base:
+        in_base = os.path.abspath(args.in_base or os.path.join(w, "txt"))
+        stages.append(Stage(
+            "ingest", "ingest_pdf.py", [],
+            ["--in_base", os.path.abspath(args.pdf_base), "--out_base", in_base, "--years", args.years]
+            + workers + (["--skip_financial"] if args.skip_financial else []) + extra_args(args, "ingest"),
+            inputs=[(os.path.abspath(args.pdf_base), "*.pdf")],
+            outputs=[(in_base, "*.txt")],
+        ))
+        mda_deps, mda_inputs = ["ingest"], []
+    else:
+        in_base = os.path.abspath(args.in_base)
+        mda_deps, mda_inputs = [], [(in_base, "*.txt")]
+    stages.append(Stage(
+        "extract_mda", "extract_mda.py", mda_deps,
+        ["--in_base", in_base, "--out_base", mda_dir, "--years", args.years]
+        + workers + extra_args(args, "extract_mda"),
+        inputs=mda_inputs,
+        outputs=[(mda_dir, "*.txt")],
+    ))
+
+    expand_argv = ["--seeds", os.path.abspath(args.seeds), "--topn", str(args.topn), "--min_sim", str(args.min_sim),
+                   "--excel", os.path.join(w, "keywords_expand.xlsx"), "--csv", dict_csv,
+                   "--vec_cache", os.path.join(w, "vec_cache")]
+    expand_inputs = [os.path.abspath(args.seeds)]
+    expand_deps = []
+    if args.pretrained:
+        expand_argv += ["--pretrained", os.path.abspath(args.pretrained)]
+        expand_inputs.append(os.path.abspath(args.pretrained))
+    elif args.use_tencent:
+        expand_argv += ["--use-tencent", "--cache_dir", os.path.join(w, "ms_models")]
+    else:
+        # 无预训练向量：以 MD&A 段落为语料训练
+        expand_argv += ["--corpus", mda_dir, "--model", os.path.join(w, "w2v.model"),
+                        "--token_cache", os.path.join(w, "token_cache")]
+        expand_deps.append("extract_mda")
+    if args.blacklist:
+        expand_argv += ["--blacklist", os.path.abspath(args.blacklist)]
+        expand_inputs.append(os.path.abspath(args.blacklist))
+    stages.append(Stage("expand", "keyword_expand_w2v.py", expand_deps, expand_argv + extra_args(args, "expand"),
+                        inputs=expand_inputs, outputs=[dict_csv]))
+
+    stages.append(Stage(
+        "extract_hits", "extract_hits.py", ["extract_mda", "expand"],
+        ["--dict", dict_csv, "--base_dir", mda_dir, "--years", args.years, "--out", hits]
+        + workers + extra_args(args, "extract_hits"),
+        outputs=[hits],
+    ))
+    stages.append(Stage(
+        "sample", "sample_hits.py", ["extract_hits"],
+        ["--input", hits, "--output", sample, "--sample_size", str(args.sample_size)] + extra_args(args, "sample"),
+        outputs=[sample],
+    ))
+    scores = os.path.join(w, "fcre_dictionary_scores.csv")
+    stages.append(Stage(
+        "score", "score_panel.py", ["sample"],
+        ["--panel", os.path.join(w, "score_panel"), "--hits", sample, "--rebuild", "--out", scores]
+        + extra_args(args, "score"),
+        outputs=[scores],
+    ))
+    stages.append(Stage(
+        "label", "llm_analysis.py", ["sample"],
+        ["--input", sample, "--output", os.path.join(w, "climaterisk_LLM_Full_Labeled.csv"),
+         "--checkpoint", os.path.join(w, "label_journal.jsonl"), "--cache", os.path.join(w, "llm_cache.sqlite")]
+        + extra_args(args, "label"),
+        outputs=[os.path.join(w, "climaterisk_LLM_Full_Labeled.csv")],
+    ))
+    return {s.name: s for s in stages}
+
+def select(stages, targets):
+    """目标步骤及其全部上游。"""
+    need, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in need:
+            need.add(name)
+            todo.extend(stages[name].deps)
+    return [n for n in stages if n in need]
+
+# ================= 状态 =================
+def load_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"version": STATE_VERSION, "stages": {}}
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def up_to_date(stage, fp, rec):
+    """指纹一致，且输出都存在、未在流水线之外被改动。"""
+    if not rec or rec.get("fingerprint") != fp:
+        return False
+    current = stage.output_fingerprints()
+    return all(v is not None for v in current.values()) and current == rec.get("outputs")
+
+# ================= 调度 =================
+def run_stage(stage, log_dir):
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{stage.name}.log")
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    t0 = time.time()
+    with open(log_path, "w", encoding="utf-8") as log:
+        log.write("$ " + " ".join(shlex.quote(c) for c in stage.command()) + "\n")
+        log.flush()
+        code = subprocess.call(stage.command(), stdout=log, stderr=subprocess.STDOUT, env=env,
+                               cwd=os.path.dirname(log_dir))
+    return code, time.time() - t0, log_path
+
+def run_pipeline(stages, order, state, state_path, jobs=2, force=(), dry_run=False):
+    """按依赖并发执行；返回 {步骤: 状态}，状态为 skip / ok / fail / blocked（dry_run 时为 run / skip）。"""
+    status = {}
+    recs = state["stages"]
+    log_dir = os.path.join(os.path.dirname(state_path), "logs")
+    pending = list(order)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        while pending or running:
+            for name in list(pending):
+                stage = stages[name]
+                deps = [d for d in stage.deps if d in order]
+                if any(status.get(d) in ("fail", "blocked") for d in deps):
+                    status[name] = "blocked"
+                    pending.remove(name)
+                    print(f"[WARN] {name}：上游失败，跳过")
+                    continue
+                if not all(status.get(d) in ("ok", "skip", "run") for d in deps):
+                    continue
+                pending.remove(name)
+                if dry_run and any(status.get(d) == "run" for d in deps):
+                    status[name] = "run"
+                    print(f"[PLAN] {name}：上游将重新运行")
+                    continue
+                dep_outputs = {d: recs.get(d, {}).get("outputs") for d in stage.deps}
+                fp = stage.fingerprint(dep_outputs)
+                if name not in force and "all" not in force and up_to_date(stage, fp, recs.get(name)):
+                    status[name] = "skip"
+                    metrics.emit("pipeline_stage", step=name, status="skip", seconds=0.0)
+                    print(f"[SKIP] {name}：指纹未变化，复用上次结果（原耗时 {recs[name].get('seconds', 0):.1f}s）")
+                    continue
+                if dry_run:
+                    status[name] = "run"
+                    print(f"[PLAN] {name}：{'强制' if name in force else '指纹变化'}，将重新运行")
+                    continue
+                print(f"[RUN] {name}：{' '.join(shlex.quote(c) for c in stage.command()[1:])}")
+                running[ex.submit(run_stage, stage, log_dir)] = (name, fp)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, fp = running.pop(fut)
+                code, seconds, log_path = fut.result()
+                outputs = stages[name].output_fingerprints()
+                missing = [k for k, v in outputs.items() if v is None]
+                if code != 0 or missing:
+                    status[name] = "fail"
+                    why = f"退出码 {code}" if code != 0 else f"缺少输出 {missing}"
+                    print(f"[ERR] {name}：{why}，耗时 {seconds:.1f}s，日志：{log_path}")
+                    recs.pop(name, None)
+                else:
+                    status[name] = "ok"
+                    recs[name] = {"fingerprint": fp, "outputs": outputs, "seconds": round(seconds, 2),
+                                  "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+                    print(f"[OK] {name}：耗时 {seconds:.1f}s")
+                metrics.emit("pipeline_stage", step=name, status=status[name], seconds=round(seconds, 3))
+                save_state(state_path, state)
+    return status
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work", default="pipeline_work", help="工作目录（各步骤输出、日志与状态文件）")
+    ap.add_argument("--in_base", default="", help="年报 TXT 根目录（含各年度子目录）；与 --pdf_base 同用时为 TXT 输出目录")
+    ap.add_argument("--pdf_base", default="", help="年报 PDF 根目录：先转换为 TXT（默认输出到 <work>/txt）")
+    ap.add_argument("--skip_financial", action="store_true", help="PDF 转换时跳过 MD&A 之后的财务报告章节")
+    ap.add_argument("--mda_dir", default="", help="MD&A 段落输出目录（默认 <work>/mda）")
+    ap.add_argument("--seeds", required=True, help="种子词 JSON")
+    ap.add_argument("--pretrained", default="", help="预训练词向量路径（.txt/.bin/.kv）")
+    ap.add_argument("--use_tencent", action="store_true", help="自动下载腾讯词向量")
+    ap.add_argument("--blacklist", default="", help="扩展词黑名单文件")
+    ap.add_argument("--topn", type=int, default=10, help="每个种子词扩展数量")
+    ap.add_argument("--min_sim", type=float, default=0.8, help="扩展词最小相似度")
+    ap.add_argument("--years", default="2014-2024", help="年份或年份范围")
+    ap.add_argument("--sample_size", type=int, default=10000, help="每个二级分类最多抽取的条数")
+    ap.add_argument("--workers", type=int, default=0, help="各步骤内部的并行进程数（0 为 CPU 核数-1）")
+    ap.add_argument("--jobs", type=int, default=2, help="同时运行的步骤数")
+    ap.add_argument("--stages", nargs="*", default=[], help="只运行这些步骤（及其上游）；默认全部")
+    ap.add_argument("--force", nargs="*", default=[], help="强制重新运行的步骤（all 为全部）")
+    ap.add_argument("--extra", nargs=2, action="append", default=[], metavar=("STAGE", "ARGS"),
+                    help="追加给某个步骤脚本的参数，如 --extra label \"--async --concurrency 16\"")
+    ap.add_argument("--dry_run", action="store_true", help="只显示将要运行的步骤")
+    ap.add_argument("--metrics", default="", help="指标文件（JSON Lines）；各步骤写入同一文件、同一运行ID")
+    ap.add_argument("--profile", nargs="*", default=[], metavar="STAGE", help="用 cProfile 剖析这些步骤（all 为全部）")
+    args = ap.parse_args()
+    if not (args.in_base or args.pdf_base):
+        ap.error("需要 --in_base 或 --pdf_base")
+    args.extra = dict(args.extra)
+
+    stages = build_stages(args)
+    unknown = [s for s in list(args.stages) + list(args.extra) + [f for f in args.force if f != "all"]
+               if s not in stages]
+    if unknown:
+        print(f"[ERR] 未知步骤：{unknown}（可选：{list(stages)}）")
+        sys.exit(2)
+    order = select(stages, args.stages or list(stages))
+    os.makedirs(args.work, exist_ok=True)
+    state_path = os.path.join(os.path.abspath(args.work), STATE_NAME)
+    state = load_state(state_path)
+    # 环境变量由子进程继承：各步骤脚本自动写入同一指标文件
+    metrics.configure(args.metrics or None, "pipeline")
+    if metrics.enabled():
+        print(f"[INFO] 指标写入 {os.environ[metrics.ENV_PATH]}，运行ID {metrics.run_id()}")
+    if args.profile:
+        os.environ[metrics.ENV_PROFILE] = ",".join(args.profile)
+
+    t0 = time.time()
+    print(f"[INFO] 步骤：{' -> '.join(order)}，并发 {args.jobs}")
+    status = run_pipeline(stages, order, state, state_path, args.jobs, set(args.force), args.dry_run)
+    summary = ", ".join(f"{k} {sum(v == k for v in status.values())}" for k in ("ok", "skip", "fail", "blocked", "run")
+                        if any(v == k for v in status.values()))
+    print(f"[DONE] {summary}，总耗时 {time.time() - t0:.1f}s")
+    if metrics.enabled():
+        metrics.print_summary(metrics.load_events(os.environ[metrics.ENV_PATH], metrics.run_id()))
+    if any(v in ("fail", "blocked") for v in status.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
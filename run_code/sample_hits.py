@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+sample_hits.py
+命中句子的去重、模板化噪声剔除与分层抽样（原 run.ipynb 中的 process_and_sample），
+以流式方式处理任意年份范围的命中结果，内存占用为每行 1 字节的保留标记加单个哈希分区：
+1. 物理去重：同一公司、同一句子、同一二级分类只保留首次出现的一行；
+2. 长度过滤：保留 min_len ~ max_len 字的句子；
+3. 模板化噪声：去重后同一句子出现超过 max_repeat 次即视为模板化披露（Boilerplate）并剔除；
+4. 分层抽样：按二级分类做水塘抽样，每类最多 sample_size 条，固定随机种子。
+第一遍流式读取时只保留 64 位哈希（按句子哈希分区写入临时文件，即磁盘哈希表），
+逐分区完成去重和计数；第二遍流式读取时按保留标记做水塘抽样。
+用法：
+    python run_code/sample_hits.py --input climaterisk_hits_2014-2024.parquet --output climaterisk_final_sample.csv
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+DEDUP_COLUMNS = ["股票代码", "句子", "二级分类"]
+# 分区临时文件中的记录：句子哈希、去重键哈希、全局行号
+PART_DTYPE = np.dtype([("h_sent", "<u8"), ("h_key", "<u8"), ("row", "<i8")])
+
+def iter_hits(paths, chunk_rows=200000, columns=None):
+    """按块流式读取一个或多个命中结果文件（CSV / Parquet），文本列统一为 str；columns 限定只读取的列。"""
+    for path in paths:
+        path = str(path)
+        if path.lower().endswith(".parquet"):
+            import pyarrow.parquet as pq
+            pf = pq.ParquetFile(path)
+            for batch in pf.iter_batches(batch_size=chunk_rows, columns=columns):
+                yield normalize_chunk(batch.to_pandas())
+        else:
+            for chunk in pd.read_csv(path, encoding="utf-8-sig", chunksize=chunk_rows, usecols=columns,
+                                     dtype={"股票代码": str, "年份": str, "句子": str}):
+                yield normalize_chunk(chunk)
+
+def normalize_chunk(df):
+    for c in DEDUP_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype(str)
+    if "命中关键词" in df.columns:
+        # parquet 中为 list<string>，还原为与 CSV 相同的 "|" 连接形式
+        df["命中关键词"] = [("|".join(v) if not isinstance(v, str) else v) for v in df["命中关键词"]]
+    return df
+
+def hash64(df, columns):
+    """按列组合计算稳定的 64 位哈希（pandas 固定密钥的 SipHash）。"""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy(np.uint64)
+
+class HashPartitions:
+    """按句子哈希高位分区的追加写临时文件；同一句子的全部记录落在同一分区。"""
+
+    def __init__(self, tmp_dir, n_parts=64):
+        self.dir = tmp_dir
+        self.n_parts = n_parts
+        self.paths = [os.path.join(tmp_dir, f"part{p:04d}.bin") for p in range(n_parts)]
+        self.files = [open(p, "wb") for p in self.paths]
+
+    def add(self, recs):
+        pid = (recs["h_sent"] >> np.uint64(32)) % np.uint64(self.n_parts)
+        order = np.argsort(pid, kind="stable")
+        recs, pid = recs[order], pid[order]
+        bounds = np.searchsorted(pid, np.arange(self.n_parts + 1, dtype=np.uint64))
+        for p in range(self.n_parts):
+            if bounds[p] < bounds[p + 1]:
+                self.files[p].write(recs[bounds[p]:bounds[p + 1]].tobytes())
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def __iter__(self):
+        for p in self.paths:
+            yield np.fromfile(p, dtype=PART_DTYPE)
+
+def plan_keep(parts: HashPartitions, n_rows: int, max_repeat: int):
+    """
+    逐分区去重并统计句子出现次数，返回 (保留标记, 统计)。
+    出现次数 = 去重后包含该句子的行数（不同公司/二级分类），与 value_counts 一致。
+    """
+    keep = np.zeros(n_rows, dtype=bool)
+    stats = {"dedup": 0, "boilerplate_sents": 0, "boilerplate_rows": 0}
+    for recs in parts:
+        if not len(recs):
+            continue
+        # 按行号排序后取每个去重键的首次出现
+        recs = recs[np.argsort(recs["row"], kind="stable")]
+        _, first = np.unique(recs["h_key"], return_index=True)
+        recs = recs[np.sort(first)]
+        stats["dedup"] += len(recs)
+        sents, inv, counts = np.unique(recs["h_sent"], return_inverse=True, return_counts=True)
+        noisy = counts[inv] > max_repeat
+        stats["boilerplate_sents"] += int((counts > max_repeat).sum())
+        stats["boilerplate_rows"] += int(noisy.sum())
+        keep[recs["row"][~noisy]] = True
+    return keep, stats
+
+class StratifiedReservoir:
+    """按层水塘抽样（Algorithm R）；每层独立的随机数发生器，结果只与种子和输入顺序有关。"""
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self.seed = seed
+        self.rng = {}
+        self.seen = {}
+        self.items = {}
+
+    def add(self, key, item):
+        if key not in self.rng:
+            self.rng[key] = random.Random(f"{self.seed}|{key}")
+            self.seen[key] = 0
+            self.items[key] = []
+        self.seen[key] += 1
+        bucket = self.items[key]
+        if len(bucket) < self.size:
+            bucket.append(item)
+        else:
+            j = self.rng[key].randrange(self.seen[key])
+            if j < self.size:
+                bucket[j] = item
+
+def process_and_sample(paths, save_path, sample_size=10000, min_len=20, max_len=300, max_repeat=50,
+                       seed=42, chunk_rows=200000, n_parts=64, tmp_dir=None):
+    t0 = time.time()
+    work = tempfile.mkdtemp(prefix="sample_hits_", dir=tmp_dir)
+    try:
+        # 第一遍：只写哈希
+        parts = HashPartitions(work, n_parts)
+        n_rows = n_len = 0
+        columns = None
+        for df in iter_hits(paths, chunk_rows):
+            columns = columns or list(df.columns)
+            lens = df["句子"].str.len()
+            ok = lens.between(min_len, max_len).to_numpy()
+            recs = np.empty(int(ok.sum()), dtype=PART_DTYPE)
+            sub = df[ok]
+            recs["h_sent"] = hash64(sub, ["句子"])
+            recs["h_key"] = hash64(sub, DEDUP_COLUMNS)
+            recs["row"] = np.arange(n_rows, n_rows + len(df))[ok]
+            parts.add(recs)
+            n_rows += len(df)
+            n_len += len(recs)
+        parts.close()
+        print(f"[INFO] 读取 {n_rows} 行，长度在 {min_len}~{max_len} 字之间的 {n_len} 行，耗时 {time.time() - t0:.1f}s")
+        keep, stats = plan_keep(parts, n_rows, max_repeat)
+        print(f"[INFO] 去重后 {stats['dedup']} 行；模板化句子 {stats['boilerplate_sents']} 个"
+              f"（{stats['boilerplate_rows']} 行）已剔除，保留 {int(keep.sum())} 行")
+
+        # 第二遍：按保留标记做分层水塘抽样
+        reservoir = StratifiedReservoir(sample_size, seed)
+        row = 0
+        for df in iter_hits(paths, chunk_rows):
+            mask = keep[row:row + len(df)]
+            sel = df[mask]
+            rows = np.arange(row, row + len(df))[mask]
+            for r, key, rec in zip(rows, sel["二级分类"].tolist(), sel.itertuples(index=False, name=None)):
+                reservoir.add(key, (r, rec))
+            row += len(df)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    out = []
+    for key in sorted(reservoir.items):
+        out.extend(rec for _, rec in sorted(reservoir.items[key]))
+    df_final = pd.DataFrame(out, columns=columns)
+    print(f"[INFO] 分层抽样：{len(reservoir.items)} 个二级分类，每类最多 {sample_size} 条")
+    print(f"最终精选样本: {len(df_final)} 条")
+    df_final.to_csv(save_path, index=False, encoding="utf-8-sig")
+    print(f"✅ 处理完成，样本已保存至: {save_path}（耗时 {time.time() - t0:.1f}s）")
+    return df_final
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", nargs="+", required=True, help="命中结果文件（CSV / Parquet，可多个，如各年份）")
+    ap.add_argument("--output", default="climaterisk_final_sample.csv", help="抽样结果 CSV")
+    ap.add_argument("--sample_size", type=int, default=10000, help="每个二级分类最多抽取的条数")
+    ap.add_argument("--min_len", type=int, default=20, help="句子最短字数")
+    ap.add_argument("--max_len", type=int, default=300, help="句子最长字数")
+    ap.add_argument("--max_repeat", type=int, default=50, help="去重后出现次数超过该值的句子视为模板化披露")
+    ap.add_argument("--seed", type=int, default=42, help="抽样随机种子")
+    ap.add_argument("--chunk_rows", type=int, default=200000, help="每次读取的行数")
+    ap.add_argument("--partitions", type=int, default=64, help="哈希分区数（越大单个分区占用内存越小）")
+    ap.add_argument("--tmp_dir", default=None, help="临时分区文件目录（默认系统临时目录）")
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run("sample", args):
+        run(args)
+
+def run(args):
+    process_and_sample(args.input, args.output, args.sample_size, args.min_len, args.max_len, args.max_repeat,
+                       args.seed, args.chunk_rows, args.partitions, args.tmp_dir)
+
+if __name__ == "__main__":
+    main()
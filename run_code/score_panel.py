@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+score_panel.py
+企业 × 年份 × 二级分类 的气候风险得分面板（原 run.ipynb 中的 calculate_dictionary_fcre 及绘图前的手工加总）：
+- 股票代码、年份、二级分类统一编码为整数，词频得分用 np.bincount 一次聚合到稠密数组；
+- 面板持久化到目录（panel.npz + codebook.json），输入文件中出现的年份整体替换，
+  新增一年只需聚合该年的命中结果，重复导入同一年不会重复计数；
+- 同时汇总 LLM（LLM_Label / LLM_Prob_*）与 FinBERT（AI_Label_Text / AI_Confidence）的句子标注，
+  得到每家公司每年的暴露、防范句数与概率加权得分。
+用法：
+    python run_code/score_panel.py --panel score_panel --hits climaterisk_hits_2014-2024.parquet --out fcre_scores.csv
+    python run_code/score_panel.py --panel score_panel --llm climaterisk_LLM_Full_Labeled.csv --finbert finbert_labeled.csv
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from sample_hits import iter_hits
+
+PANEL_VERSION = 1
+# 标注汇总的三个通道：暴露 / 防范 / 中性
+LABEL_CHANNELS = ["暴露", "防范", "中性"]
+LLM_LABELS = {-1: 0, 1: 1, 0: 2}
+FINBERT_LABELS = {"暴露": 0, "防范": 1, "中性": 2}
+SOURCES = ["llm", "finbert"]
+# 聚合只读取需要的列（跳过句子文本）
+HIT_KEY_COLUMNS = ["股票代码", "年份", "公司", "一级分类", "二级分类"]
+LLM_COLUMNS = ["LLM_Label", "LLM_Prob_Exposed", "LLM_Prob_Prevent", "LLM_Prob_Neutral"]
+FINBERT_COLUMNS = ["AI_Label_Text", "AI_Confidence"]
+
+def norm_code(s):
+    """股票代码统一为 6 位字符串（CSV 读入为整数时补回前导 0）。"""
+    s = s.astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
+    return s.where(~s.str.isdigit(), s.str.zfill(6))
+
+class Codebook:
+    """字符串键 -> 连续整数编码，只追加不删除，已有编码保持不变。"""
+
+    def __init__(self, keys=None):
+        self.keys = list(keys or [])
+        self.index = {k: i for i, k in enumerate(self.keys)}
+
+    def encode(self, values):
+        """向量化编码（pandas Categorical），新出现的键追加到末尾。"""
+        values = pd.Series(values)
+        for k in pd.unique(values):
+            if k not in self.index:
+                self.index[k] = len(self.keys)
+                self.keys.append(k)
+        return pd.Categorical(values, categories=self.keys).codes.astype(np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+class ScorePanel:
+    """
+    counts[企业, 年份, 二级分类]：命中句数（词频得分）；
+    labels[来源][企业, 年份, 通道]：标注句数，probs[来源][企业, 年份, 通道]：概率（置信度）加权和。
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.firms, self.years, self.subs = Codebook(), Codebook(), Codebook()
+        self.names = {}
+        self.cats = {}
+        self.counts = np.zeros((0, 0, 0), dtype=np.int64)
+        self.labels = {s: np.zeros((0, 0, len(LABEL_CHANNELS)), dtype=np.int64) for s in SOURCES}
+        self.probs = {s: np.zeros((0, 0, len(LABEL_CHANNELS)), dtype=np.float64) for s in SOURCES}
+        if root and os.path.exists(os.path.join(root, "codebook.json")):
+            self.load()
+
+    # ---------- 持久化 ----------
+    def load(self):
+        with open(os.path.join(self.root, "codebook.json"), "r", encoding="utf-8") as f:
+            cb = json.load(f)
+        if cb.get("version") != PANEL_VERSION:
+            print("[WARN] 面板版本不一致，将重新构建")
+            return
+        self.firms, self.years, self.subs = Codebook(cb["firms"]), Codebook(cb["years"]), Codebook(cb["subs"])
+        self.names, self.cats = cb["names"], cb["cats"]
+        with np.load(os.path.join(self.root, "panel.npz")) as z:
+            self.counts = z["counts"]
+            for s in SOURCES:
+                self.labels[s], self.probs[s] = z[f"labels_{s}"], z[f"probs_{s}"]
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, "panel.tmp.npz")
+        np.savez(tmp, counts=self.counts, **{f"labels_{s}": self.labels[s] for s in SOURCES},
+                 **{f"probs_{s}": self.probs[s] for s in SOURCES})
+        os.replace(tmp, os.path.join(self.root, "panel.npz"))
+        cb = {"version": PANEL_VERSION, "firms": self.firms.keys, "years": self.years.keys,
+              "subs": self.subs.keys, "names": self.names, "cats": self.cats}
+        tmp = os.path.join(self.root, "codebook.tmp.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cb, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, "codebook.json"))
+
+    # ---------- 聚合 ----------
+    def _grow(self):
+        """编码表扩张后，按新的维度补零。"""
+        F, Y, S = len(self.firms), len(self.years), len(self.subs)
+        self.counts = self._fit(self.counts, (F, Y, S))
+        for s in SOURCES:
+            self.labels[s] = self._fit(self.labels[s], (F, Y, len(LABEL_CHANNELS)))
+            self.probs[s] = self._fit(self.probs[s], (F, Y, len(LABEL_CHANNELS)))
+
+    def _encode_keys(self, df):
+        """股票代码、年份编码为整数；规范化只作用于去重后的取值。"""
+        fk, fu = pd.factorize(df["股票代码"])
+        codes = norm_code(pd.Series(fu)).to_numpy(object)
+        f = self.firms.encode(codes)[fk]
+        yk, yu = pd.factorize(df["年份"])
+        y = self.years.encode(pd.to_numeric(pd.Series(yu), errors="coerce").fillna(0).astype(int).astype(str))[yk]
+        if "公司" in df.columns:
+            pairs = pd.DataFrame({"k": fk, "公司": df["公司"].astype(str).to_numpy()}).drop_duplicates("k", keep="last")
+            self.names.update(zip(codes[pairs["k"].to_numpy()], pairs["公司"]))
+        return f, y
+
+    @staticmethod
+    def _sub_codes(codebook, values):
+        k, u = pd.factorize(values)
+        return codebook.encode(pd.Series(u).astype(str))[k]
+
+    @staticmethod
+    def _fit(a, shape):
+        return np.pad(a, [(0, n - m) for n, m in zip(shape, a.shape)]) if a.shape != shape else a
+
+    def _replace_years(self, target, delta, years):
+        """用本次输入的聚合结果整体替换涉及年份的切片，返回替换后的数组。"""
+        delta = self._fit(delta, target.shape)
+        for y in years:
+            yi = self.years.index[y]
+            target[:, yi] = delta[:, yi]
+        return target
+
+    def add_hits(self, paths, chunk_rows=500000):
+        """
+        流式聚合命中结果的词频得分。输入中出现的年份整体替换（先在增量数组中聚合，再覆盖对应年份），
+        故新增一年只需读取该年数据，重复导入同一年也不会重复计数。返回本次涉及的年份列表。
+        """
+        delta = np.zeros((0, 0, 0), dtype=np.int64)
+        years = set()
+        for df in iter_hits(paths, chunk_rows, columns=HIT_KEY_COLUMNS):
+            f, y = self._encode_keys(df)
+            s = self._sub_codes(self.subs, df["二级分类"])
+            pairs = df[["二级分类", "一级分类"]].drop_duplicates()
+            self.cats.update(zip(pairs["二级分类"].astype(str), pairs["一级分类"].astype(str)))
+            years.update(self.years.keys[i] for i in np.unique(y))
+            F, Y, S = len(self.firms), len(self.years), len(self.subs)
+            delta = self._fit(delta, (F, Y, S))
+            delta += np.bincount((f * Y + y) * S + s, minlength=F * Y * S).reshape(F, Y, S)
+        self._grow()
+        self.counts = self._replace_years(self.counts, delta, years)
+        return sorted(years)
+
+    def add_labels(self, paths, source, chunk_rows=500000):
+        """
+        汇总句子标注（source='llm' 读取 LLM_Label 与 LLM_Prob_*；'finbert' 读取 AI_Label_Text 与 AI_Confidence），
+        同样按年份整体替换该来源的数据。返回本次涉及的年份列表。
+        """
+        C = len(LABEL_CHANNELS)
+        d_lab = np.zeros((0, 0, C), dtype=np.int64)
+        d_prob = np.zeros((0, 0, C), dtype=np.float64)
+        years = set()
+        cols = ["股票代码", "年份", "公司"] + (LLM_COLUMNS if source == "llm" else FINBERT_COLUMNS)
+        for df in iter_hits(paths, chunk_rows, columns=cols):
+            f, y = self._encode_keys(df)
+            years.update(self.years.keys[i] for i in np.unique(y))
+            if source == "llm":
+                lab = pd.to_numeric(df["LLM_Label"], errors="coerce").map(LLM_LABELS)
+                p = np.stack([pd.to_numeric(df[c], errors="coerce").fillna(0).to_numpy(float)
+                              for c in ("LLM_Prob_Exposed", "LLM_Prob_Prevent", "LLM_Prob_Neutral")], axis=1)
+            else:
+                lab = df["AI_Label_Text"].astype(str).map(FINBERT_LABELS)
+                conf = (pd.to_numeric(df["AI_Confidence"], errors="coerce").fillna(0).to_numpy(float)
+                        if "AI_Confidence" in df.columns else np.ones(len(df)))
+                p = np.zeros((len(df), C))
+                has = lab.notna().to_numpy()
+                p[np.flatnonzero(has), lab[has].astype(int).to_numpy()] = conf[has]
+            ok = lab.notna().to_numpy()
+            F, Y = len(self.firms), len(self.years)
+            d_lab, d_prob = self._fit(d_lab, (F, Y, C)), self._fit(d_prob, (F, Y, C))
+            cell = f[ok] * Y + y[ok]
+            d_lab += np.bincount(cell * C + lab[ok].astype(int).to_numpy(), minlength=F * Y * C).reshape(F, Y, C)
+            for c in range(C):
+                d_prob[..., c] += np.bincount(cell, weights=p[ok, c], minlength=F * Y).reshape(F, Y)
+        self._grow()
+        self.labels[source] = self._replace_years(self.labels[source], d_lab, years)
+        self.probs[source] = self._replace_years(self.probs[source], d_prob, years)
+        return sorted(years)
+
+    # ---------- 输出 ----------
+    def risk_subs(self):
+        """计入总风险得分的二级分类：名称含“风险”的类别（与原 notebook 一致）。"""
+        return [s for s in self.subs.keys if "风险" in s]
+
+    def to_frame(self, years=None):
+        """
+        宽表：每行一家公司一年，列为各二级分类词频得分、总风险得分，以及各标注来源的暴露/防范句数、
+        概率加权得分和净暴露（暴露 - 防范）。只保留有命中或标注的公司-年份。
+        """
+        F, Y, S = self.counts.shape
+        fi, yi = np.meshgrid(np.arange(F), np.arange(Y), indexing="ij")
+        out = {"股票代码": np.array(self.firms.keys, dtype=object)[fi.ravel()],
+               "公司": [self.names.get(k, "") for k in np.array(self.firms.keys, dtype=object)[fi.ravel()]],
+               "年份": np.array(self.years.keys, dtype=object)[yi.ravel()].astype(int)}
+        flat = self.counts.reshape(F * Y, S)
+        for j, sub in enumerate(self.subs.keys):
+            out[sub] = flat[:, j]
+        risk = [self.subs.index[s] for s in self.risk_subs()]
+        out["总风险得分"] = flat[:, risk].sum(axis=1)
+        active = flat.sum(axis=1) > 0
+        for s in SOURCES:
+            lab = self.labels[s].reshape(F * Y, -1)
+            if not lab.any():
+                continue
+            pr = self.probs[s].reshape(F * Y, -1)
+            tag = s.upper() if s == "llm" else "FinBERT"
+            out[f"{tag}_暴露句数"], out[f"{tag}_防范句数"] = lab[:, 0], lab[:, 1]
+            out[f"{tag}_暴露得分"], out[f"{tag}_防范得分"] = pr[:, 0].round(4), pr[:, 1].round(4)
+            out[f"{tag}_净暴露"] = lab[:, 0] - lab[:, 1]
+            active |= lab.sum(axis=1) > 0
+        df = pd.DataFrame(out)[active]
+        if years is not None:
+            df = df[df["年份"].isin([int(y) for y in years])]
+        return df.sort_values(["股票代码", "年份"], kind="stable").reset_index(drop=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--panel", default="score_panel", help="面板目录（增量更新）")
+    ap.add_argument("--hits", nargs="*", default=[], help="命中结果或精选样本（CSV / Parquet）")
+    ap.add_argument("--llm", nargs="*", default=[], help="LLM 标注结果（含 LLM_Label / LLM_Prob_*）")
+    ap.add_argument("--finbert", nargs="*", default=[], help="FinBERT 标注结果（含 AI_Label_Text / AI_Confidence）")
+    ap.add_argument("--rebuild", action="store_true", help="忽略已有面板，从输入重新构建")
+    ap.add_argument("--out", default="fcre_scores.csv", help="输出宽表 CSV")
+    ap.add_argument("--years", default="", help="只输出指定年份范围，如 2024 或 2014-2024")
+    metrics.add_args(ap)
+    args = ap.parse_args()
+    with metrics.stage_run("score", args):
+        run(args)
+
+def run(args):
+    t0 = time.time()
+    panel = ScorePanel(None if args.rebuild else args.panel)
+    panel.root = args.panel
+    if args.hits:
+        ys = panel.add_hits(args.hits)
+        print(f"[INFO] 词频得分：更新年份 {', '.join(ys)}")
+    if args.llm:
+        ys = panel.add_labels(args.llm, "llm")
+        print(f"[INFO] LLM 标注：更新年份 {', '.join(ys)}")
+    if args.finbert:
+        ys = panel.add_labels(args.finbert, "finbert")
+        print(f"[INFO] FinBERT 标注：更新年份 {', '.join(ys)}")
+    panel.save()
+
+    years = None
+    if args.years:
+        from extract_hits import parse_years
+        y0, y1 = parse_years(args.years)
+        years = range(y0, y1 + 1)
+    df = panel.to_frame(years)
+    df.to_csv(args.out, index=False, encoding="utf-8-sig")
+    F, Y, S = panel.counts.shape
+    print(f"✅ 面板 {F} 家公司 × {Y} 年 × {S} 个二级分类，输出 {len(df)} 行，耗时 {time.time() - t0:.1f}s")
+    print(f"[DONE] 输出：{os.path.abspath(args.out)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+sent_index.py
+句子库（sentence_store.py）之上的磁盘倒排索引：字符二元组 -> 句子ID 倒排表，用于临时的关键词查询与词典迭代，
+不必每次重新扫描全部 MD&A。
+- 索引对象为原句与 s.lower() 的字符二元组（两者相同时只算一次），句末追加结束符，
+  因此单字关键词也能由“以该字开头的二元组”召回；
+- 查询时先对关键词各二元组的倒排表求交得到候选句，再按 scan_dir 的规则逐句核对
+  （ASCII 关键词在 s.lower() 上匹配，其余在原句上精确匹配），结果与 scan_dir 完全一致；
+- 每次更新只为新增/变化的文件写一个新段（seg-NNNNNN.*.npy，mmap 读取），被替换文件的旧倒排在查询时过滤，
+  失效比例过高时整体重建；句子ID 与句子库一致，可直接关联抽样与标注结果。
+用法：
+    python run_code/sent_index.py --store sent_store --index sent_index --base_dir data/output --years 2014-2024
+    python run_code/sent_index.py --store sent_store --index sent_index --words 台风 洪涝 --out hits.csv
+    python run_code/sent_index.py --store sent_store --index sent_index --dict keywords_expand.xlsx --verify
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from extract_hits import KeywordMatcher, load_dict, scan_dir, parse_years, iter_year_dirs, parse_meta_from_filename
+from sentence_store import SentenceStore, SENT_ID_SHIFT
+
+INDEX_VERSION = 1
+MANIFEST_NAME = "index_manifest.json"
+CHAR_BITS = 21                 # Unicode 码位不超过 21 位，二元组编码为 (前字 << 21) | 后字
+END = 0                        # 句末结束符（码位 0），使每个字都至少作为一个二元组的首字出现
+SEG_ARRAYS = ("keys", "offsets", "postings")
+
+def encode_text(text: str):
+    """字符串 -> 码位数组（uint32）。"""
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+def gram_keys(codes):
+    """相邻码位组成的二元组编码（uint64）。"""
+    return (codes[:-1].astype(np.uint64) << np.uint64(CHAR_BITS)) | codes[1:].astype(np.uint64)
+
+def build_postings(sentences, sent_ids):
+    """
+    对一批句子建立倒排：返回 (keys, offsets, postings)。
+    keys 升序且唯一，keys[i] 的句子ID 为 postings[offsets[i]:offsets[i+1]]（升序、去重）。
+    """
+    if not sentences:
+        return np.zeros(0, np.uint64), np.zeros(1, np.int64), np.zeros(0, np.int64)
+    # 含大写字母的句子追加一份小写形式（同一句子ID），供 ASCII 关键词按 s.lower() 查询
+    texts, ids = [], []
+    for s, sid in zip(sentences, sent_ids):
+        s = s.replace("\x00", " ")
+        texts.append(s)
+        ids.append(sid)
+        low = s.lower()
+        if low != s:
+            texts.append(low)
+            ids.append(sid)
+    # 全部文本以结束符连接后一次性编码，避免逐句调用
+    codes = encode_text("\x00".join(texts) + "\x00")
+    keys = gram_keys(codes)
+    owner = np.asarray(ids, dtype=np.int64)[np.cumsum(codes == END)[:-1]]   # 每个二元组所属的句子ID
+    keep = codes[:-1] != END                    # 丢弃以结束符开头的二元组（跨句）
+    keys, owner = keys[keep], owner[keep]
+    order = np.lexsort((owner, keys))
+    keys, owner = keys[order], owner[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])
+    keys, owner = keys[first], owner[first]
+    uniq, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return uniq, offsets, owner
+
+class SentenceIndex:
+    """索引目录：index_manifest.json + seg-NNNNNN.{keys,offsets,postings}.npy。"""
+
+    def __init__(self, root, store: SentenceStore):
+        self.root = Path(root)
+        self.store = store
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.manifest = self._load_manifest()
+        self._segs = {}
+
+    # ---------- 清单 ----------
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                m = json.load(f)
+        except (OSError, ValueError):
+            m = None
+        settings = {"version": INDEX_VERSION, "store": self.store.manifest["settings"]}
+        if m is None or m.get("settings") != settings:
+            return {"settings": settings, "next_seg": (m or {}).get("next_seg", 0), "files": {}, "segments": {}}
+        if any("/" not in k for k in m["files"]):
+            # 旧版以文件名为键：按文件ID对应到句子库的 <目录名>/<文件名> 键，已建的段无需重建
+            by_fid = {r["file_id"]: k for k, r in self.store.manifest["files"].items()}
+            m["files"] = {by_fid.get(r["file_id"], k): r for k, r in m["files"].items()}
+        return m
+
+    def save_manifest(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = str(self.manifest_path) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=0)
+        os.replace(tmp, self.manifest_path)
+
+    def _live(self, name, rec):
+        """索引中的文件记录是否仍对应句子库中的当前版本。"""
+        cur = self.store.manifest["files"].get(name)
+        return cur is not None and cur["sha1"] == rec["sha1"] and cur["file_id"] == rec["file_id"]
+
+    # ---------- 写入 ----------
+    def update(self, rebuild_ratio: float = 0.5):
+        """
+        为句子库中尚未索引或内容已变化的文件建立一个新段；返回 {'indexed','removed','sentences'}。
+        已删除/被替换文件的旧倒排只在清单中标记失效，失效句数超过 rebuild_ratio 时整体重建。
+        """
+        files = self.manifest["files"]
+        stale = [k for k, r in files.items() if not self._live(k, r)]
+        for k in stale:
+            del files[k]
+        todo = [(k, r) for k, r in self.store.records() if k not in files]
+        counts = {"indexed": len(todo), "removed": len(stale), "sentences": 0}
+        if todo:
+            seg = f"seg-{self.manifest['next_seg']:06d}"
+            self.manifest["next_seg"] += 1
+            sents, ids = [], []
+            for name, r in todo:
+                col = self.store.read_slice(r["part"], r["row"], r["n"], ["句子ID", "句子"])
+                ids.extend(col.column("句子ID").to_pylist())
+                sents.extend(col.column("句子").to_pylist())
+            arrays = build_postings(sents, ids)
+            self.root.mkdir(parents=True, exist_ok=True)
+            for a, arr in zip(SEG_ARRAYS, arrays):
+                np.save(self.root / f"{seg}.{a}.npy", arr)
+            for name, r in todo:
+                files[name] = {"file_id": r["file_id"], "sha1": r["sha1"], "seg": seg, "n": r["n"]}
+            self.manifest["segments"][seg] = len(ids)
+            counts["sentences"] = len(ids)
+        self._drop_dead_segments()
+        if self.dead_ratio() > rebuild_ratio:
+            self.rebuild()
+        self.save_manifest()
+        return counts
+
+    def dead_ratio(self) -> float:
+        total = sum(self.manifest["segments"].values())
+        live = sum(r["n"] for r in self.manifest["files"].values())
+        return 1 - live / total if total else 0.0
+
+    def rebuild(self):
+        """丢弃全部段，按句子库当前内容重建为一个段。"""
+        self.manifest["files"] = {}
+        self._drop_dead_segments()
+        return self.update(rebuild_ratio=1.0)
+
+    def _drop_dead_segments(self):
+        live = {r["seg"] for r in self.manifest["files"].values()}
+        for seg in list(self.manifest["segments"]):
+            if seg not in live:
+                del self.manifest["segments"][seg]
+                self._segs.pop(seg, None)
+                for a in SEG_ARRAYS:
+                    try:
+                        os.remove(self.root / f"{seg}.{a}.npy")
+                    except OSError:
+                        pass
+
+    # ---------- 查询 ----------
+    def _seg(self, seg):
+        if seg not in self._segs:
+            self._segs[seg] = tuple(np.load(self.root / f"{seg}.{a}.npy", mmap_mode="r") for a in SEG_ARRAYS)
+        return self._segs[seg]
+
+    @staticmethod
+    def _postings(seg_arrays, word):
+        """
+        单个关键词在一个段内的候选句子ID（升序）：各二元组倒排求交，单字取以其开头的全部二元组之并。
+        与 scan_dir 一致，ASCII 关键词按小写查询，其余按原文查询。
+        """
+        keys, offsets, postings = seg_arrays
+        codes = encode_text(word.lower() if word.isascii() else word)
+        if len(codes) == 0:
+            return np.zeros(0, np.int64)
+        if len(codes) == 1:
+            lo = np.uint64(int(codes[0]) << CHAR_BITS)
+            a, b = np.searchsorted(keys, np.array([lo, lo + np.uint64(1 << CHAR_BITS)], dtype=np.uint64))
+            return np.unique(np.asarray(postings[offsets[a]:offsets[b]]))
+        lists = []
+        for g in np.unique(gram_keys(codes)):
+            i = np.searchsorted(keys, g)
+            if i >= len(keys) or keys[i] != g:
+                return np.zeros(0, np.int64)
+            lists.append(postings[offsets[i]:offsets[i + 1]])
+        lists.sort(key=len)
+        out = np.asarray(lists[0])
+        for p in lists[1:]:
+            out = np.intersect1d(out, p, assume_unique=True)
+            if not len(out):
+                break
+        return out
+
+    def candidates(self, words, dirs=None):
+        """任一关键词可能命中的句子ID（升序）：已过滤失效文件，给定 dirs 时只保留这些目录下的文件。"""
+        allowed = None
+        if dirs is not None:
+            allowed = {r["file_id"] for _, r in self.store.records(dirs)}
+        by_seg = {}
+        for name, r in self.manifest["files"].items():
+            if (allowed is None or r["file_id"] in allowed) and self._live(name, r):
+                by_seg.setdefault(r["seg"], []).append(r["file_id"])
+        out = []
+        for seg, fids in by_seg.items():
+            arrays = self._seg(seg)
+            found = [self._postings(arrays, w) for w in words]
+            cand = np.unique(np.concatenate(found)) if found else np.zeros(0, np.int64)
+            out.append(cand[np.isin(cand >> SENT_ID_SHIFT, np.asarray(fids))])
+        return np.unique(np.concatenate(out)) if out else np.zeros(0, np.int64)
+
+    def fetch(self, sent_ids, dirs=None):
+        """
+        按句子ID取回句子行（dict 列表），按 records(dirs) 的文件顺序与句序排列，与 scan_dir 的输出顺序一致。
+        """
+        recs = self.store.records(dirs)
+        rank = {r["file_id"]: (i, name, r) for i, (name, r) in enumerate(recs)}
+        mask = (1 << SENT_ID_SHIFT) - 1
+        groups = {}
+        for sid in np.asarray(sent_ids, dtype=np.int64).tolist():
+            if (sid >> SENT_ID_SHIFT) in rank:
+                groups.setdefault(sid >> SENT_ID_SHIFT, []).append(sid & mask)
+        rows = []
+        cols = ["句子ID", "文件名", "股票代码", "年份", "公司", "句序", "句子"]
+        for fid in sorted(groups, key=lambda f: rank[f][0]):
+            _, name, r = rank[fid]
+            t = self.store.read_slice(r["part"], r["row"], r["n"], cols).take(sorted(groups[fid]))
+            data = {c: t.column(c).to_pylist() for c in cols}
+            rows.extend(dict(zip(cols, vals)) for vals in zip(*(data[c] for c in cols)))
+        return rows
+
+    def query(self, words, dirs=None):
+        """
+        返回含任一关键词的句子行，附“命中关键词”列（| 分隔，按字典序）。匹配规则同 scan_dir。
+        """
+        words = [w for w in dict.fromkeys(words) if w]
+        rows = []
+        for row in self.fetch(self.candidates(words, dirs), dirs):
+            s, low = row["句子"], row["句子"].lower()
+            hit = sorted(w for w in words if (w.lower() in low if w.isascii() else w in s))
+            if hit:
+                row["命中关键词"] = "|".join(hit)
+                rows.append(row)
+        return rows
+
+    def search(self, catmap: dict, dirs=None):
+        """按 load_dict 的词典查询，返回与 scan_dir 相同列、相同顺序的命中行（另含句子ID）。"""
+        words = [w for ws in catmap.values() for w in ws]
+        matcher = KeywordMatcher(catmap)
+        rows = []
+        for row in self.fetch(self.candidates(words, dirs), dirs):
+            for cat, sub, hit_words in matcher.match(row["句子"]):
+                rows.append({"文件名": row["文件名"], "股票代码": row["股票代码"], "年份": row["年份"],
+                             "公司": row["公司"], "句序": row["句序"], "一级分类": cat, "二级分类": sub,
+                             "命中关键词": "|".join(sorted(hit_words)), "句子": row["句子"],
+                             "句子ID": row["句子ID"]})
+        return rows
+
+    def stats(self):
+        sizes = sum(os.path.getsize(self.root / f"{s}.{a}.npy") for s in self.manifest["segments"] for a in SEG_ARRAYS)
+        return {"files": len(self.manifest["files"]), "segments": len(self.manifest["segments"]),
+                "sentences": sum(r["n"] for r in self.manifest["files"].values()),
+                "dead_ratio": round(self.dead_ratio(), 4), "mb": round(sizes / 2**20, 1)}
+
+def verify(index, catmap, dirs):
+    """与 scan_dir 逐行对比（直接读取 TXT 重新扫描），返回不一致的行数。"""
+    key = lambda r: (r["文件名"], r["句序"], r["一级分类"], r["二级分类"], r["命中关键词"], r["句子"])
+    t0 = time.perf_counter()
+    ref = [key(r) for d in dirs for r in scan_dir(str(d), catmap)]
+    t_scan = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    got = [key(r) for r in index.search(catmap, dirs)]
+    t_index = time.perf_counter() - t0
+    bad = 0 if ref == got else max(len(set(ref) ^ set(got)), 1)
+    print(f"[INFO] scan_dir {len(ref)} 行 {t_scan:.2f}s；索引 {len(got)} 行 {t_index * 1000:.0f}ms"
+          f"（{t_scan / max(t_index, 1e-9):.0f}x）")
+    return bad
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--store", default="sent_store", help="句子库目录")
+    ap.add_argument("--index", default="sent_index", help="倒排索引目录")
+    ap.add_argument("--annual_dir", help="单个 MD&A TXT 目录（优先于 --base_dir/--years）")
+    ap.add_argument("--base_dir", default="", help="包含各年度子目录的根目录；给定时先增量更新句子库与索引")
+    ap.add_argument("--years", default="2014-2024", help="年份或年份范围，同时用于限定查询范围")
+    ap.add_argument("--workers", type=int, default=1, help="句子库分句进程数（1 为串行，0 为 CPU 核数-1）")
+    ap.add_argument("--words", nargs="*", default=[], help="查询关键词（任一命中）")
+    ap.add_argument("--dict", default="", help="按扩展关键词表查询（输出格式同 extract_hits）")
+    ap.add_argument("--verify", action="store_true", help="与 scan_dir 对比查询结果（需 --dict 与 TXT 目录）")
+    ap.add_argument("--out", default="", help="查询结果输出 CSV；不给则打印前 --limit 行")
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--rebuild", action="store_true", help="丢弃现有索引并重建")
+    args = ap.parse_args()
+
+    store = SentenceStore(args.store)
+    y0, y1 = parse_years(args.years)
+    dirs = None
+    if args.annual_dir or args.base_dir:
+        dirs = [Path(args.annual_dir)] if args.annual_dir else iter_year_dirs(Path(args.base_dir), y0, y1)
+        if not dirs:
+            print(f"[ERR] 在 {args.annual_dir or args.base_dir} 下未找到目录。")
+            return
+        workers = args.workers if args.workers > 0 else max(1, (os.cpu_count() or 4) - 1)
+        t0 = time.time()
+        c = store.update(dirs, workers=workers)
+        print(f"[OK] 句子库：命中 {c['hit']}，新增 {c['miss']}，变化 {c['stale']}，移除 {c['removed']}，"
+              f"耗时 {time.time() - t0:.1f}s")
+
+    index = SentenceIndex(args.index, store)
+    t0 = time.time()
+    c = index.rebuild() if args.rebuild else index.update()
+    print(f"[OK] 索引：新索引 {c['indexed']} 份（{c['sentences']} 句），移除 {c['removed']} 份，耗时 {time.time() - t0:.1f}s")
+    print(f"[INFO] {json.dumps(index.stats(), ensure_ascii=False)}")
+
+    if not (args.words or args.dict):
+        return
+    if dirs is None:
+        # 未指定 TXT 目录时按文件名中的年份限定查询范围
+        years = {str(y) for y in range(y0, y1 + 1)}
+        seen = {r["dir"] for k, r in store.records() if parse_meta_from_filename(os.path.basename(k))[1] in years}
+        dirs = sorted(seen)
+    t0 = time.perf_counter()
+    if args.dict:
+        catmap = load_dict(args.dict)
+        rows = index.search(catmap, dirs)
+    else:
+        rows = index.query(args.words, dirs)
+    print(f"[OK] 命中 {len(rows)} 行，查询耗时 {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+    if args.out:
+        import pandas as pd
+        pd.DataFrame(rows).to_csv(args.out, index=False, encoding="utf-8-sig")
+        print(f"[DONE] 已写出 {args.out}")
+    else:
+        for r in rows[:args.limit]:
+            print(f"  {r['股票代码']} {r['年份']} #{r['句序']} [{r['命中关键词']}] {r['句子'][:60]}")
+
+    if args.verify:
+        if not args.dict:
+            print("[ERR] --verify 需要 --dict")
+            return
+        bad = verify(index, catmap, dirs)
+        print("[OK] 与 scan_dir 结果一致" if not bad else f"[ERR] 与 scan_dir 不一致：{bad} 行")
+
+if __name__ == "__main__":
+    main()
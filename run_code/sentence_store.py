@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+sentence_store.py
+MD&A 分句结果的持久列式句子库，供关键词匹配、抽样、标注等环节共用，避免各环节重复读取和分句。
+- 每句一行：句子ID、文件ID、文件名、股票代码、年份、公司、句序、起始/结束偏移（clean_text 后的字符位置）、句子；
+- 句子ID = 文件ID << 20 | 句序，文件ID 按文件名分配且不再变化，各环节可据此稳定关联；
+- 数据以未压缩的 Arrow IPC 分片（parts/*.arrow）保存，读取时 mmap，句子文本零拷贝；
+- 增量更新：清单记录每个文件的大小/修改时间/sha1，只重新分句新增或变化的文件，写入新分片；
+  旧分片中被替换的行在读取时过滤，失效行过多时自动压缩。
+用法：
+    python run_code/sentence_store.py --store sent_store --base_dir data/output --years 2014-2024 --workers 0
+    python run_code/sentence_store.py --store sent_store --stats
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from extract_hits import list_txt, parse_meta_from_filename, parse_years, iter_year_dirs, sent_spans
+from extract_mda import file_digest, plan_files
+
+STORE_VERSION = 1
+# 分句规则变化时调高，已有句子库将整体重建
+SEGMENTER_VERSION = 1
+MANIFEST_NAME = "store_manifest.json"
+SENT_ID_SHIFT = 20
+
+STORE_COLUMNS = ["句子ID", "文件ID", "文件名", "股票代码", "年份", "公司", "句序", "起始", "结束", "句子"]
+
+def store_schema():
+    # IPC 文件格式不允许跨批次替换字典，元数据列按普通字符串存储（未压缩，可直接 mmap）
+    import pyarrow as pa
+    types = {"句子ID": pa.int64(), "文件ID": pa.int32(), "句序": pa.int32(), "起始": pa.int32(), "结束": pa.int32()}
+    return pa.schema([(c, types.get(c, pa.string())) for c in STORE_COLUMNS])
+
+def sent_id(file_id: int, idx: int) -> int:
+    return (file_id << SENT_ID_SHIFT) | idx
+
+def segment_file(fpath: str):
+    """进程池任务：读取并分句一个 MD&A 文件，返回 (文件路径, 句子列表, 偏移列表, 文件信息)。"""
+    with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+    cleaned, spans = sent_spans(text)
+    st = os.stat(fpath)
+    info = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha1": file_digest(fpath)}
+    return fpath, [cleaned[s:e] for s, e in spans], spans, info
+
+def file_key(fpath) -> str:
+    """清单中的文件键：<所在目录名>/<文件名>（与 extract_mda 清单一致），不同目录下的同名文件互不覆盖。"""
+    p = Path(fpath)
+    return f"{p.parent.name}/{p.name}"
+
+def _migrate_keys(m: dict):
+    """旧版清单以文件名为键：按记录中的目录改为 <目录名>/<文件名>，文件ID（句子ID）保持不变。"""
+    files = m.get("files", {})
+    if not files or all("/" in k for k in files):
+        return
+    renamed = {k: f"{Path(r['dir']).name}/{k}" for k, r in files.items() if "/" not in k and r.get("dir")}
+    m["files"] = {renamed.get(k, k): r for k, r in files.items()}
+    if "ids" in m:
+        m["ids"] = {renamed.get(k, k): v for k, v in m["ids"].items()}
+
+class SentenceStore:
+    """句子库目录：store_manifest.json + parts/part-NNNNNN.arrow。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.parts_dir = self.root / "parts"
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.manifest = self._load_manifest()
+        self._tables = {}
+
+    # ---------- 清单 ----------
+    def _fingerprint(self):
+        return {"version": STORE_VERSION, "segmenter": SEGMENTER_VERSION, "shift": SENT_ID_SHIFT}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                m = json.load(f)
+        except (OSError, ValueError):
+            m = None
+        if m is not None:
+            _migrate_keys(m)
+        if m is None or m.get("settings") != self._fingerprint():
+            # 首次建库或分句规则变化：保留文件ID分配，其余全部重建
+            ids = {k: r["file_id"] for k, r in (m or {}).get("files", {}).items()}
+            return {"settings": self._fingerprint(), "next_file_id": (m or {}).get("next_file_id", 0),
+                    "next_part": (m or {}).get("next_part", 0), "files": {}, "parts": {},
+                    "previous": (m or {}).get("files", {}), "ids": ids, "reset": m is not None}
+        m.setdefault("ids", {k: r["file_id"] for k, r in m["files"].items()})
+        return m
+
+    def save_manifest(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        data = {k: v for k, v in self.manifest.items() if k not in ("previous", "reset")}
+        tmp = str(self.manifest_path) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=0)
+        os.replace(tmp, self.manifest_path)
+
+    def file_id(self, name: str) -> int:
+        """按文件键（<目录名>/<文件名>）分配稳定的文件ID。"""
+        ids = self.manifest["ids"]
+        if name not in ids:
+            ids[name] = self.manifest["next_file_id"]
+            self.manifest["next_file_id"] += 1
+        return ids[name]
+
+    # ---------- 写入 ----------
+    def update(self, dirs, workers: int = 1, batch_rows: int = 100000, compact_ratio: float = 0.5):
+        """
+        对 dirs 下的 TXT 增量分句：新增/变化的文件写入一个新分片，源文件已删除的记录移除。
+        返回 {'hit','miss','stale','removed','sentences'} 统计。
+        """
+        import pyarrow as pa
+        files = [fp for d in dirs for fp in list_txt(str(d))]
+        todo, counts = plan_files(files, self.manifest, key_of=file_key)
+        scanned = {str(Path(d).resolve()) for d in dirs}
+        present = {file_key(fp) for fp in files}
+        removed = [k for k, r in self.manifest["files"].items()
+                   if r.get("dir") in scanned and k not in present]
+        for k in removed:
+            del self.manifest["files"][k]
+        counts["removed"], counts["sentences"] = len(removed), 0
+        if todo:
+            self.parts_dir.mkdir(parents=True, exist_ok=True)
+            part = f"part-{self.manifest['next_part']:06d}.arrow"
+            self.manifest["next_part"] += 1
+            schema = store_schema()
+            buf = {c: [] for c in STORE_COLUMNS}
+            row = 0
+            tmp = self.parts_dir / (part + ".tmp")
+            sink = pa.OSFile(str(tmp), "wb")
+            writer = pa.ipc.new_file(sink, schema)
+
+            def flush():
+                if buf["句子ID"]:
+                    writer.write_table(pa.Table.from_pydict(buf, schema=schema))
+                    for c in STORE_COLUMNS:
+                        buf[c].clear()
+
+            if workers > 1 and len(todo) > 1:
+                ex = ProcessPoolExecutor(max_workers=workers)
+                results = ex.map(segment_file, todo, chunksize=8)
+            else:
+                ex, results = None, map(segment_file, todo)
+            new_recs = {}
+            try:
+                for fpath, sents, spans, info in results:
+                    name = os.path.basename(fpath)
+                    key = file_key(fpath)
+                    fid = self.file_id(key)
+                    code, year, company = parse_meta_from_filename(name)
+                    n = len(sents)
+                    buf["句子ID"].extend(sent_id(fid, i) for i in range(n))
+                    buf["文件ID"].extend([fid] * n)
+                    buf["文件名"].extend([name] * n)
+                    buf["股票代码"].extend([code] * n)
+                    buf["年份"].extend([year] * n)
+                    buf["公司"].extend([company] * n)
+                    buf["句序"].extend(range(n))
+                    buf["起始"].extend(s for s, _ in spans)
+                    buf["结束"].extend(e for _, e in spans)
+                    buf["句子"].extend(sents)
+                    new_recs[key] = {**info, "file_id": fid, "part": part, "row": row, "n": n,
+                                      "dir": str(Path(fpath).parent.resolve())}
+                    row += n
+                    counts["sentences"] += n
+                    if len(buf["句子ID"]) >= batch_rows:
+                        flush()
+                flush()
+            finally:
+                if ex is not None:
+                    ex.shutdown()
+                writer.close()
+                sink.close()
+            os.replace(tmp, self.parts_dir / part)
+            self.manifest["files"].update(new_recs)
+            self.manifest["parts"][part] = row
+        self.manifest.pop("previous", None)
+        self._drop_dead_parts()
+        if self.dead_ratio() > compact_ratio:
+            self.compact()
+        self.save_manifest()
+        return counts
+
+    def _drop_dead_parts(self):
+        live = {r["part"] for r in self.manifest["files"].values()}
+        for part in list(self.manifest["parts"]):
+            if part not in live:
+                del self.manifest["parts"][part]
+                self._tables.pop(part, None)
+                try:
+                    os.remove(self.parts_dir / part)
+                except OSError:
+                    pass
+        # 清单重建或中断遗留的孤立分片
+        if self.parts_dir.exists():
+            for p in self.parts_dir.iterdir():
+                if p.name not in self.manifest["parts"] and p.suffix == ".arrow":
+                    try:
+                        p.unlink()
+                    except OSError:
+                        pass
+
+    def dead_ratio(self) -> float:
+        total = sum(self.manifest["parts"].values())
+        live = sum(r["n"] for r in self.manifest["files"].values())
+        return 1 - live / total if total else 0.0
+
+    def compact(self):
+        """把全部有效行重写为一个分片（按文件ID排序），删除旧分片。"""
+        import pyarrow as pa
+        if not self.manifest["files"]:
+            return
+        part = f"part-{self.manifest['next_part']:06d}.arrow"
+        self.manifest["next_part"] += 1
+        tmp = self.parts_dir / (part + ".tmp")
+        recs = sorted(self.manifest["files"].values(), key=lambda r: r["file_id"])
+        row = 0
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, store_schema()) as writer:
+            for r in recs:
+                writer.write_table(self._table(r["part"]).slice(r["row"], r["n"]))
+                r["part"], r["row"] = part, row
+                row += r["n"]
+        os.replace(tmp, self.parts_dir / part)
+        self.manifest["parts"][part] = row
+        self._tables.clear()
+        self._drop_dead_parts()
+
+    # ---------- 读取 ----------
+    def _table(self, part):
+        """mmap 打开分片（零拷贝）。"""
+        import pyarrow as pa
+        if part not in self._tables:
+            src = pa.memory_map(str(self.parts_dir / part), "r")
+            self._tables[part] = pa.ipc.open_file(src).read_all()
+        return self._tables[part]
+
+    def records(self, dirs=None):
+        """
+        有效文件记录 [(文件键 <目录名>/<文件名>, 记录), ...]。给定 dirs 时只返回这些目录下的文件，
+        按 (目录顺序, 文件名) 排序，与直接扫描 TXT 的顺序一致；否则按文件ID排序。
+        """
+        if dirs is None:
+            return sorted(self.manifest["files"].items(), key=lambda kv: kv[1]["file_id"])
+        rank = {str(Path(d).resolve()): i for i, d in enumerate(dirs)}
+        out = [(k, r) for k, r in self.manifest["files"].items() if r.get("dir") in rank]
+        return sorted(out, key=lambda kv: (rank[kv[1]["dir"]], kv[0]))
+
+    def slices(self, dirs=None, max_rows: int = 50000):
+        """把有效行按 records 的顺序划分为 (分片, 起始行, 行数) 区间：同一分片内连续存放的文件合并，每段不超过 max_rows 行。"""
+        out = []
+        for _, r in self.records(dirs):
+            if not r["n"]:
+                continue
+            if out and out[-1][0] == r["part"] and out[-1][1] + out[-1][2] == r["row"] \
+                    and out[-1][2] + r["n"] <= max_rows:
+                out[-1] = (r["part"], out[-1][1], out[-1][2] + r["n"])
+            else:
+                out.append((r["part"], r["row"], r["n"]))
+        return out
+
+    def read_slice(self, part, start, n, columns=None):
+        t = self._table(part).slice(start, n)
+        return t.select(columns) if columns else t
+
+    def iter_tables(self, dirs=None, columns=None, max_rows: int = 50000):
+        """按 records 的顺序逐段产出有效行（pyarrow.Table，零拷贝切片）。"""
+        for part, start, n in self.slices(dirs, max_rows):
+            yield self.read_slice(part, start, n, columns)
+
+    def table(self, dirs=None, columns=None):
+        import pyarrow as pa
+        tables = list(self.iter_tables(dirs, columns))
+        if not tables:
+            return store_schema().empty_table().select(columns) if columns else store_schema().empty_table()
+        return pa.concat_tables(tables)
+
+    def lookup(self, sent_ids):
+        """按句子ID取句子文本，返回与输入同序的列表（不存在的ID为 None）。"""
+        by_fid = {r["file_id"]: r for r in self.manifest["files"].values()}
+        mask = (1 << SENT_ID_SHIFT) - 1
+        out = []
+        for sid in sent_ids:
+            sid = int(sid)
+            r = by_fid.get(sid >> SENT_ID_SHIFT)
+            idx = sid & mask
+            if r is None or idx >= r["n"]:
+                out.append(None)
+            else:
+                out.append(self._table(r["part"]).column("句子")[r["row"] + idx].as_py())
+        return out
+
+    def stats(self):
+        return {"files": len(self.manifest["files"]),
+                "sentences": sum(r["n"] for r in self.manifest["files"].values()),
+                "parts": len(self.manifest["parts"]),
+                "dead_ratio": round(self.dead_ratio(), 4)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--store", default="sent_store", help="句子库目录")
+    ap.add_argument("--annual_dir", help="单个 MD&A TXT 目录（优先于 --base_dir/--years）")
+    ap.add_argument("--base_dir", default="data/output", help="包含各年度子目录的根目录")
+    ap.add_argument("--years", default="2024", help="年份或年份范围，如 2024 或 2014-2024")
+    ap.add_argument("--workers", type=int, default=1, help="分句进程数（1 为串行，0 为 CPU 核数-1）")
+    ap.add_argument("--compact", action="store_true", help="更新后强制压缩为单个分片")
+    ap.add_argument("--stats", action="store_true", help="只打印句子库统计")
+    args = ap.parse_args()
+
+    store = SentenceStore(args.store)
+    if args.stats:
+        print(json.dumps(store.stats(), ensure_ascii=False))
+        return
+    y0, y1 = parse_years(args.years)
+    dirs = [Path(args.annual_dir)] if args.annual_dir else iter_year_dirs(Path(args.base_dir), y0, y1)
+    if not dirs:
+        print(f"[ERR] 在 {args.annual_dir or args.base_dir} 下未找到目录。")
+        return
+    workers = args.workers if args.workers > 0 else max(1, (os.cpu_count() or 4) - 1)
+    t0 = time.time()
+    c = store.update(dirs, workers=workers)
+    if args.compact:
+        store.compact()
+        store.save_manifest()
+    print(f"[OK] 命中 {c['hit']}，新增 {c['miss']}，变化 {c['stale']}，移除 {c['removed']}，"
+          f"新分句 {c['sentences']} 句，耗时 {time.time() - t0:.1f}s")
+    print(f"[DONE] {json.dumps(store.stats(), ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()
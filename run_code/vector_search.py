@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+vector_search.py
+词向量近邻检索：
+- ExactSearch：把全部查询向量组成矩阵，与归一化词表分块做一次矩阵乘法，逐块合并 top-k，
+  不生成完整的 (查询数 × 词表大小) 得分矩阵；
+- IVFIndex：基于 k-means 倒排的近似检索索引（纯 NumPy），可保存到磁盘并以 mmap 加载，
+  供反复调参（--topn / --min_sim）时复用；recall_at_k 用于对照精确检索报告召回率。
+"""
+
+import os
+import numpy as np
+
+def unit_rows(M):
+    """按行归一化（float32），零向量保持为零。"""
+    M = np.asarray(M, dtype=np.float32)
+    n = np.linalg.norm(M, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return M / n
+
+def _merge_topk(best_s, best_i, S, offset, k):
+    """把一个分块的得分 S 并入当前 top-k（未排序）。"""
+    if S.shape[1] > k:
+        part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+        blk_s = np.take_along_axis(S, part, axis=1)
+        blk_i = part + offset
+    else:
+        blk_s = S
+        blk_i = np.broadcast_to(np.arange(S.shape[1]) + offset, S.shape)
+    cat_s = np.concatenate([best_s, blk_s], axis=1)
+    cat_i = np.concatenate([best_i, blk_i], axis=1)
+    if cat_s.shape[1] > k:
+        part = np.argpartition(-cat_s, k - 1, axis=1)[:, :k]
+        cat_s = np.take_along_axis(cat_s, part, axis=1)
+        cat_i = np.take_along_axis(cat_i, part, axis=1)
+    return cat_s, cat_i
+
+def _sorted_topk(best_s, best_i):
+    order = np.argsort(-best_s, axis=1, kind="stable")
+    return np.take_along_axis(best_i, order, axis=1), np.take_along_axis(best_s, order, axis=1)
+
+def _mask_excluded(S, exclude, lo, hi):
+    """把落在 [lo, hi) 内的排除项得分置为 -inf（exclude[i] 为第 i 个查询要排除的词表下标）。"""
+    if not exclude:
+        return
+    for qi, ex in enumerate(exclude):
+        for e in ex or ():
+            if lo <= e < hi:
+                S[qi, e - lo] = -np.inf
+
+class ExactSearch:
+    """精确余弦检索：词表按 block_rows 分块，每块与全部查询做一次矩阵乘法。"""
+
+    def __init__(self, vectors, norms=None, block_rows=65536):
+        self.vectors = vectors
+        self.norms = np.linalg.norm(vectors, axis=1) if norms is None else norms
+        self.block_rows = block_rows
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def search(self, Q, k, exclude=None):
+        """
+        Q: (m, d) 查询矩阵（内部会归一化）；返回 (下标 (m, k), 余弦相似度 (m, k))，按相似度降序。
+        exclude: 每个查询需要排除的词表下标列表（如查询词本身）。
+        """
+        Q = unit_rows(Q)
+        m, n = Q.shape[0], len(self)
+        k = min(k, n)
+        best_s = np.full((m, 0), -np.inf, dtype=np.float32)
+        best_i = np.zeros((m, 0), dtype=np.int64)
+        for lo in range(0, n, self.block_rows):
+            hi = min(n, lo + self.block_rows)
+            V = np.asarray(self.vectors[lo:hi], dtype=np.float32)
+            norms = np.asarray(self.norms[lo:hi], dtype=np.float32).copy()
+            norms[norms == 0] = 1.0
+            S = (Q @ V.T) / norms
+            _mask_excluded(S, exclude, lo, hi)
+            best_s, best_i = _merge_topk(best_s, best_i, S, lo, k)
+        return _sorted_topk(best_s, best_i)
+
+class IVFIndex:
+    """
+    倒排文件（IVF）近似检索：k-means 聚类中心作为粗量化器，查询只在最相近的 nprobe 个簇内精确打分。
+    磁盘格式为一个目录：centroids.npy / order.npy / offsets.npy / unit.npy / meta.npy
+    （meta = 词表签名 + 构建时的 nlist）。
+    """
+
+    def __init__(self, centroids, order, offsets, unit, meta):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.unit = unit
+        self.meta = meta
+
+    @staticmethod
+    def signature(vectors):
+        """词表签名（规模 + 抽样行的和），用于判断磁盘索引是否对应当前向量。"""
+        n, d = vectors.shape
+        probe = np.asarray(vectors[:: max(1, n // 64)][:64], dtype=np.float64)
+        return np.array([n, d, float(probe.sum())], dtype=np.float64)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, iters=10, sample=200000, seed=42, block_rows=65536, path=None):
+        """
+        训练并构建索引。给定 path 时，按簇重排后的归一化向量直接写入磁盘（open_memmap），
+        构建过程不在内存中持有完整的向量副本。
+        """
+        n = vectors.shape[0]
+        nlist = nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        # 在抽样上训练球面 k-means
+        train = unit_rows(vectors[np.sort(rng.choice(n, size=min(n, sample), replace=False))])
+        centroids = train[rng.choice(len(train), size=min(nlist, len(train)), replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = train[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = unit_rows(centroids)
+        # 全量分配，按簇排序得到倒排表
+        assign = np.empty(n, dtype=np.int32)
+        for lo in range(0, n, block_rows):
+            assign[lo:lo + block_rows] = np.argmax(unit_rows(vectors[lo:lo + block_rows]) @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1)).astype(np.int64)
+        if path:
+            os.makedirs(path, exist_ok=True)
+            unit = np.lib.format.open_memmap(os.path.join(path, "unit.npy"), mode="w+",
+                                             dtype=np.float32, shape=vectors.shape)
+        else:
+            unit = np.empty(vectors.shape, dtype=np.float32)
+        for lo in range(0, n, block_rows):
+            unit[lo:lo + block_rows] = unit_rows(vectors[order[lo:lo + block_rows]])
+        idx = cls(centroids, order, offsets, unit, np.append(cls.signature(vectors), nlist))
+        if path:
+            unit.flush()
+            idx.save(path)
+        return idx
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "order", "offsets", "unit", "meta"):
+            if name == "unit" and isinstance(self.unit, np.memmap) and \
+                    os.path.abspath(self.unit.filename) == os.path.abspath(os.path.join(path, "unit.npy")):
+                continue  # 构建时已直接写入
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mode = "r" if mmap else None
+        arrs = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+                for name in ("centroids", "order", "offsets", "unit", "meta")]
+        return cls(*arrs)
+
+    @classmethod
+    def load_or_build(cls, path, vectors, nlist=None):
+        """磁盘上有匹配当前向量（且 nlist 与指定值相同）的索引则直接加载，否则重建并保存。"""
+        if path and os.path.exists(os.path.join(path, "meta.npy")):
+            idx = cls.load(path)
+            sig = cls.signature(vectors)
+            if idx.meta.shape[0] >= len(sig) and np.allclose(idx.meta[:len(sig)], sig) and \
+                    (not nlist or idx.nlist == nlist):
+                return idx, False
+        return cls.build(vectors, nlist=nlist, path=path), True
+
+    @property
+    def nlist(self):
+        """构建时的 nlist；旧版索引的 meta 中没有记录，取聚类中心数。"""
+        n_sig = 3   # signature() 的长度
+        return int(self.meta[n_sig]) if self.meta.shape[0] > n_sig else len(self.centroids)
+
+    def search(self, Q, k, nprobe=8, exclude=None):
+        """近似检索，返回值与 ExactSearch.search 相同。"""
+        Q = unit_rows(Q)
+        m = Q.shape[0]
+        k = min(k, len(self.order))
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(Q @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        out_i = np.zeros((m, k), dtype=np.int64)
+        out_s = np.full((m, k), -np.inf, dtype=np.float32)
+        for qi in range(m):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[qi]])
+            if not len(rows):
+                continue
+            s = np.asarray(self.unit[rows], dtype=np.float32) @ Q[qi]
+            ids = np.asarray(self.order[rows])
+            if exclude and exclude[qi]:
+                s[np.isin(ids, list(exclude[qi]))] = -np.inf
+            kk = min(k, len(s))
+            top = np.argpartition(-s, kk - 1)[:kk]
+            top = top[np.argsort(-s[top], kind="stable")]
+            out_i[qi, :kk], out_s[qi, :kk] = ids[top], s[top]
+        return out_i, out_s
+
+def recall_at_k(exact_idx, approx_idx):
+    """近似结果相对精确结果的平均 recall@k。"""
+    hits = [len(set(a) & set(e)) / max(len(e), 1) for e, a in zip(exact_idx.tolist(), approx_idx.tolist())]
+    return float(np.mean(hits)) if hits else 1.0